@@ -1,89 +1,570 @@
+import logging
+import queue
 import requests
+import requests.adapters
+import random
+import threading
 import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from Instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill)*self.rate)
+                self.last_refill = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens)/self.rate
+            time.sleep(wait)
 
 class BoardGameGeekAPI:
     API_URL = "https://www.boardgamegeek.com/xmlapi2/"
+    BATCH_SIZE = 20 # Largest number of ids Board Game Geek accepts in a single thing query
+    MAX_BATCH_ATTEMPTS = 3
+    MAX_WORKERS = 4
+    REQUESTS_PER_SECOND = 2
+    RETRY_DELAY = 5
+    MAX_RETRY_DELAY = 60
+    POOL_SIZE = 10
+    CHUNK_SIZE = 16*1024 # Bytes fed to the streaming parser at a time
+    QUEUE_SIZE = 64 # Parsed items waiting to be consumed
+    PUT_TIMEOUT = 0.1 # Seconds a worker waits on a full queue before checking whether its consumer is gone
+    TIMEOUT = 30 # Seconds to wait for connecting and for each read
 
-    def __init__(self, bgg_username): 
+    def __init__(self, bgg_username=None, api_url=API_URL, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS,
+                 requests_per_second=REQUESTS_PER_SECOND, retry_delay=RETRY_DELAY, pool_size=POOL_SIZE, 
+                 timeout=TIMEOUT, cache=None, queue_size=QUEUE_SIZE, cache_only=False): 
         self.username = bgg_username
+        self.cache = cache
+        self.cache_only = cache_only # Never goes to the network, stale responses are used as they are
+        self.queue_size = queue_size
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.timeout = timeout
         
-    def query_bgg(self, type_string, params):
-        query_result = requests.get(self.API_URL + type_string, params=params)
+        # One keep-alive session for all queries, including retries. Workers block on the pool 
+        # instead of opening throwaway connections when it is smaller than max_workers
+        self.adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
         
-        while query_result.status_code == 202:
-            timeout = 5
-            print("Code 202: Board Game Geek has queued your request. Trying again in " + str(timeout) + " seconds.")
-            time.sleep(timeout)
-            query_result = requests.get(self.API_URL + type_string, params=params)
-                    
-        while query_result.status_code == 429:
-            timeout = 5
-            print("Code 429: Board Game Geek asks you too slow down. Trying again in " + str(timeout) + " seconds.")
-            time.sleep(timeout)
-            query_result = requests.get(self.API_URL + type_string, params=params)
-                    
+        self.stats_lock = threading.Lock()
+        self.bytes_transferred = 0
+        self.bytes_decoded = 0
+        
+        # All workers share one rate limiter, so adding workers never raises the request rate
+        self.rate_limiter = TokenBucket(requests_per_second, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.streams = set() # Cancel events of the streams being consumed, see start_stream
+        
+    def close(self):
+        # Streams still open are cancelled first. A consumer that raised may not have closed its generator yet,
+        # and the workers feeding it would otherwise wait on the full queue forever
+        with self.stats_lock:
+            for cancelled in self.streams:
+                cancelled.set()
+        self.executor.shutdown(cancel_futures=True)
+        self.session.close()
+        
+    def get(self, type_string, params, headers=None, stream=False):
+        with metrics.timer('wait_rate_limit'):
+            self.rate_limiter.acquire()
+        with metrics.timer('request'):
+            query_result = self.session.get(self.api_url + type_string, params=params, headers=headers, 
+                                            timeout=self.timeout, stream=stream)
+        metrics.count('status_' + str(query_result.status_code))
+        
+        # Streamed bodies are counted by iter_xml_items once consumed
+        if not stream:
+            self.count_bytes(query_result.raw.tell(), len(query_result.content))
+        return query_result
+    
+    def count_bytes(self, bytes_transferred, bytes_decoded):
+        with self.stats_lock:
+            self.bytes_transferred += bytes_transferred # Body bytes as received, before decompression
+            self.bytes_decoded += bytes_decoded
+        metrics.count('bytes_transferred', bytes_transferred)
+        metrics.count('bytes_decoded', bytes_decoded)
+    
+    def connection_stats(self):
+        connections_opened = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            connections_opened += pool.num_connections
+            requests_sent += pool.num_requests
+        
+        with self.stats_lock:
+            return {
+                'requests': requests_sent,
+                'connections_opened': connections_opened,
+                'connections_reused': requests_sent - connections_opened,
+                'bytes_transferred': self.bytes_transferred,
+                'bytes_decoded': self.bytes_decoded,
+            }
+    
+    def backoff_delay(self, attempt):
+        # Exponential backoff with full jitter, so throttled workers don't retry in lockstep
+        delay = min(self.MAX_RETRY_DELAY, self.retry_delay * 2**attempt)
+        return random.uniform(delay/2, delay)
+        
+    def cached_response(self, body):
+        query_result = requests.Response()
+        query_result.status_code = 200
+        query_result.encoding = 'utf-8'
+        query_result._content = body
+        query_result._content_consumed = True # Lets iter_content serve the body like a streamed one
+        return query_result
+        
+    def query_bgg(self, type_string, params, use_cache=True, stream=False, revalidate=False):
+        # revalidate asks the server even for a fresh cache entry, with a conditional request
+        with metrics.timer('query_bgg'):
+            return self.query_bgg_uninstrumented(type_string, params, use_cache, stream, revalidate)
+        
+    def query_bgg_uninstrumented(self, type_string, params, use_cache, stream, revalidate=False):
+        headers = dict()
+        cached = None
+        if self.cache_only:
+            cached = self.cache.lookup(type_string, params) if self.cache else None
+            if cached is None:
+                raise RuntimeError('No cached response for ' + type_string + ' ' + str(params))
+            return self.cached_response(cached['body'])
+        
+        if self.cache and use_cache:
+            cached = self.cache.lookup(type_string, params)
+            if cached and cached['fresh'] and not revalidate:
+                metrics.count('cache_hits')
+                return self.cached_response(cached['body'])
+            
+            # A stale entry is revalidated instead of downloaded again when the server gave validators
+            if cached and cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached and cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        query_result = self.get(type_string, params, headers, stream)
+        
+        # BGG may queue a request and then throttle the retry or vice versa, so both are handled in one loop
+        throttled_attempt = 0
+        while query_result.status_code in (202, 429):
+            if query_result.status_code == 202:
+                timeout = self.retry_delay
+                wait_timer = 'wait_queued'
+                logger.warning('Code 202: Board Game Geek has queued your request. Trying again in %s seconds.', timeout)
+            else:
+                timeout = self.backoff_delay(throttled_attempt)
+                throttled_attempt += 1
+                wait_timer = 'wait_throttled'
+                logger.warning('Code 429: Board Game Geek asks you too slow down. Trying again in %.1f seconds.', timeout)
+            query_result.close() # Hands the connection back to the pool when the body was not read
+            with metrics.timer(wait_timer):
+                time.sleep(timeout)
+            query_result = self.get(type_string, params, headers, stream)
+        
+        if cached and query_result.status_code == 304:
+            metrics.count('cache_revalidated')
+            self.cache.refresh(type_string, params)
+            return self.cached_response(cached['body'])
+        
+        if self.cache and use_cache and not stream and query_result.status_code == 200:
+            self.cache.put(type_string, params, query_result.content, 
+                           query_result.headers.get('ETag'), query_result.headers.get('Last-Modified'))
         return query_result
 
-    def query_bgg_collection(self):
-        print('Querying collection from BoardGameGeek for user ' + self.username)
+    def collection_params(self, username):
         params_base = {
-            'username': self.username,
+            'username': username,
             'subtype': 'boardgame',
             'excludesubtype': 'boardgameexpansion',
             'own': 1,
             'stats': 1,
         }   
-    
-        query_result = self.query_bgg('collection', params_base)
-                    
-        base_game_items = ET.fromstring(query_result.text)
         
         params_expansion = {
-            'username': self.username,
+            'username': username,
             'subtype': 'boardgameexpansion',
             'own': 1,
             'stats': 1,
         }
-
-        query_result = self.query_bgg('collection', params_expansion)
-                    
-        expansion_items = ET.fromstring(query_result.text)
+        return params_base, params_expansion
+    
+    def query_bgg_collection(self, username=None, revalidate=False):
+        username = username or self.username
+        return self.query_bgg_collections([username], revalidate)[username]
+    
+    def query_bgg_collections(self, usernames, revalidate=False):
+        logger.info('Querying collection from BoardGameGeek for user %s', ', '.join(usernames))
         
-        xml_collection = {
-                'base_game_items' : base_game_items,
-                'expansion_items' : expansion_items,
-        }
+        # Base games and expansions of every user are queried at the same time
+        queries = dict()
+        for username in usernames:
+            params_base, params_expansion = self.collection_params(username)
+            queries[username] = (self.executor.submit(self.query_bgg, 'collection', params_base, revalidate=revalidate),
+                                 self.executor.submit(self.query_bgg, 'collection', params_expansion, 
+                                                      revalidate=revalidate))
+        
+        xml_collections = dict()
+        for username in usernames:
+            base_game_query, expansion_query = queries[username]
+            xml_collections[username] = {
+                    'base_game_items' : ET.fromstring(base_game_query.result().text),
+                    'expansion_items' : ET.fromstring(expansion_query.result().text),
+            }
         
-        return xml_collection
+        if self.cache and not self.cache_only:
+            self.cache.save()
+        return xml_collections
     
-    def query_bgg_id(self, game_id):
-        param = {
+    def thing_params(self, game_id):
+        return {
                 'id': game_id,
                 'stats': 1,
-                 }   
-        query_result = self.query_bgg('thing', param)
-        print('\t' + game_id + ': Returned status code ' + str(query_result.status_code))
+                }
+    
+    def query_bgg_id(self, game_id):
+        query_result = self.query_bgg('thing', self.thing_params(game_id))
+        logger.debug('%s: Returned status code %s', game_id, query_result.status_code)
+        return query_result
+    
+    def query_bgg_batch(self, game_ids):
+        # Batch responses are cached per id in query_bgg_batches, as batches differ between runs
+        query_result = self.query_bgg('thing', self.thing_params(','.join(game_ids)), use_cache=False)
+        logger.debug('%s: Returned status code %s', ', '.join(game_ids), query_result.status_code)
         return query_result
+    
+    def iter_xml_items(self, query_result, chunks=None):
+        # Feeds the body to the parser as it arrives and yields every top level item once it is complete. 
+        # Yielded items are detached from the root, so nothing is kept alive once the consumer is done with them
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        depth = 0
+        bytes_decoded = 0
+        parse_seconds = 0.0 # Only the parser's share, the download and the consumer are left out
+        n_items = 0
+        
+        for chunk in query_result.iter_content(self.CHUNK_SIZE):
+            bytes_decoded += len(chunk)
+            if chunks is not None:
+                chunks.append(chunk) # Kept for the cache by callers that want the whole body
+            start = time.perf_counter()
+            parser.feed(chunk)
+            parse_seconds += time.perf_counter() - start
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if root is None:
+                        root = element
+                    continue
+                
+                depth -= 1
+                if depth == 1 and element.tag == 'item':
+                    root.remove(element)
+                    n_items += 1
+                    yield element
+        parser.close()
+        
+        metrics.add_time('parse_xml', parse_seconds, n_items)
+        if query_result.raw is not None:
+            self.count_bytes(query_result.raw.tell(), bytes_decoded)
+    
+    def start_stream(self):
+        # Workers of a stream check the returned event while waiting on the queue, it is set once nobody reads it
+        cancelled = threading.Event()
+        with self.stats_lock:
+            self.streams.add(cancelled)
+        return cancelled
+    
+    def stop_stream(self, event_queue, futures, cancelled):
+        # Run when a stream is done or its consumer went away, e.g. because parsing an item raised. Queries not
+        # started yet are dropped and the queue is drained, so blocked workers get out right away
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+        while True:
+            try:
+                event_queue.get_nowait()
+            except queue.Empty:
+                break
+        with self.stats_lock:
+            self.streams.discard(cancelled)
+    
+    def put_event(self, event_queue, event, cancelled):
+        # Returns False instead of blocking for good when the stream was cancelled
+        while not cancelled.is_set():
+            try:
+                event_queue.put(event, timeout=self.PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def stream_bgg_batch(self, game_ids, item_queue, cancelled):
+        try:
+            query_result = self.query_bgg('thing', self.thing_params(','.join(game_ids)), use_cache=False, stream=True)
+            logger.debug('%s: Returned status code %s', ', '.join(game_ids), query_result.status_code)
+            for item in self.iter_xml_items(query_result):
+                if not self.put_event(item_queue, item, cancelled):
+                    query_result.close()
+                    return
+        finally:
+            self.put_event(item_queue, None, cancelled) # Marks the batch as finished, also when the query failed
+    
+    def iter_bgg_ids(self, game_ids):
+        # Streaming counterpart of query_bgg_ids. Yields (game_id, item) pairs for base games and expansions in 
+        # the order they are parsed, instead of holding every response tree until all batches are done
+        game_ids = game_ids['base_game_ids'] + game_ids['expansion_ids']
+        returned_ids = set()
+        
+        if self.cache:
+            for game_id in game_ids:
+                item = self.cached_item(game_id)
+                if item is not None:
+                    returned_ids.add(game_id)
+                    yield game_id, item
+            logger.info('%s of %s ids loaded from cache', len(returned_ids), len(game_ids))
+        missing_ids = [game_id for game_id in game_ids if game_id not in returned_ids]
+        
+        for attempt in range(self.MAX_BATCH_ATTEMPTS):
+            if not missing_ids or self.cache_only:
+                break
+            
+            # Workers parse their responses concurrently, the bounded queue keeps them at most QUEUE_SIZE items ahead
+            item_queue = queue.Queue(self.queue_size)
+            cancelled = self.start_stream()
+            futures = []
+            try:
+                batches = [missing_ids[start:start+self.batch_size] for start in range(0, len(missing_ids), self.batch_size)]
+                futures = [self.executor.submit(self.stream_bgg_batch, batch_ids, item_queue, cancelled) 
+                           for batch_ids in batches]
+                
+                finished_batches = 0
+                while finished_batches < len(batches):
+                    item = item_queue.get()
+                    if item is None:
+                        finished_batches += 1
+                        continue
+                    
+                    game_id = item.attrib['id']
+                    returned_ids.add(game_id)
+                    self.cache_item(game_id, item)
+                    yield game_id, item
+                
+                for future in futures:
+                    future.result()
+            finally:
+                self.stop_stream(item_queue, futures, cancelled)
+            
+            # Only the ids left out of a partial response are queried again
+            missing_ids = [game_id for game_id in game_ids if game_id not in returned_ids]
+            if missing_ids:
+                logger.warning('Missing from response, trying again: %s', ', '.join(missing_ids))
+            
+        for game_id in missing_ids:
+            logger.warning('%s: Not returned by Board Game Geek, skipping', game_id)
+            
+        if self.cache and not self.cache_only:
+            self.cache.save()
+    
+    def cached_item(self, game_id):
+        if not self.cache:
+            return None
+        body = self.cached_body('thing', self.thing_params(game_id))
+        if body is None:
+            return None
+        with metrics.timer('parse_xml'):
+            return ET.fromstring(body)[0]
+        
+    def cache_item(self, game_id, item):
+        if self.cache:
+            xml_item = ET.Element('items')
+            xml_item.append(item)
+            self.cache.put('thing', self.thing_params(game_id), ET.tostring(xml_item))
+    
+    def stream_bgg_collection(self, params, subtype, event_queue, cancelled):
+        try:
+            query_result = self.query_bgg('collection', params, stream=True)
+            
+            # Streamed responses bypass the cache in query_bgg, so the body is collected while it is parsed
+            chunks = None
+            if self.cache and query_result.raw is not None and query_result.status_code == 200:
+                chunks = []
+            # Ids are handed over a batch at a time, which keeps the queue traffic low on long listings
+            game_ids = []
+            for item in self.iter_xml_items(query_result, chunks):
+                game_ids.append(item.attrib['objectid'])
+                if len(game_ids) == self.batch_size:
+                    if not self.put_event(event_queue, (subtype, game_ids), cancelled):
+                        query_result.close()
+                        return
+                    game_ids = []
+            if game_ids and not self.put_event(event_queue, (subtype, game_ids), cancelled):
+                return
+            if chunks is not None:
+                self.cache.put('collection', params, b''.join(chunks), 
+                               query_result.headers.get('ETag'), query_result.headers.get('Last-Modified'))
+        finally:
+            self.put_event(event_queue, (None, None), cancelled) # Marks the listing as finished, also when the query failed
+    
+    def iter_collection_games(self, username=None, skip_ids=()):
+        # Streams the base game and expansion listings in parallel and fetches the details of listed games as soon 
+        # as a batch is full, while the listings are still arriving. Yields (subtype, game_id, None) for every listed 
+        # game and later ('thing', game_id, item) once its details are parsed. Ids in skip_ids are only listed
+        username = username or self.username
+        logger.info('Streaming collection from BoardGameGeek for user %s', username)
+        
+        # Listing workers put (subtype, game_ids) tuples, batch workers put items like in iter_bgg_ids
+        event_queue = queue.Queue(self.queue_size)
+        cancelled = self.start_stream()
+        params_base, params_expansion = self.collection_params(username)
+        futures = []
+        queried_ids = []
+        returned_ids = set()
+        try:
+            futures.append(self.executor.submit(self.stream_bgg_collection, params_base, 'boardgame', event_queue, 
+                                                cancelled))
+            futures.append(self.executor.submit(self.stream_bgg_collection, params_expansion, 'boardgameexpansion', 
+                                                event_queue, cancelled))
+            
+            running_listings = len(futures)
+            running_batches = 0
+            batch_ids = []
+            while running_listings or running_batches:
+                event = event_queue.get()
+                if event is None:
+                    running_batches -= 1
+                    continue
+                
+                if isinstance(event, tuple):
+                    subtype, game_ids = event
+                    if subtype is None:
+                        running_listings -= 1
+                        game_ids = []
+                        
+                    for game_id in game_ids:
+                        yield subtype, game_id, None
+                        if game_id in skip_ids:
+                            continue
+                        item = self.cached_item(game_id)
+                        if item is not None:
+                            yield 'thing', game_id, item
+                        elif self.cache_only:
+                            logger.warning('%s: Not in the cache, skipping', game_id)
+                        else:
+                            batch_ids.append(game_id)
+                            queried_ids.append(game_id)
+                        
+                        if len(batch_ids) == self.batch_size:
+                            futures.append(self.executor.submit(self.stream_bgg_batch, batch_ids, event_queue, cancelled))
+                            running_batches += 1
+                            batch_ids = []
+                            
+                    if batch_ids and not running_listings:
+                        futures.append(self.executor.submit(self.stream_bgg_batch, batch_ids, event_queue, cancelled))
+                        running_batches += 1
+                        batch_ids = []
+                    continue
+                
+                game_id = event.attrib['id']
+                returned_ids.add(game_id)
+                self.cache_item(game_id, event)
+                yield 'thing', game_id, event
+                
+            for future in futures:
+                future.result()
+        finally:
+            # Also run when the consumer raised or stopped iterating, which would leave the workers blocked
+            self.stop_stream(event_queue, futures, cancelled)
+        
+        # Ids left out of a partial response go through the usual retries
+        missing_ids = [game_id for game_id in queried_ids if game_id not in returned_ids]
+        if missing_ids:
+            logger.warning('Missing from response, trying again: %s', ', '.join(missing_ids))
+            for game_id, item in self.iter_bgg_ids({'base_game_ids': missing_ids, 'expansion_ids': []}):
+                yield 'thing', game_id, item
+        elif self.cache and not self.cache_only:
+            self.cache.save()
+    
+    def cached_body(self, type_string, params):
+        if self.cache_only:
+            cached = self.cache.lookup(type_string, params)
+            return cached['body'] if cached else None
+        return self.cache.get_fresh(type_string, params)
+    
+    def split_items(self, items):
+        # Wraps every item in its own copy of the root, so each entry looks like a single id response
+        xml_items = dict()
+        for item in items.findall('item'):
+            xml_item = ET.Element(items.tag, items.attrib)
+            xml_item.append(item)
+            xml_items[item.attrib['id']] = xml_item
+        return xml_items
+    
+    def query_bgg_batches(self, game_ids):
+        xml_items = dict()
+        if self.cache:
+            for game_id in game_ids:
+                body = self.cached_body('thing', self.thing_params(game_id))
+                if body:
+                    xml_items[game_id] = ET.fromstring(body)
+            logger.info('%s of %s ids loaded from cache', len(xml_items), len(game_ids))
+        missing_ids = [game_id for game_id in game_ids if game_id not in xml_items]
+        
+        for attempt in range(self.MAX_BATCH_ATTEMPTS):
+            if not missing_ids or self.cache_only:
+                break
+            batches = [missing_ids[start:start+self.batch_size] for start in range(0, len(missing_ids), self.batch_size)]
+            for query_result in self.executor.map(self.query_bgg_batch, batches):
+                with metrics.timer('parse_xml_batch'):
+                    batch_items = self.split_items(ET.fromstring(query_result.text))
+                xml_items.update(batch_items)
+                if self.cache:
+                    for game_id in batch_items:
+                        self.cache.put('thing', self.thing_params(game_id), ET.tostring(batch_items[game_id]))
+            
+            # Only the ids left out of a partial response are queried again
+            missing_ids = [game_id for game_id in game_ids if game_id not in xml_items]
+            if missing_ids:
+                logger.warning('Missing from response, trying again: %s', ', '.join(missing_ids))
+            
+        for game_id in missing_ids:
+            logger.warning('%s: Not returned by Board Game Geek, skipping', game_id)
+        
+        return xml_items
         
     def query_bgg_ids(self, game_ids):
-        print('Querying base games:')
-        xml_base_games = dict()
-        for game_id in game_ids['base_game_ids']:  
-            query_result = self.query_bgg_id(game_id)
-            base_game_item = ET.fromstring(query_result.text)
-            xml_base_games[game_id] = base_game_item
-        
-        print('Querying expansions:')
-        xml_expansions = dict()
-        for game_id in game_ids['expansion_ids']:
-            query_result = self.query_bgg_id(game_id)
-            expansion_item = ET.fromstring(query_result.text)
-            xml_expansions[game_id] = expansion_item
+        logger.info('Querying base games and expansions')
+        
+        # Base game and expansion batches share the worker pool, so the two overlap
+        xml_items = self.query_bgg_batches(game_ids['base_game_ids'] + game_ids['expansion_ids'])
+        
+        xml_base_games = {game_id: xml_items[game_id] for game_id in game_ids['base_game_ids'] if game_id in xml_items}
+        xml_expansions = {game_id: xml_items[game_id] for game_id in game_ids['expansion_ids'] if game_id in xml_items}
         
         xml_games = {
             'xml_base_games' : xml_base_games,
             'xml_expansions' : xml_expansions,
         }
+        
+        if self.cache and not self.cache_only:
+            self.cache.save()
         return xml_games
-    
\ No newline at end of file
+    
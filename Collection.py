@@ -1,59 +1,169 @@
-import pickle
+import logging
+import sys
+import types
+from CollectionIndex import CollectionIndex
+from Instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+def extract_item_fields(xml_item):
+    # Walks the item once and dispatches on tag, instead of running one descendant search per field. 
+    # The first match of each field wins, as it did with find('.//...')
+    fields = {
+        'title': None,
+        'min_players': None,
+        'max_players': None,
+        'playing_time': None,
+        'bgg_rank': None,
+        'player_count_votes': [], # (numplayers, {result value: votes}) per row, None when nobody has voted
+        'base_game_links': [],
+    }
+    poll_name = None
+    
+    for element in xml_item.iter():
+        tag = element.tag
+        if tag == 'result':
+            continue # Read together with their results row
+        
+        elif tag == 'results':
+            if poll_name == 'suggested_numplayers':
+                votes = None
+                if len(element):
+                    votes = {result.get('value'): int(result.get('numvotes')) for result in element}
+                fields['player_count_votes'].append((element.get('numplayers'), votes))
+        
+        elif tag == 'poll':
+            poll_name = element.get('name')
+            
+        elif tag == 'link':
+            if element.get('type') == 'boardgameexpansion' and element.get('inbound') == 'true':
+                fields['base_game_links'].append(element.get('id'))
+                
+        elif tag == 'name':
+            if fields['title'] is None and element.get('type') == 'primary':
+                fields['title'] = element.get('value')
+                
+        elif tag == 'minplayers':
+            if fields['min_players'] is None:
+                fields['min_players'] = int(element.get('value'))
+                
+        elif tag == 'maxplayers':
+            if fields['max_players'] is None:
+                fields['max_players'] = int(element.get('value'))
+                
+        elif tag == 'playingtime':
+            if fields['playing_time'] is None:
+                fields['playing_time'] = int(element.get('value'))
+                
+        elif tag == 'rank':
+            if fields['bgg_rank'] is None and element.get('friendlyname') == 'Board Game Rank':
+                fields['bgg_rank'] = element.get('value')
+                
+    return fields
+
+def player_count_mask(player_counts):
+    mask = 0
+    for player_count in player_counts:
+        mask |= 1 << player_count
+    return mask
+
+def player_counts_from_mask(mask):
+    player_counts = []
+    player_count = 0
+    while mask:
+        if mask & 1:
+            player_counts.append(player_count)
+        mask >>= 1
+        player_count += 1
+    return player_counts
+
+def encode_player_count_votes(player_count_votes):
+    # The suggested_numplayers poll as kept with each game, e.g. '1:0/2/25;2:14/20/1;3+:' for best/recommended/not 
+    # recommended votes per row, and nothing after the colon for rows without results. Keeps the votes around so
+    # the player counts can be recomputed under another rule without parsing the XML again, see PollAnalysis
+    rows = []
+    for player_count, results in player_count_votes:
+        if results:
+            rows.append(player_count + ':' + str(results['Best']) + '/' + str(results['Recommended']) + '/' 
+                        + str(results['Not Recommended']))
+        else:
+            rows.append(player_count + ':')
+    return ';'.join(rows)
 
 class BoardGame:
     NO_VALUE = 1000000 # Ensures the appropriate field will be sorted last
     
+    # Slots instead of a per-instance dict, and player counts as bitmasks instead of lists, 
+    # as the models dominate memory when many collections are loaded at once
+    __slots__ = ('title', 'bgg_id', 'min_players', 'max_players', 'playing_time', 
+                 'optimal_player_mask', 'recommended_player_mask', 'player_count_votes')
+    
     def __init__(self, bgg_id):
         self.title = ''
-        self.bgg_id = bgg_id  
+        self.bgg_id = sys.intern(bgg_id)
         self.min_players = 0
         self.max_players = 0
         self.playing_time = 0
-        self.optimal_player_count = []
-        self.recommended_player_count = []
+        self.optimal_player_mask = 0
+        self.recommended_player_mask = 0
+        self.player_count_votes = ''
         
     def __repr__(self):
         return self.title + ' (' + self.bgg_id + ')'
     
+    @property
+    def optimal_player_count(self):
+        return player_counts_from_mask(self.optimal_player_mask)
+    
+    @optimal_player_count.setter
+    def optimal_player_count(self, player_counts):
+        self.optimal_player_mask = player_count_mask(player_counts)
+        
+    @property
+    def recommended_player_count(self):
+        return player_counts_from_mask(self.recommended_player_mask)
+    
+    @recommended_player_count.setter
+    def recommended_player_count(self, player_counts):
+        self.recommended_player_mask = player_count_mask(player_counts)
+    
     def set_title(self, raw_title):
-        self.title = raw_title.replace('–','-') # Replace non-UTF-8 dash character 
+        # Interned, so games shared between collections share one copy of the title 
+        self.title = sys.intern(raw_title.replace('–','-')) # Replace non-UTF-8 dash character 
     
     def get_latex_string(self, *args):
-        info_string = ''
-        info_string_part = ''
+        info_string_parts = []
         
         for arg in args:  
             if arg == 'BGG Rank':
                 if self.bgg_rank == self.NO_VALUE:
-                    info_string_part = ' & -'
+                    info_string_parts.append(' & -')
                 else:
-                    info_string_part = ' & ' + str(self.bgg_rank)
+                    info_string_parts.append(' & ' + str(self.bgg_rank))
             
             elif arg == 'Playing Time':
                 if self.playing_time == self.NO_VALUE:
-                    info_string_part = ' & -'
+                    info_string_parts.append(' & -')
                 else:
-                    info_string_part = ' & ' + str(self.playing_time)
+                    info_string_parts.append(' & ' + str(self.playing_time))
         
             elif arg == '':
-                info_string_part = ' & '
-            else:
-                info_string_part = ''
-            
-            info_string = info_string + info_string_part
+                info_string_parts.append(' & ')
         
 #        line_string = '\\hdashline[0.5pt/5pt]'
-        suffix = '\\\\\n'# + line_string
-        return info_string + suffix
+        info_string_parts.append('\\\\\n')# + line_string
+        return ''.join(info_string_parts)
     
     def add_info_from_xml(self, xml_item):
-        title = xml_item.find('.//name[@type="primary"]').get('value')
-        self.set_title(title)
+        self.add_info_from_fields(extract_item_fields(xml_item))
+        
+    def add_info_from_fields(self, fields):
+        self.set_title(fields['title'])
         
         # Statistics
-        min_players = int(xml_item.find('.//minplayers').get('value'))
-        max_players = int(xml_item.find('.//maxplayers').get('value'))
-        playing_time = int(xml_item.find('.//playingtime').get('value'))
+        min_players = fields['min_players']
+        max_players = fields['max_players']
+        playing_time = fields['playing_time']
         if playing_time == 0:
             playing_time = self.NO_VALUE
         
@@ -62,36 +172,61 @@ class BoardGame:
         self.playing_time = playing_time
         
         # Determining best and recommended players
-        poll = xml_item.find('.//poll[@name="suggested_numplayers"]')
-        
-        for results in poll:
-            if results.getchildren():
-                player_count = results.attrib['numplayers']
-                
+        self.player_count_votes = encode_player_count_votes(fields['player_count_votes'])
+        for player_count, results in fields['player_count_votes']:
+            if results:
                 if player_count.isdigit(): # Ignores entries with '4+', '7+', etc
                     player_count = int(player_count)
                     
                     votes = dict()
-                    votes['optimal'] = int(results.find('./result[@value="Best"]').get('numvotes'))
-                    votes['recommended'] = int(results.find('./result[@value="Recommended"]').get('numvotes'))
-                    votes['not_recommended'] = int(results.find('./result[@value="Not Recommended"]').get('numvotes'))
+                    votes['optimal'] = results['Best']
+                    votes['recommended'] = results['Recommended']
+                    votes['not_recommended'] = results['Not Recommended']
                               
                     winner = max(votes, key=votes.get)
                     
                     if(winner == 'optimal'):
-                        self.optimal_player_count.append(player_count)
+                        self.optimal_player_mask |= 1 << player_count
                     elif(winner == 'recommended'):
-                        self.recommended_player_count.append(player_count)
+                        self.recommended_player_mask |= 1 << player_count
             else:
                 # Users haven't voted on player count
                 self.recommended_player_count = list(range(int(min_players), int(max_players)+1))
+                
+    def add_info_from_record(self, record):
+        self.set_title(record['title'])
+        self.min_players = record['min_players']
+        self.max_players = record['max_players']
+        self.playing_time = record['playing_time']
+        self.optimal_player_count = record['optimal_player_count']
+        self.recommended_player_count = record['recommended_player_count']
+        self.player_count_votes = record['player_count_votes']
+        
+    def get_record(self):
+        record = {
+            'bgg_id': self.bgg_id,
+            'title': self.title,
+            'min_players': self.min_players,
+            'max_players': self.max_players,
+            'playing_time': self.playing_time,
+            'bgg_rank': None,
+            'optimal_player_count': self.optimal_player_count,
+            'recommended_player_count': self.recommended_player_count,
+            'player_count_votes': self.player_count_votes,
+            'base_game_links': [],
+        }
+        return record
         
 
 class BaseGame(BoardGame):
+    NO_EXPANSIONS = types.MappingProxyType(dict()) # Shared by all base games until they get an expansion
+    
+    __slots__ = ('bgg_rank', 'expansions')
+    
     def __init__(self, bgg_id):
         BoardGame.__init__(self, bgg_id)
         self.bgg_rank = self.NO_VALUE
-        self.expansions = dict()
+        self.expansions = self.NO_EXPANSIONS
         
     def __repr__(self):
         summary = BoardGame.__repr__(self)
@@ -113,22 +248,45 @@ class BaseGame(BoardGame):
 
         return title + info_string
     
-    def add_info_from_xml(self, xml_item):
-        BoardGame.add_info_from_xml(self, xml_item)
-        rank_string = xml_item.find('.//rank[@friendlyname="Board Game Rank"]').get('value')
+    def add_info_from_fields(self, fields):
+        BoardGame.add_info_from_fields(self, fields)
+        rank_string = fields['bgg_rank']
         if rank_string.isdigit():
             self.bgg_rank = int(rank_string)
         else:
             self.bgg_rank = self.NO_VALUE
 
+    def add_info_from_record(self, record):
+        BoardGame.add_info_from_record(self, record)
+        self.bgg_rank = record['bgg_rank']
+        
+    def get_record(self):
+        record = BoardGame.get_record(self)
+        record['type'] = 'boardgame'
+        record['bgg_rank'] = self.bgg_rank
+        return record
+
     def add_expansion(self, expansion):
+        if self.expansions is self.NO_EXPANSIONS:
+            self.expansions = dict()
         self.expansions[expansion.bgg_id] = expansion
     
 class Expansion(BoardGame):
+    __slots__ = ('short_title', 'latex_short_title', 'base_game_ids', 'base_game_links')
+    
     def __init__(self, bgg_id):
         BoardGame.__init__(self, bgg_id)
         self.short_title = self.title
-        self.base_game_id = None
+        self.latex_short_title = ''
+        self.base_game_ids = () # Owned base games it is listed under, in the order BGG links them
+        self.base_game_links = ()
+        
+    @property
+    def base_game_id(self):
+        # The first owned base game, which the short title is relative to
+        if self.base_game_ids:
+            return self.base_game_ids[0]
+        return None
         
     def get_latex_title(self):
         return self.short_title.replace('&', '\&')   
@@ -141,17 +299,32 @@ class Expansion(BoardGame):
 
         return prefix + info_string
     
-    def add_info_from_xml(self, xml_item, base_game_ids):
-        BoardGame.add_info_from_xml(self, xml_item)
+    def add_info_from_xml(self, xml_item, base_game_ids=()):
+        fields = extract_item_fields(xml_item)
+        BoardGame.add_info_from_fields(self, fields)
         
-        links = xml_item.findall('.//link[@type="boardgameexpansion"][@inbound="true"]')
-        for link in links:
-            base_game_id = link.attrib['id']
+        self.base_game_links = tuple(fields['base_game_links'])
+        for base_game_id in self.base_game_links:
             if base_game_id in base_game_ids:
                 return base_game_id
         return None
+    
+    def add_info_from_record(self, record, base_game_ids=()):
+        BoardGame.add_info_from_record(self, record)
+        self.base_game_links = tuple(record['base_game_links'])
+        for base_game_id in self.base_game_links:
+            if base_game_id in base_game_ids:
+                return base_game_id
+        return None
+    
+    def get_record(self):
+        record = BoardGame.get_record(self)
+        record['type'] = 'boardgameexpansion'
+        record['base_game_links'] = self.base_game_links
+        return record
         
     def set_short_title(self, base_game_title):
+        self.short_title = self.title
         length_shared_title = 0
         for char_self, char_base in zip(self.title, base_game_title):
             if(char_self==char_base):
@@ -164,11 +337,16 @@ class Expansion(BoardGame):
         self.latex_short_title = '\\quad\\textit{' + self.short_title.replace('&', '\&') + '}'
         
 class Collection:
+    STORE_CHUNK_SIZE = 500 # Stored games loaded per query while streaming
+    
     def __init__(self):
         self.base_games = dict()
         self.expansions = dict()
         self.player_counts = dict()
-        self.xml_games_filename = 'xml_games.pkl'
+        self.expansion_links = dict()
+        self.sort_keys = dict(CollectionIndex.SORT_KEYS)
+        self.index = None # Built on the first query, dropped whenever the games or player counts change
+        self.poll_analysis = None # Vote matrix of apply_player_count_rule, kept while the games stay the same
         
     def __repr__(self):
         summary= ''
@@ -177,6 +355,7 @@ class Collection:
         return summary
         
     def parse_xml_collection(self, xml_collection):
+        self.index = None
         base_game_ids = []
         for item in xml_collection['base_game_items']:
             bgg_id = item.attrib['objectid']
@@ -200,39 +379,291 @@ class Collection:
         
         return game_ids
     
-    def export_xml_games(self, xml_games):
-        xml_games_file = open(self.xml_games_filename, "wb")
-        pickle.dump(xml_games, xml_games_file)
-        xml_games_file.close()
+    def sync_xml_collection(self, xml_collection):
+        # Diffs a freshly queried collection against the loaded state. Only added games are returned 
+        # for querying, removed games are dropped together with their player counts
+        self.index = None
+        fresh_base_game_ids = [item.attrib['objectid'] for item in xml_collection['base_game_items']]
+        fresh_expansion_ids = [item.attrib['objectid'] for item in xml_collection['expansion_items']]
+        
+        for bgg_id in set(self.expansions) - set(fresh_expansion_ids):
+            self.remove_expansion(bgg_id)
+        for bgg_id in set(self.base_games) - set(fresh_base_game_ids):
+            self.remove_base_game(bgg_id)
+            
+        # Expansions already in the collection are linked to added base games once those are parsed. Added games
+        # take their place in the listing, which expansions are linked in
+        base_game_ids = [bgg_id for bgg_id in fresh_base_game_ids if bgg_id not in self.base_games]
+        expansion_ids = [bgg_id for bgg_id in fresh_expansion_ids if bgg_id not in self.expansions]
+        self.base_games = {bgg_id: self.base_games[bgg_id] if bgg_id in self.base_games else BaseGame(bgg_id) 
+                           for bgg_id in fresh_base_game_ids}
+        self.expansions = {bgg_id: self.expansions[bgg_id] if bgg_id in self.expansions else Expansion(bgg_id) 
+                           for bgg_id in fresh_expansion_ids}
+                
+        logger.info('Synchronized collection: %s base games and %s expansions to query', len(base_game_ids), 
+                    len(expansion_ids))
+                
+        game_ids = {
+                'base_game_ids': base_game_ids,
+                'expansion_ids': expansion_ids,
+                }
+        
+        return game_ids
+    
+    def remove_base_game(self, bgg_id):
+        self.index = None
+        for player_count in list(self.player_counts):
+            for player_type in ['optimal', 'recommended']:
+                self.player_counts[player_count][player_type].pop(bgg_id, None)
+        self.remove_empty_player_counts()
+        
+        for expansion in self.base_games[bgg_id].expansions.values():
+            expansion.base_game_ids = tuple(base_game_id for base_game_id in expansion.base_game_ids if base_game_id != bgg_id)
+            if expansion.base_game_ids:
+                expansion.set_short_title(self.base_games[expansion.base_game_ids[0]].title)
+        del self.base_games[bgg_id]
+        
+    def remove_expansion(self, bgg_id):
+        self.index = None
+        expansion = self.expansions[bgg_id]
+        for base_game_id in expansion.base_game_ids:
+            self.remove_player_counts_expansion(bgg_id, base_game_id)
+            del self.base_games[base_game_id].expansions[bgg_id]
+        self.remove_empty_player_counts()
         
-    def import_xml_games(self):
-        xml_games_file = open(self.xml_games_filename, "rb")
-        xml_games = pickle.load(xml_games_file)
-        self.parse_xml_games(xml_games)
+        for base_game_id in expansion.base_game_links:
+            del self.expansion_links[base_game_id][bgg_id]
+        del self.expansions[bgg_id]
+        
+    def remove_player_counts_expansion(self, bgg_id, base_game_id):
+        expansion = self.expansions[bgg_id]
+        player_counts = {
+                'optimal': expansion.optimal_player_count,
+                'recommended': expansion.recommended_player_count,
+                }
+        for player_type in player_counts:
+            for player_count in player_counts[player_type]:
+                if player_count not in self.player_counts:
+                    continue
+                entries = self.player_counts[player_count][player_type]
+                entry = entries.get(base_game_id)
+                if entry is None:
+                    continue
+                if bgg_id in entry['expansions']:
+                    entry['expansions'].remove(bgg_id)
+                if entry['need_expansion'] and not entry['expansions']:
+                    del entries[base_game_id]
+        
+    def remove_empty_player_counts(self):
+        for player_count in list(self.player_counts):
+            if not self.player_counts[player_count]['optimal'] and not self.player_counts[player_count]['recommended']:
+                del self.player_counts[player_count]
+    
+    def save_state(self, store, skip_ids=()):
+        self.export_games(store, skip_ids)
+        store.put_collection_items(list(self.base_games), list(self.expansions))
+        
+    def load_state(self, store, fresh_only=False):
+        game_ids = store.get_collection_items()
+        if not game_ids['base_game_ids'] and not game_ids['expansion_ids']:
+            return False
+        
+        # Games missing from the store, or stale with fresh_only, are left out, so the next sync treats them as added
+        missing_game_ids = self.import_games(store, game_ids, fresh_only)
+        for bgg_id in missing_game_ids['base_game_ids']:
+            del self.base_games[bgg_id]
+        for bgg_id in missing_game_ids['expansion_ids']:
+            del self.expansions[bgg_id]
+        return True
+    
+    def export_games(self, store, skip_ids=()):
+        # Games in skip_ids were loaded from the store, writing them back would mark them as freshly fetched
+        store.put_games([game.get_record() for game in list(self.base_games.values()) + list(self.expansions.values())
+                         if game.bgg_id not in skip_ids])
+        
+    def import_games(self, store, game_ids, fresh_only=False):
+        # Loads the games found in the store without parsing any XML. Returns the ids left to query, which with 
+        # fresh_only include the stale games
+        records = store.get_games(game_ids['base_game_ids'] + game_ids['expansion_ids'], fresh_only)
+        
+        base_game_ids = []
+        for bgg_id in game_ids['base_game_ids']:
+            self.base_games[bgg_id] = BaseGame(bgg_id)
+            if bgg_id in records:
+                self.base_games[bgg_id].add_info_from_record(records[bgg_id])
+                self.update_player_counts_base_game(bgg_id)
+            else:
+                base_game_ids.append(bgg_id)
+        
+        expansion_ids = []
+        imported_expansion_ids = []
+        for bgg_id in game_ids['expansion_ids']:
+            self.expansions[bgg_id] = Expansion(bgg_id)
+            if bgg_id in records:
+                self.expansions[bgg_id].add_info_from_record(records[bgg_id])
+                self.add_expansion_links(bgg_id)
+                imported_expansion_ids.append(bgg_id)
+            else:
+                expansion_ids.append(bgg_id)
+                
+        # Base games left to query are linked once parsed, their player counts are needed for the comparison
+        self.link_expansions(imported_expansion_ids, unparsed_base_game_ids=set(base_game_ids))
+        
+        logger.info('Loaded %s games from the store', len(records))
+        
+        game_ids = {
+                'base_game_ids': base_game_ids,
+                'expansion_ids': expansion_ids,
+                }
+        
+        return game_ids
         
     def parse_xml_games(self, xml_games):
-        print('Parsing base games:')
+        logger.info('Parsing base games')
         for bgg_id in xml_games['xml_base_games']:
             item = xml_games['xml_base_games'][bgg_id][0]
-            self.base_games[bgg_id].add_info_from_xml(item)
+            with metrics.timer('add_info_from_xml'):
+                self.base_games[bgg_id].add_info_from_xml(item)
             self.update_player_counts_base_game(bgg_id)
-            print("\t" + self.base_games[bgg_id].title + ' (' + bgg_id + ')')
+            logger.debug('%s (%s)', self.base_games[bgg_id].title, bgg_id)
         
-        print('Parsing expansions:')
+        logger.info('Parsing expansions')
         for bgg_id in xml_games['xml_expansions']:
             item = xml_games['xml_expansions'][bgg_id][0]
-            base_game_id = self.expansions[bgg_id].add_info_from_xml(item, list(self.base_games))
-            print("\t" + self.expansions[bgg_id].title + ' (' + bgg_id + ')')
+            with metrics.timer('add_info_from_xml'):
+                self.expansions[bgg_id].add_info_from_xml(item)
+            self.add_expansion_links(bgg_id)
+            logger.debug('%s (%s)', self.expansions[bgg_id].title, bgg_id)
             
-            # Add expansion to base game 
-            if base_game_id:
-                self.base_games[base_game_id].add_expansion(self.expansions[bgg_id])
-                self.expansions[bgg_id].base_game_id = base_game_id
-                self.expansions[bgg_id].set_short_title(self.base_games[base_game_id].title)
+        # Add expansions to base games
+        self.link_expansions(xml_games['xml_expansions'], xml_games['xml_base_games'])
+            
+    def parse_xml_items(self, xml_items):
+        # Consumes (bgg_id, item) pairs as they arrive, for instance from BoardGameGeekAPI.iter_bgg_ids. The 
+        # fields are extracted right away so the items can be discarded
+        logger.info('Parsing base games and expansions')
+        base_game_ids = []
+        expansion_ids = []
+        for bgg_id, item in xml_items:
+            if bgg_id in self.base_games:
+                with metrics.timer('add_info_from_xml'):
+                    self.base_games[bgg_id].add_info_from_xml(item)
+                self.update_player_counts_base_game(bgg_id)
+                base_game_ids.append(bgg_id)
+            else:
+                with metrics.timer('add_info_from_xml'):
+                    self.expansions[bgg_id].add_info_from_xml(item)
+                self.add_expansion_links(bgg_id)
+                expansion_ids.append(bgg_id)
+        
+        with metrics.timer('link_expansions'):
+            self.link_expansions(expansion_ids, base_game_ids)
+        
+    def parse_xml_stream(self, events, store=None, stored_ids=()):
+        # Consumes the events of BoardGameGeekAPI.iter_collection_games, building the collection while the listings 
+        # are still arriving. Games in stored_ids are loaded from the store, which the API skipped fetching. Listed 
+        # games that were neither stored nor returned are left out
+        self.index = None
+        logger.info('Parsing base games and expansions')
+        base_game_ids = []
+        expansion_ids = []
+        listed_ids = [] # Stored games waiting to be loaded, a chunk at a time
+        for event_type, bgg_id, item in events:
+            if event_type in ('boardgame', 'boardgameexpansion'):
+                if event_type == 'boardgame':
+                    self.base_games[bgg_id] = BaseGame(bgg_id)
+                else:
+                    self.expansions[bgg_id] = Expansion(bgg_id)
+                if bgg_id in stored_ids:
+                    listed_ids.append(bgg_id)
+                if len(listed_ids) == self.STORE_CHUNK_SIZE:
+                    self.add_records(store.get_games(listed_ids), base_game_ids, expansion_ids)
+                    listed_ids = []
+                    
+            elif bgg_id in self.base_games:
+                with metrics.timer('add_info_from_xml'):
+                    self.base_games[bgg_id].add_info_from_xml(item)
+                self.update_player_counts_base_game(bgg_id)
+                base_game_ids.append(bgg_id)
                 
-            self.update_player_counts_expansion(bgg_id)
+            else:
+                with metrics.timer('add_info_from_xml'):
+                    self.expansions[bgg_id].add_info_from_xml(item)
+                self.add_expansion_links(bgg_id)
+                expansion_ids.append(bgg_id)
+        self.add_records(store.get_games(listed_ids) if listed_ids else {}, base_game_ids, expansion_ids)
+        
+        for bgg_id in set(self.base_games) - set(base_game_ids):
+            del self.base_games[bgg_id]
+        for bgg_id in set(self.expansions) - set(expansion_ids):
+            del self.expansions[bgg_id]
+        
+        with metrics.timer('link_expansions'):
+            self.link_expansions(expansion_ids, base_game_ids)
+        
+    def add_records(self, records, base_game_ids, expansion_ids):
+        for bgg_id in records:
+            if bgg_id in self.base_games:
+                self.base_games[bgg_id].add_info_from_record(records[bgg_id])
+                self.update_player_counts_base_game(bgg_id)
+                base_game_ids.append(bgg_id)
+            else:
+                self.expansions[bgg_id].add_info_from_record(records[bgg_id])
+                self.add_expansion_links(bgg_id)
+                expansion_ids.append(bgg_id)
+        
+    def add_expansion_links(self, bgg_id):
+        # Reverse index from base game to the expansions linking to it, owned or not
+        for base_game_id in self.expansions[bgg_id].base_game_links:
+            if base_game_id not in self.expansion_links:
+                self.expansion_links[base_game_id] = dict() # Used as an ordered set
+            self.expansion_links[base_game_id][bgg_id] = None
+            
+    def link_expansions(self, expansion_ids=(), base_game_ids=(), unparsed_base_game_ids=()):
+        # Linking stage, run once base games and expansions are parsed, since an expansion's player counts are 
+        # compared against its base game. Attaches the given expansions to every owned base game they link to,
+        # and the expansions already in the collection to the given base games. Every lookup is hashed, so the
+        # stage is linear in the number of links
+        expansion_ids = dict.fromkeys(expansion_ids)
+        for base_game_id in base_game_ids:
+            expansion_ids.update(self.expansion_links.get(base_game_id, {}))
+        
+        # Expansions are attached in collection listing order, not in the order their responses arrived in, so 
+        # the output is the same between runs and whether games were fetched or loaded from the store
+        positions = {bgg_id: position for position, bgg_id in enumerate(self.expansions)}
+        unordered_base_game_ids = set() # Base games given an expansion listed before one they already had
+        for bgg_id in sorted(expansion_ids, key=positions.__getitem__):
+            expansion = self.expansions[bgg_id]
+            linked_ids = [base_game_id for base_game_id in expansion.base_game_links 
+                          if base_game_id in self.base_games and base_game_id not in unparsed_base_game_ids]
+            
+            for base_game_id in linked_ids:
+                if base_game_id not in expansion.base_game_ids:
+                    base_game = self.base_games[base_game_id]
+                    if base_game.expansions and positions[next(reversed(base_game.expansions))] > positions[bgg_id]:
+                        unordered_base_game_ids.add(base_game_id)
+                    base_game.add_expansion(expansion)
+                    self.update_player_counts_expansion(bgg_id, base_game_id)
+                    
+            expansion.base_game_ids = tuple(linked_ids)
+            if linked_ids:
+                expansion.set_short_title(self.base_games[linked_ids[0]].title)
+        
+        for base_game_id in unordered_base_game_ids:
+            self.sort_expansions(base_game_id, positions)
+            
+    def sort_expansions(self, base_game_id, positions):
+        # Restores listing order after linking expansions to a base game in several passes, e.g. stored ones first
+        base_game = self.base_games[base_game_id]
+        base_game.expansions = {bgg_id: base_game.expansions[bgg_id] 
+                                for bgg_id in sorted(base_game.expansions, key=positions.__getitem__)}
+        for player_count in self.player_counts.values():
+            for entries in (player_count['optimal'], player_count['recommended']):
+                if base_game_id in entries:
+                    entries[base_game_id]['expansions'].sort(key=positions.__getitem__)
         
     def update_player_counts_base_game(self, bgg_id):
+        self.index = None
         base_game = self.base_games[bgg_id]
         
         optimal_player_count = base_game.optimal_player_count
@@ -248,9 +679,9 @@ class Collection:
                 self.player_counts[player_count] = {'optimal': dict(), 'recommended': dict()}
             self.player_counts[player_count]['recommended'][bgg_id] = {'need_expansion': False, 'expansions': []}
           
-    def update_player_counts_expansion(self, bgg_id):
+    def update_player_counts_expansion(self, bgg_id, base_game_id):
+        self.index = None
         expansion = self.expansions[bgg_id]
-        base_game = self.base_games[expansion.base_game_id]
         
         optimal_player_count = expansion.optimal_player_count
         recommended_player_count = expansion.recommended_player_count
@@ -258,24 +689,86 @@ class Collection:
         for player_count in optimal_player_count:
             if not self.player_counts.get(player_count):
                     self.player_counts[player_count] = {'optimal': dict(), 'recommended': dict()}
-            if player_count not in base_game.optimal_player_count:
-                self.player_counts[player_count]['optimal'][base_game.bgg_id] = {'need_expansion': True, 'expansions': [bgg_id]}
-            else:
-                self.player_counts[player_count]['optimal'][base_game.bgg_id]['expansions'].append(bgg_id)
+            if base_game_id not in self.player_counts[player_count]['optimal']:
+                self.player_counts[player_count]['optimal'][base_game_id] = {'need_expansion': True, 'expansions': []}
+            self.player_counts[player_count]['optimal'][base_game_id]['expansions'].append(bgg_id)
             
         for player_count in recommended_player_count:
             if not self.player_counts.get(player_count):
                     self.player_counts[player_count] = {'optimal': dict(), 'recommended': dict()}
-            if player_count not in base_game.recommended_player_count:
-                self.player_counts[player_count]['recommended'][base_game.bgg_id] = {'need_expansion': True, 'expansions': [bgg_id]}
-            else:
-                self.player_counts[player_count]['recommended'][base_game.bgg_id]['expansions'].append(bgg_id)
+            if base_game_id not in self.player_counts[player_count]['recommended']:
+                self.player_counts[player_count]['recommended'][base_game_id] = {'need_expansion': True, 'expansions': []}
+            self.player_counts[player_count]['recommended'][base_game_id]['expansions'].append(bgg_id)
+    
+    def get_poll_analysis(self, include_plus_buckets=False):
+        # Base games first, so they come before their expansions in every player count column
+        games = list(self.base_games.values()) + list(self.expansions.values())
+        analysis = self.poll_analysis
+        if (analysis is None or analysis.include_plus_buckets != include_plus_buckets 
+                or analysis.bgg_ids != [game.bgg_id for game in games]):
+            from PollAnalysis import PollAnalysis # NumPy is only needed here
+            with metrics.timer('poll_analysis'):
+                analysis = self.poll_analysis = PollAnalysis(games, include_plus_buckets)
+        return analysis
+    
+    def apply_player_count_rule(self, rule='plurality', include_plus_buckets=False, **options):
+        # Recomputes the best and recommended player counts of every game from the stored poll votes, see 
+        # PollAnalysis.winners for the rules and their options, and rebuilds the player counts in one pass
+        self.index = None
+        analysis = self.get_poll_analysis(include_plus_buckets)
+        n_base_games = len(self.base_games)
+        games = list(self.base_games.values()) + list(self.expansions.values())
+        
+        with metrics.timer('player_count_rule'):
+            optimal_counts, recommended_counts, whole_range = analysis.winners(rule, **options)
+            for game, optimal_mask, recommended_mask in zip(games, analysis.masks(optimal_counts), 
+                                                            analysis.masks(recommended_counts, whole_range)):
+                game.optimal_player_mask = optimal_mask
+                game.recommended_player_mask = recommended_mask
+            
+            self.player_counts = dict()
+            for player_type, player_counts, player_range in [('optimal', optimal_counts, None), 
+                                                             ('recommended', recommended_counts, whole_range)]:
+                for player_count, game_indexes in analysis.games_by_player_count(player_counts, player_range).items():
+                    if player_count not in self.player_counts:
+                        self.player_counts[player_count] = {'optimal': dict(), 'recommended': dict()}
+                    entries = self.player_counts[player_count][player_type]
+                    
+                    # Same entries as update_player_counts_base_game and update_player_counts_expansion
+                    for game_index in game_indexes:
+                        game = games[game_index]
+                        if game_index < n_base_games:
+                            entries[game.bgg_id] = {'need_expansion': False, 'expansions': []}
+                            continue
+                        for base_game_id in game.base_game_ids:
+                            if base_game_id not in entries:
+                                entries[base_game_id] = {'need_expansion': True, 'expansions': []}
+                            entries[base_game_id]['expansions'].append(game.bgg_id)
+    
+    def get_index(self):
+        if self.index is None:
+            self.index = CollectionIndex(self)
+        return self.index
+    
+    def query(self, **filters):
+        # Filtered and sorted base game ids, e.g. query(player_count=4, max_playing_time=60, max_bgg_rank=500, 
+        # sort_by='bgg_rank'). See CollectionIndex.query for the supported filters
+        return self.get_index().query(**filters)
+                
+    def add_sort_key(self, key, sort_key):
+        # sort_key maps a BaseGame to a comparable value, for instance lambda base_game: base_game.max_players
+        self.sort_keys[key] = sort_key
+        if self.index:
+            self.index.forget_sort_key(key)
+            
+    def ids_sorted_by(self, base_game_ids, key):
+        return self.get_index().sort_ids(base_game_ids, key)
                 
     def ids_sorted_by_title(self, base_game_ids):
-        return sorted(base_game_ids, key=lambda base_game_id: self.base_games[base_game_id].title)
+        return self.ids_sorted_by(base_game_ids, 'title')
     
     def ids_sorted_by_playing_time(self, base_game_ids):
-        return sorted(base_game_ids, key=lambda base_game_id: (self.base_games[base_game_id].playing_time, self.base_games[base_game_id].title))
+        return self.ids_sorted_by(base_game_ids, 'playing_time')
     
     def ids_sorted_by_bgg_rank(self, base_game_ids):
-        return sorted(base_game_ids, key=lambda base_game_id: (self.base_games[base_game_id].bgg_rank, self.base_games[base_game_id].title))
\ No newline at end of file
+        return self.ids_sorted_by(base_game_ids, 'bgg_rank')
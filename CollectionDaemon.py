@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Collection import Collection
+from Instrumentation import metrics
+from LatexHandler import LatexHandler
+from Pipeline import EXPORTERS
+
+logger = logging.getLogger(__name__)
+
+class CollectionDaemon:
+    # Long running mode: the collections of its users stay parsed in memory, BGG is polled for changes with
+    # conditional requests and only the sections showing changed games are rendered again. A local HTTP endpoint
+    # regenerates on demand and reports how long regenerations take:
+    #   POST /regenerate?user=name  polls and regenerates one user, or every user without the parameter
+    #   GET /status                 last result per user and the run's timers and counters
+    POLL_INTERVAL = 15*60 # Seconds between polls of all collections
+    HOST = '127.0.0.1'
+    PORT = 8765
+
+    def __init__(self, api, store, latex_path, latex_filename, usernames, formats=('tex',), compile_pdf=False,
+                 compile_workers=None, player_count_rule=None, poll_interval=POLL_INTERVAL, host=HOST, port=PORT):
+        self.api = api
+        self.store = store
+        self.latex_path = latex_path
+        self.latex_filename = latex_filename
+        self.usernames = usernames
+        self.formats = list(formats)
+        self.compile_pdf = compile_pdf
+        self.compile_workers = compile_workers
+        self.player_count_rule = player_count_rule
+        self.poll_interval = poll_interval
+
+        self.collections = dict()
+        self.latex_handlers = dict() # Kept per user, they hold the rendered sections
+        self.results = dict()
+        self.lock = threading.Lock() # One regeneration at a time, as the store and the API client are shared. The
+                                     # store has to be opened with check_same_thread=False
+        self.stopped = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.thread = None
+
+    def get_user_path(self, username):
+        if len(self.usernames) == 1:
+            return self.latex_path
+        return self.latex_path + username + '/'
+
+    def fetch_games(self, collection, game_ids):
+        # Fresh games in the store are loaded from it, the others are fetched and stored. Games BGG did not return are
+        # left out, like in a pipeline run
+        missing_game_ids = collection.import_games(self.store, game_ids, fresh_only=True)
+        imported_base_game_ids = [bgg_id for bgg_id in game_ids['base_game_ids']
+                                  if bgg_id not in missing_game_ids['base_game_ids']]
+        collection.link_expansions(base_game_ids=imported_base_game_ids,
+                                   unparsed_base_game_ids=set(missing_game_ids['base_game_ids']))
+
+        fetched_ids = []
+        collection.parse_xml_items(self.iter_fetched(missing_game_ids, fetched_ids))
+        self.store.put_games([collection.base_games[bgg_id].get_record() if bgg_id in collection.base_games
+                              else collection.expansions[bgg_id].get_record() for bgg_id in fetched_ids])
+
+        fetched_ids = set(fetched_ids)
+        for bgg_id in missing_game_ids['expansion_ids']:
+            if bgg_id not in fetched_ids:
+                collection.remove_expansion(bgg_id)
+        for bgg_id in missing_game_ids['base_game_ids']:
+            if bgg_id not in fetched_ids:
+                collection.remove_base_game(bgg_id)
+
+    def iter_fetched(self, game_ids, fetched_ids):
+        for bgg_id, item in self.api.iter_bgg_ids(game_ids):
+            fetched_ids.append(bgg_id)
+            yield bgg_id, item
+
+    def get_affected_sections(self, collection, base_game_ids, expansion_ids):
+        # Player counts and history pages that show any of the games. The expansions of a base game are included,
+        # as their short titles depend on the base games they are listed under
+        player_counts = set()
+        affected_base_game_ids = set()
+        expansion_ids = list(expansion_ids)
+        for bgg_id in base_game_ids:
+            base_game = collection.base_games[bgg_id]
+            player_counts.update(base_game.optimal_player_count + base_game.recommended_player_count)
+            affected_base_game_ids.add(bgg_id)
+            expansion_ids.extend(base_game.expansions)
+        for bgg_id in expansion_ids:
+            expansion = collection.expansions[bgg_id]
+            player_counts.update(expansion.optimal_player_count + expansion.recommended_player_count)
+            affected_base_game_ids.update(expansion.base_game_ids)
+        return player_counts, affected_base_game_ids
+
+    def update_collection(self, username):
+        # Returns the sections to render again, or None when the whole document has to be rendered
+        xml_collection = self.api.query_bgg_collection(username, revalidate=True)
+        collection = self.collections.get(username)
+        if collection is None:
+            collection = self.collections[username] = Collection()
+            self.fetch_games(collection, collection.parse_xml_collection(xml_collection))
+            return None, len(collection.base_games) + len(collection.expansions), 0
+
+        # Sections of removed games are found before the games are gone
+        fresh_ids = {item.attrib['objectid'] for item in xml_collection['base_game_items']}
+        fresh_ids.update(item.attrib['objectid'] for item in xml_collection['expansion_items'])
+        removed_base_game_ids = [bgg_id for bgg_id in collection.base_games if bgg_id not in fresh_ids]
+        removed_expansion_ids = [bgg_id for bgg_id in collection.expansions if bgg_id not in fresh_ids]
+        player_counts, base_game_ids = self.get_affected_sections(collection, removed_base_game_ids,
+                                                                  removed_expansion_ids)
+
+        game_ids = collection.sync_xml_collection(xml_collection)
+        if game_ids['base_game_ids'] or game_ids['expansion_ids']:
+            self.fetch_games(collection, game_ids)
+        added_player_counts, added_base_game_ids = self.get_affected_sections(
+                collection, [bgg_id for bgg_id in game_ids['base_game_ids'] if bgg_id in collection.base_games],
+                [bgg_id for bgg_id in game_ids['expansion_ids'] if bgg_id in collection.expansions])
+        player_counts.update(added_player_counts)
+        base_game_ids.update(added_base_game_ids)
+
+        n_added = len(game_ids['base_game_ids']) + len(game_ids['expansion_ids'])
+        n_removed = len(removed_base_game_ids) + len(removed_expansion_ids)
+        return (player_counts, base_game_ids), n_added, n_removed
+
+    def regenerate(self, username):
+        with self.lock, metrics.timer('regenerate'):
+            try:
+                return self.regenerate_unlocked(username)
+            except Exception:
+                # A failed poll may leave the collection synchronized with games that were never fetched, or the
+                # document half rendered, and the next poll would see no difference. The collection is dropped with
+                # its sections instead, so the next poll rebuilds it from the store and renders it whole
+                self.collections.pop(username, None)
+                self.latex_handlers.pop(username, None)
+                raise
+
+    def regenerate_unlocked(self, username):
+        start = time.perf_counter()
+        sections, n_added, n_removed = self.update_collection(username)
+        collection = self.collections[username]
+        if self.player_count_rule and (sections is None or n_added or n_removed):
+            # The rule changes player counts of other games too
+            collection.apply_player_count_rule(self.player_count_rule)
+            sections = None
+
+        user_path = self.get_user_path(username)
+        os.makedirs(user_path, exist_ok=True)
+        latex = self.latex_handlers.get(username)
+        if sections is None or latex is None:
+            latex = self.latex_handlers[username] = LatexHandler(collection, user_path, self.latex_filename,
+                                                                 max_workers=self.compile_workers, keep_sections=True)
+        else:
+            latex.forget_sections(*sections)
+
+        changed = sections is None or n_added or n_removed
+        if changed:
+            for output_format in self.formats:
+                if output_format == 'tex':
+                    latex.export()
+                else:
+                    exporter_class = EXPORTERS[output_format]
+                    exporter_class(collection, user_path, os.path.splitext(self.latex_filename)[0]
+                                   + exporter_class.EXTENSION).export()
+            if self.compile_pdf:
+                latex.build_pdf()
+
+        self.results[username] = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds': round(time.perf_counter() - start, 6),
+            'added': n_added,
+            'removed': n_removed,
+            'rendered': bool(changed),
+            'base_games': len(collection.base_games),
+            'expansions': len(collection.expansions),
+        }
+        logger.info('Regenerated collection of user %s in %.3f s: %s games added, %s removed', username,
+                    self.results[username]['seconds'], n_added, n_removed)
+        return self.results[username]
+
+    def regenerate_all(self):
+        results = dict()
+        for username in self.usernames:
+            try:
+                results[username] = self.regenerate(username)
+            except Exception as error: # One failing user must not stop the others
+                logger.error('Regenerating the collection of user %s failed: %s', username, error)
+                results[username] = {'error': str(error)}
+        return results
+
+    def status(self):
+        return {
+            'users': self.usernames,
+            'poll_interval': self.poll_interval,
+            'results': self.results,
+            'metrics': metrics.summary(),
+        }
+
+    def handler_class(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send_json(self, status_code, content):
+                body = json.dumps(content, indent=1).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urllib.parse.urlparse(self.path).path == '/status':
+                    self.send_json(200, daemon.status())
+                else:
+                    self.send_json(404, {'error': 'Unknown path'})
+
+            def do_POST(self):
+                url = urllib.parse.urlparse(self.path)
+                if url.path != '/regenerate':
+                    self.send_json(404, {'error': 'Unknown path'})
+                    return
+                username = dict(urllib.parse.parse_qsl(url.query)).get('user')
+                if username is None:
+                    self.send_json(200, daemon.regenerate_all())
+                elif username not in daemon.usernames:
+                    self.send_json(404, {'error': 'Unknown user ' + username})
+                else:
+                    try:
+                        self.send_json(200, {username: daemon.regenerate(username)})
+                    except Exception as error:
+                        logger.error('Regenerating the collection of user %s failed: %s', username, error)
+                        self.send_json(500, {'error': str(error)})
+
+            def log_message(self, format, *args):
+                logger.debug('%s - ' + format, self.address_string(), *args)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('Listening on http://%s:%s/', *self.server.server_address[:2])
+        return 'http://' + self.server.server_address[0] + ':' + str(self.server.server_address[1]) + '/'
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None: # shutdown waits for serve_forever, which never ran otherwise
+            self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self):
+        # Polls every collection on a schedule until stopped, requests arrive in between
+        self.start()
+        try:
+            while not self.stopped.is_set():
+                self.regenerate_all()
+                self.stopped.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info('Stopping')
+        finally:
+            if not self.stopped.is_set():
+                self.stop()
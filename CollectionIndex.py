@@ -0,0 +1,130 @@
+from bisect import bisect_left, bisect_right
+
+def mask_from_positions(positions, size):
+    # Builds the bitset through a digit string, which is linear where repeated |= on a growing int is not
+    digits = bytearray(b'0'*size)
+    for position in positions:
+        digits[size - 1 - position] = ord('1')
+    return int(digits, 2) if size else 0
+
+def positions_from_mask(mask):
+    digits = bin(mask)[:1:-1] # Least significant bit first
+    positions = []
+    position = digits.find('1')
+    while position != -1:
+        positions.append(position)
+        position = digits.find('1', position + 1)
+    return positions
+
+class RangeIndex:
+    # Answers value <= x and value >= x with a binary search plus precomputed prefix bitsets, 
+    # so only the tail of at most step positions is turned into bits per query
+    MAX_PREFIXES = 256
+    
+    def __init__(self, values, order, size):
+        self.values = values # Ascending, values[i] belongs to the game at position order[i]
+        self.order = order
+        self.size = size
+        self.step = max(64, size//self.MAX_PREFIXES + 1)
+        self.prefixes = [0]
+        mask = 0
+        for start in range(0, size, self.step):
+            mask |= mask_from_positions(order[start:start+self.step], size)
+            self.prefixes.append(mask)
+            
+    def first_mask(self, count):
+        block = count//self.step
+        return self.prefixes[block] | mask_from_positions(self.order[block*self.step:count], self.size)
+    
+    def at_most(self, value):
+        return self.first_mask(bisect_right(self.values, value))
+    
+    def at_least(self, value):
+        return ((1 << self.size) - 1) & ~self.first_mask(bisect_left(self.values, value))
+
+class CollectionIndex:
+    # Read-only indexes over the base games of a collection. Every base game gets a position in title order,
+    # filters are bitsets over those positions and sort orders are integer ranks, computed once per sort key
+    SORT_KEYS = {
+        'title': lambda base_game: base_game.title,
+        'playing_time': lambda base_game: (base_game.playing_time, base_game.title),
+        'bgg_rank': lambda base_game: (base_game.bgg_rank, base_game.title),
+    }
+    
+    def __init__(self, collection):
+        self.base_games = collection.base_games
+        self.sort_keys = collection.sort_keys
+        self.base_game_ids = sorted(self.base_games, key=lambda base_game_id: self.base_games[base_game_id].title)
+        self.positions = {base_game_id: position for position, base_game_id in enumerate(self.base_game_ids)}
+        self.size = len(self.base_game_ids)
+        
+        self.player_masks = {'optimal': dict(), 'recommended': dict()}
+        for player_count in collection.player_counts:
+            for player_type in self.player_masks:
+                positions = [self.positions[base_game_id] for base_game_id in collection.player_counts[player_count][player_type]]
+                self.player_masks[player_type][player_count] = mask_from_positions(positions, self.size)
+        
+        # Filled on first use
+        self.orders = dict()
+        self.ranks = dict()
+        self.ranks_by_id = dict()
+        self.range_indexes = dict()
+        
+    def forget_sort_key(self, key):
+        for memo in [self.orders, self.ranks, self.ranks_by_id, self.range_indexes]:
+            memo.pop(key, None)
+        
+    def get_order(self, key):
+        # Positions sorted by the key
+        if key not in self.orders:
+            if key == 'title':
+                self.orders[key] = list(range(self.size))
+            else:
+                sort_key = self.sort_keys[key]
+                self.orders[key] = sorted(range(self.size), key=lambda position: sort_key(self.base_games[self.base_game_ids[position]]))
+        return self.orders[key]
+    
+    def get_ranks(self, key):
+        # Rank of every position under the key
+        if key not in self.ranks:
+            ranks = [0]*self.size
+            for rank, position in enumerate(self.get_order(key)):
+                ranks[position] = rank
+            self.ranks[key] = ranks
+        return self.ranks[key]
+    
+    def get_ranks_by_id(self, key):
+        if key not in self.ranks_by_id:
+            self.ranks_by_id[key] = dict(zip(self.base_game_ids, self.get_ranks(key)))
+        return self.ranks_by_id[key]
+    
+    def get_range_index(self, key):
+        if key not in self.range_indexes:
+            order = self.get_order(key)
+            values = [getattr(self.base_games[self.base_game_ids[position]], key) for position in order]
+            self.range_indexes[key] = RangeIndex(values, order, self.size)
+        return self.range_indexes[key]
+    
+    def sort_ids(self, base_game_ids, key):
+        # Sorting on a precomputed integer through a C level key function, instead of a lambda building tuples
+        return sorted(base_game_ids, key=self.get_ranks_by_id(key).__getitem__)
+        
+    def query(self, player_count=None, player_type='optimal', min_playing_time=None, max_playing_time=None, 
+              max_bgg_rank=None, sort_by='title', limit=None):
+        mask = (1 << self.size) - 1
+        if player_count is not None:
+            mask &= self.player_masks[player_type].get(player_count, 0)
+        if min_playing_time is not None:
+            mask &= self.get_range_index('playing_time').at_least(min_playing_time)
+        if max_playing_time is not None:
+            mask &= self.get_range_index('playing_time').at_most(max_playing_time)
+        if max_bgg_rank is not None:
+            mask &= self.get_range_index('bgg_rank').at_most(max_bgg_rank)
+        
+        # Positions come out in title order, other orders sort the matches by their precomputed integer rank
+        positions = positions_from_mask(mask)
+        if sort_by != 'title':
+            positions.sort(key=self.get_ranks(sort_by).__getitem__)
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.base_game_ids[position] for position in positions]
@@ -0,0 +1,215 @@
+import csv
+import html
+import io
+import json
+import os
+from Collection import BoardGame #To access NO_VALUE
+from Instrumentation import metrics
+
+class Exporter:
+    # Renders the player count tables and the game list of a collection in one output format. Subclasses turn the
+    # rows streamed by iter_player_count_table and iter_game_list into the fragments of their document
+    FORMAT = None
+    EXTENSION = None
+    BUFFER_SIZE = 1024*1024
+    MAX_PLAYER_COUNT = 6
+
+    def __init__(self, collection, relative_path, filename):
+        self.collection = collection
+        self.output_path = relative_path
+        self.filename = filename
+
+    def get_player_counts(self, max_player_count=100):
+        valid_player_counts = [player_count for player_count in self.collection.player_counts.keys() if int(player_count) <= max_player_count]
+        return sorted(valid_player_counts)
+
+    def get_player_count_title(self, player_count):
+        if player_count == 1:
+            return 'Solo play'
+        return str(player_count) + ' Players'
+
+    def iter_player_count_table(self, player_count, player_type):
+        # (base game, need expansion, expansions) per row, shortest playing time first
+        entries = self.collection.player_counts[player_count][player_type]
+        for base_game_id in self.collection.query(player_count=player_count, player_type=player_type, sort_by='playing_time'):
+            entry = entries[base_game_id]
+            yield (self.collection.base_games[base_game_id], entry['need_expansion'],
+                   [self.collection.expansions[expansion_id] for expansion_id in entry['expansions']])
+
+    def get_game_ids(self):
+        return self.collection.ids_sorted_by_title(self.collection.base_games.keys())
+
+    def iter_game_list(self):
+        # (base game, expansions) per base game, by title
+        for base_game_id in self.get_game_ids():
+            base_game = self.collection.base_games[base_game_id]
+            yield base_game, list(base_game.expansions.values())
+
+    def get_value(self, value):
+        # Missing playing times and ranks are exported as empty values
+        if value == BoardGame.NO_VALUE:
+            return None
+        return value
+
+    def render_document(self):
+        raise NotImplementedError
+
+    def write(self, output):
+        # Any text stream will do, e.g. sys.stdout or io.StringIO
+        output.writelines(self.render_document())
+
+    def export(self):
+        # Written in a single pass to a temporary file that replaces the old output only once complete
+        file_path = self.output_path + self.filename
+        with open(file_path + '.tmp', "w", encoding="utf-8", buffering=self.BUFFER_SIZE) as output_file, \
+                metrics.timer('export_' + self.FORMAT):
+            self.write(output_file)
+        os.replace(file_path + '.tmp', file_path)
+
+
+class JSONExporter(Exporter):
+    FORMAT = 'json'
+    EXTENSION = '.json'
+
+    def get_row(self, base_game, need_expansion, expansions):
+        return {
+            'bgg_id': base_game.bgg_id,
+            'title': base_game.title,
+            'playing_time': self.get_value(base_game.playing_time),
+            'bgg_rank': self.get_value(base_game.bgg_rank),
+            'need_expansion': need_expansion,
+            'expansions': [{
+                'bgg_id': expansion.bgg_id,
+                'title': expansion.title,
+                'short_title': expansion.short_title,
+                'playing_time': self.get_value(expansion.playing_time),
+                } for expansion in expansions],
+        }
+
+    def get_game(self, base_game, expansions):
+        return {
+            'bgg_id': base_game.bgg_id,
+            'title': base_game.title,
+            'min_players': base_game.min_players,
+            'max_players': base_game.max_players,
+            'playing_time': self.get_value(base_game.playing_time),
+            'bgg_rank': self.get_value(base_game.bgg_rank),
+            'expansions': [{'bgg_id': expansion.bgg_id, 'title': expansion.title} for expansion in expansions],
+        }
+
+    def render_document(self):
+        # One row per line, so the document streams out without building the whole object first
+        yield '{"player_counts": ['
+        for index, player_count in enumerate(self.get_player_counts(self.MAX_PLAYER_COUNT)):
+            yield (',' if index else '') + '\n {"player_count": ' + str(player_count) + ', "title": ' \
+                + json.dumps(self.get_player_count_title(player_count))
+            for player_type in ['optimal', 'recommended']:
+                yield ',\n  "' + player_type + '": ['
+                for row_index, row in enumerate(self.iter_player_count_table(player_count, player_type)):
+                    yield (',' if row_index else '') + '\n   ' + json.dumps(self.get_row(*row))
+                yield ']'
+            yield '}'
+        yield '],\n"games": ['
+        for index, game in enumerate(self.iter_game_list()):
+            yield (',' if index else '') + '\n ' + json.dumps(self.get_game(*game))
+        yield ']}\n'
+
+
+class CSVExporter(Exporter):
+    # A single table: the rows of the optimal and recommended tables per player count, then the game list.
+    # Expansions get their own rows, pointing to their base game
+    FORMAT = 'csv'
+    EXTENSION = '.csv'
+    COLUMNS = ['table', 'player_count', 'bgg_id', 'title', 'expansion_of', 'need_expansion', 'min_players',
+               'max_players', 'playing_time', 'bgg_rank']
+
+    def get_rows(self, table, player_count, base_game, expansions, need_expansion=''):
+        rows = [[table, player_count, base_game.bgg_id, base_game.title, '', need_expansion, base_game.min_players,
+                 base_game.max_players, self.get_value(base_game.playing_time), self.get_value(base_game.bgg_rank)]]
+        for expansion in expansions:
+            rows.append([table, player_count, expansion.bgg_id, expansion.title, base_game.bgg_id, '',
+                         expansion.min_players, expansion.max_players, self.get_value(expansion.playing_time), None])
+        return rows
+
+    def render_document(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(self.COLUMNS)
+        for player_count in self.get_player_counts(self.MAX_PLAYER_COUNT):
+            for player_type in ['optimal', 'recommended']:
+                for base_game, need_expansion, expansions in self.iter_player_count_table(player_count, player_type):
+                    writer.writerows(self.get_rows(player_type, player_count, base_game, expansions, need_expansion))
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+
+        for base_game, expansions in self.iter_game_list():
+            writer.writerows(self.get_rows('games', '', base_game, expansions))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class HTMLExporter(Exporter):
+    # A static page with the same tables as the LaTeX document
+    FORMAT = 'html'
+    EXTENSION = '.html'
+    STYLE = (
+        'body {font-family: sans-serif; max-width: 50em; margin: auto;}\n'
+        'table {width: 100%; border-collapse: collapse; margin-bottom: 2em;}\n'
+        'caption {font-weight: bold; font-size: large;}\n'
+        'th, td {padding: 0.2em 0.5em;}\n'
+        'th {border-bottom: 1px solid; font-variant: small-caps;}\n'
+        'td + td {text-align: center; width: 8em;}\n'
+        '.shaded {background-color: #e6e6e6;}\n'
+        '.expansion td:first-child {padding-left: 2em; font-style: italic;}\n'
+        )
+
+    def render_cell(self, value):
+        value = self.get_value(value)
+        return '<td>' + ('-' if value is None else html.escape(str(value))) + '</td>'
+
+    def render_row(self, title, playing_time, bgg_rank, classes):
+        # Expansion rows pass an empty rank, like in the LaTeX tables
+        return ('<tr' + (' class="' + ' '.join(classes) + '"' if classes else '') + '>' + self.render_cell(title)
+                + self.render_cell(playing_time) + self.render_cell(bgg_rank) + '</tr>\n')
+
+    def render_player_count_table(self, player_count):
+        yield ('<section id="players-' + str(player_count) + '">\n<h2>' + self.get_player_count_title(player_count)
+               + '</h2>\n')
+        for player_type in ['optimal', 'recommended']:
+            if not self.collection.player_counts[player_count][player_type]:
+                continue
+            yield ('<table>\n<caption>' + player_type.capitalize() + ' for</caption>\n'
+                   '<thead><tr><th>Board game title</th><th>Avg. (min.)</th><th>BGG Rank</th></tr></thead>\n<tbody>\n')
+            for row_counter, (base_game, need_expansion, expansions) in \
+                    enumerate(self.iter_player_count_table(player_count, player_type), 1):
+                classes = ['shaded'] if row_counter % 2 else []
+                title = '(' + base_game.title + ')' if need_expansion else base_game.title
+                yield self.render_row(title, base_game.playing_time, base_game.bgg_rank, classes)
+                for expansion in expansions:
+                    yield self.render_row(expansion.short_title, expansion.playing_time, '', classes + ['expansion'])
+            yield '</tbody>\n</table>\n'
+        yield '</section>\n'
+
+    def render_game_list(self):
+        yield '<section id="games">\n<h2>Games</h2>\n<ul>\n'
+        for base_game, expansions in self.iter_game_list():
+            yield '<li>' + html.escape(base_game.title)
+            if expansions:
+                yield '\n<ul>\n' + ''.join('<li>' + html.escape(expansion.title) + '</li>\n' for expansion in expansions) + '</ul>\n'
+            yield '</li>\n'
+        yield '</ul>\n</section>\n'
+
+    def render_document(self):
+        yield ('<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>Board game collection</title>\n'
+               '<style>\n' + self.STYLE + '</style>\n</head>\n<body>\n<nav>\n')
+        player_counts = self.get_player_counts(self.MAX_PLAYER_COUNT)
+        for player_count in player_counts:
+            yield '<a href="#players-' + str(player_count) + '">' + self.get_player_count_title(player_count) + '</a>\n'
+        yield '<a href="#games">Games</a>\n</nav>\n'
+        for player_count in player_counts:
+            yield from self.render_player_count_table(player_count)
+        yield from self.render_game_list()
+        yield '</body>\n</html>\n'
@@ -0,0 +1,126 @@
+import sqlite3
+import time
+from ResponseCache import ResponseCache
+
+class GameStore:
+    STORE_FILENAME = 'games.sqlite'
+    SCHEMA_VERSION = 3
+    MAX_AGE = ResponseCache.TTLS['thing'] # Seconds before a stored game is stale and fetched again
+    SCHEMA = (
+        'CREATE TABLE games ('
+        '    bgg_id TEXT PRIMARY KEY,'
+        '    type TEXT NOT NULL,'
+        '    title TEXT NOT NULL,'
+        '    min_players INTEGER NOT NULL,'
+        '    max_players INTEGER NOT NULL,'
+        '    playing_time INTEGER NOT NULL,'
+        '    bgg_rank INTEGER,'
+        '    optimal_player_count TEXT NOT NULL,'
+        '    recommended_player_count TEXT NOT NULL,'
+        '    player_count_votes TEXT NOT NULL,'
+        '    base_game_links TEXT NOT NULL,'
+        '    fetched_at REAL NOT NULL'
+        ');'
+        'CREATE TABLE collection_items ('
+        '    bgg_id TEXT PRIMARY KEY,'
+        '    type TEXT NOT NULL'
+        ');'
+    )
+    COLUMNS = ['bgg_id', 'type', 'title', 'min_players', 'max_players', 'playing_time', 'bgg_rank', 
+               'optimal_player_count', 'recommended_player_count', 'player_count_votes', 'base_game_links']
+    LIST_COLUMNS = ['optimal_player_count', 'recommended_player_count', 'base_game_links']
+    SELECT_GAMES = 'SELECT ' + ', '.join(COLUMNS) + ' FROM games'
+    
+    def __init__(self, filename=STORE_FILENAME, check_same_thread=True, max_age=MAX_AGE):
+        # Without check_same_thread the store can be used from other threads, as long as they take turns
+        self.max_age = max_age
+        self.connection = sqlite3.connect(filename, check_same_thread=check_same_thread)
+        
+        # The store only holds data extracted from BGG, so a store of another version is rebuilt rather than migrated
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            with self.connection:
+                self.connection.execute('DROP TABLE IF EXISTS games')
+                self.connection.execute('DROP TABLE IF EXISTS collection_items')
+            self.connection.executescript(self.SCHEMA)
+            self.connection.execute('PRAGMA user_version = ' + str(self.SCHEMA_VERSION))
+            
+    def close(self):
+        self.connection.close()
+            
+    def record_to_row(self, record):
+        row = []
+        for column in self.COLUMNS:
+            if column in self.LIST_COLUMNS:
+                row.append(','.join(str(value) for value in record[column]))
+            else:
+                row.append(record[column])
+        return row
+    
+    def row_to_record(self, row):
+        record = dict(zip(self.COLUMNS, row))
+        for column in self.LIST_COLUMNS:
+            values = record[column].split(',') if record[column] else []
+            if column == 'base_game_links':
+                record[column] = values
+            else:
+                record[column] = [int(value) for value in values]
+        return record
+    
+    def put_games(self, records):
+        # Only games just fetched from BGG are put, so every row is stamped with the time of writing
+        fetched_at = time.time()
+        with self.connection:
+            self.connection.executemany(
+                    'INSERT OR REPLACE INTO games VALUES (' + ', '.join('?'*(len(self.COLUMNS) + 1)) + ')',
+                    [self.record_to_row(record) + [fetched_at] for record in records])
+            
+    def get_fresh_condition(self, fresh_only):
+        # Games fetched longer than max_age ago are left out when only fresh ones are asked for
+        if fresh_only:
+            return ' AND fetched_at >= ?', [time.time() - self.max_age]
+        return '', []
+            
+    def get_game(self, bgg_id):
+        row = self.connection.execute(self.SELECT_GAMES + ' WHERE bgg_id = ?', (bgg_id,)).fetchone()
+        if row is None:
+            return None
+        return self.row_to_record(row)
+    
+    def get_games(self, bgg_ids, fresh_only=False):
+        records = dict()
+        bgg_ids = list(bgg_ids)
+        condition, parameters = self.get_fresh_condition(fresh_only)
+        chunk_size = 500 # Stays below the SQLite limit on query parameters
+        for start in range(0, len(bgg_ids), chunk_size):
+            chunk = bgg_ids[start:start+chunk_size]
+            rows = self.connection.execute(
+                    self.SELECT_GAMES + ' WHERE bgg_id IN (' + ', '.join('?'*len(chunk)) + ')' + condition, 
+                    chunk + parameters)
+            for row in rows:
+                record = self.row_to_record(row)
+                records[record['bgg_id']] = record
+        return records
+    
+    def get_game_ids(self, fresh_only=False):
+        condition, parameters = self.get_fresh_condition(fresh_only)
+        return {row[0] for row in self.connection.execute('SELECT bgg_id FROM games WHERE 1' + condition, parameters)}
+    
+    def put_collection_items(self, base_game_ids, expansion_ids):
+        with self.connection:
+            self.connection.execute('DELETE FROM collection_items')
+            self.connection.executemany('INSERT INTO collection_items VALUES (?, ?)', 
+                                        [(bgg_id, 'boardgame') for bgg_id in base_game_ids] 
+                                        + [(bgg_id, 'boardgameexpansion') for bgg_id in expansion_ids])
+            
+    def get_collection_items(self):
+        game_ids = {
+                'base_game_ids': [],
+                'expansion_ids': [],
+                }
+        for bgg_id, item_type in self.connection.execute('SELECT bgg_id, type FROM collection_items ORDER BY rowid'):
+            if item_type == 'boardgame':
+                game_ids['base_game_ids'].append(bgg_id)
+            else:
+                game_ids['expansion_ids'].append(bgg_id)
+        return game_ids
@@ -0,0 +1,78 @@
+import contextlib
+import json
+import threading
+import time
+
+class Instrumentation:
+    # Thread safe timers and counters. Timers keep the number of measurements next to the total time,
+    # so per item figures can be derived from the summary
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.timers = dict()
+            self.counters = dict()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds, count=1):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {'count': 0, 'seconds': 0.0}
+            timer['count'] += count
+            timer['seconds'] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        # Times producing the items of a generator, without the time the consumer spends on them
+        iterator = iter(iterable)
+        seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+        self.add_time(name, seconds)
+
+    def summary(self):
+        with self.lock:
+            timers = dict()
+            for name in sorted(self.timers):
+                timer = self.timers[name]
+                timers[name] = {
+                    'count': timer['count'],
+                    'seconds': round(timer['seconds'], 6),
+                    'mean_seconds': round(timer['seconds']/timer['count'], 9) if timer['count'] else 0.0,
+                }
+            return {
+                'wall_seconds': round(time.perf_counter() - self.started, 6),
+                'timers': timers,
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def write_json(self, filename, extra=None):
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+        with open(filename, 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=1)
+
+# Shared by all modules of a run
+metrics = Instrumentation()
@@ -1,226 +1,345 @@
 import os
+import json
+import hashlib
+import logging
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from Collection import BoardGame #To access NO_VALUE
+from Exporter import Exporter
+from Instrumentation import metrics
 from math import ceil
 
-class LatexHandler:
-    def __init__(self, collection, relative_path, filename):
-        self.collection = collection
-        self.latex_path = relative_path
-        self.latex_filename = filename
+logger = logging.getLogger(__name__)
 
-    def write_preamble(self):
-        with open(self.latex_path+self.latex_filename,"w",  encoding="utf-8") as latex_file:
-            # Write documentclass
-            latex_file.write('\\documentclass[twoside, a4paper, 10pt]{report}\n')
-            
-            # Write packages
-            latex_file.write(
-                            '\\usepackage[utf8]{inputenc}\n'
-                            '\\usepackage{slantsc}\n'
-                            '\\usepackage{lmodern}\n'
-                            '\n'
-                            '\\usepackage{fullpage}\n'
-                            '\n'
-                            '\\usepackage{longtable}\n'
-                            '\\usepackage{tabularx}\n'
-                            '\\usepackage{array}\n'
-                            '\\usepackage{caption}\n'
-                            '\\usepackage{booktabs}\n'
-                            '\\usepackage{arydshln}\n'
-                            '\\usepackage[figuresright]{rotating}\n'
-                            '\\usepackage{multirow}\n'
-                            '\n'
-                            '\\usepackage{color, colortbl}\n'
-                            '\\definecolor{LightGray}{gray}{0.9}\n'
-                            '\n'
-                            '\\usepackage{titlesec}\n'
-                            '\\titleformat{\\section}[hang]\n'
-                            '  {}\n'
-                            '  {}\n'
-                            '  {0em}\n'
-                            '  {\\Huge\\bf\\center}\n'
-                            '\n'
-                            '\\usepackage{fancyhdr}\n'
-                            '\\pagestyle{fancy}\n'
-                            '\\fancyhead{}\n'
-                            '\\fancyfoot{}\n'
-                            '\\fancyfoot[RO] {Page \\thepage}\n'
-                            '\\fancyfoot[LE] {Page \\thepage}\n'
-                            '\\fancyfoot[C] {\\leftmark}\n'
-                            '\\renewcommand{\\headrulewidth}{0pt}\n'
-                            '\\renewcommand{\\footrulewidth}{0.4pt}\n'
-                            '\\renewcommand\\sectionmark[1]{\\markboth{#1}{}}\n'
-                            '\n'
-                            )
-            
-            # Write begin document
-            latex_file.write(
-                            '\\begin{document}\n'
-                            )
+class LatexHandler(Exporter):
+    FORMAT = 'tex'
+    EXTENSION = '.tex'
+    BUILD_DIRECTORY = 'build/'
+    MANIFEST_FILENAME = 'manifest.json'
+    MAX_RUNS = 3
+    
+    def __init__(self, collection, relative_path, filename, compiler='pdflatex', max_workers=None, keep_sections=False):
+        Exporter.__init__(self, collection, relative_path, filename)
+        self.history_tables = dict()
+        self.sections = dict() if keep_sections else None # Rendered tables and history pages, see forget_sections
+        self.compiler = compiler
+        self.max_workers = max_workers or os.cpu_count()
+
+    def render_preamble(self):
+        # Write documentclass
+        yield '\\documentclass[twoside, a4paper, 10pt]{report}\n'
+        
+        # Write packages
+        yield (
+                        '\\usepackage[utf8]{inputenc}\n'
+                        '\\usepackage{slantsc}\n'
+                        '\\usepackage{lmodern}\n'
+                        '\n'
+                        '\\usepackage{fullpage}\n'
+                        '\n'
+                        '\\usepackage{longtable}\n'
+                        '\\usepackage{tabularx}\n'
+                        '\\usepackage{array}\n'
+                        '\\usepackage{caption}\n'
+                        '\\usepackage{booktabs}\n'
+                        '\\usepackage{arydshln}\n'
+                        '\\usepackage[figuresright]{rotating}\n'
+                        '\\usepackage{multirow}\n'
+                        '\n'
+                        '\\usepackage{color, colortbl}\n'
+                        '\\definecolor{LightGray}{gray}{0.9}\n'
+                        '\n'
+                        '\\usepackage{titlesec}\n'
+                        '\\titleformat{\\section}[hang]\n'
+                        '  {}\n'
+                        '  {}\n'
+                        '  {0em}\n'
+                        '  {\\Huge\\bf\\center}\n'
+                        '\n'
+                        '\\usepackage{fancyhdr}\n'
+                        '\\pagestyle{fancy}\n'
+                        '\\fancyhead{}\n'
+                        '\\fancyfoot{}\n'
+                        '\\fancyfoot[RO] {Page \\thepage}\n'
+                        '\\fancyfoot[LE] {Page \\thepage}\n'
+                        '\\fancyfoot[C] {\\leftmark}\n'
+                        '\\renewcommand{\\headrulewidth}{0pt}\n'
+                        '\\renewcommand{\\footrulewidth}{0.4pt}\n'
+                        '\\renewcommand\\sectionmark[1]{\\markboth{#1}{}}\n'
+                        '\n'
+                        )
+        
+        # Write begin document
+        yield (
+                        '\\begin{document}\n'
+                        )
+        
+        # Write column definition
+        yield (
+                        '\\newcolumntype{+}{>{\\global\\let\\currentrowstyle\\relax}}\n'
+                        '\\newcolumntype{^}{>{\\currentrowstyle}}\n'
+                        '\\newcommand{\\rowstyle}[1]{\\gdef\\currentrowstyle{#1}#1}\n'
+                        '\\newcolumntype{P}[1]{>{\\centering\\arraybackslash}p{#1}}\n'
+                        '\\newcolumntype{Y}{>{\\centering\\arraybackslash}X}\n'
+                        )
+        
+    # Table header
+    HEADER_STRING = (
+                        '\\renewcommand{\\arraystretch}{1.1}\\\\\n'
+                        '\\hline\n'
+                        '\\scshape Board game title  &\\scshape Avg.({\\slshape min.}) & \\scshape BGG Rank\\\\\n'
+                        '\\hline\n'
+                        '\\endfirsthead\n'
+                        '\\scshape Board game title  &\\scshape Avg.({\\slshape min.}) & \\scshape BGG Rank \\\\\n'
+                        '\\hline\n'
+                        '\\endhead\n')
+    
+    def render_player_count_tables(self, max_player_count=100):
+        for player_count in self.get_player_counts(max_player_count):
+            if self.sections is None:
+                yield from self.render_player_count_table(player_count)
+                continue
+            key = 'players_' + str(player_count)
+            if key not in self.sections:
+                self.sections[key] = ''.join(self.render_player_count_table(player_count))
+                metrics.count('sections_rendered')
+            yield self.sections[key]
             
-            # Write column definition
-            latex_file.write(
-                            '\\newcolumntype{+}{>{\\global\\let\\currentrowstyle\\relax}}\n'
-                            '\\newcolumntype{^}{>{\\currentrowstyle}}\n'
-                            '\\newcommand{\\rowstyle}[1]{\\gdef\\currentrowstyle{#1}#1}\n'
-                            '\\newcolumntype{P}[1]{>{\\centering\\arraybackslash}p{#1}}\n'
-                            '\\newcolumntype{Y}{>{\\centering\\arraybackslash}X}\n'
-                            )
+    def forget_sections(self, player_counts=(), base_game_ids=()):
+        # With keep_sections the document is put together from the sections of earlier renders. The sections
+        # showing games that changed have to be dropped first
+        for player_count in player_counts:
+            self.sections.pop('players_' + str(player_count), None)
+        for base_game_id in base_game_ids:
+            self.sections.pop('history_' + base_game_id, None)
             
-    def write_player_count_tables(self, max_player_count=100):
-        with open(self.latex_path+self.latex_filename,"a", encoding="utf-8") as latex_file:            
-            # Define table header
-            header_string = (
-                            '\\renewcommand{\\arraystretch}{1.1}\\\\\n'
-                            '\\hline\n'
-                            '\\scshape Board game title  &\\scshape Avg.({\\slshape min.}) & \\scshape BGG Rank\\\\\n'
-                            '\\hline\n'
-                            '\\endfirsthead\n'
-                            '\\scshape Board game title  &\\scshape Avg.({\\slshape min.}) & \\scshape BGG Rank \\\\\n'
-                            '\\hline\n'
-                            '\\endhead\n')
+    def render_player_count_table(self, player_count):
+        yield '\\section{' + self.get_player_count_title(player_count) + '} \n'
+        yield '\\setcounter{page}{1}\n'
+                
+        for player_type in ['optimal', 'recommended']:
             
-            valid_player_counts = [player_count for player_count in self.collection.player_counts.keys() if int(player_count) <= max_player_count]
-            for player_count in sorted(valid_player_counts):       
-                if(player_count == 1):
-                    player_string = 'Solo play'
-                else:
-                    player_string = str(player_count) + ' Players'
-
-                latex_file.write('\\section{' + player_string + '} \n')
-                latex_file.write('\\setcounter{page}{1}\n')
-                        
-                for player_type in ['optimal', 'recommended']:
+            # Check if there are games with that player count for the player count type
+            if self.collection.player_counts[player_count][player_type]:
+                # Write table header
+                yield (
+                                '\\begin{longtable}{+p{10cm}^c^c^c}\n'
+                                '\\caption*{\\large \\textbf{' + player_type.capitalize() + ' for}}\n'
+                                + self.HEADER_STRING
+                                )
+                
+                row_counter = 1
+                for base_game, need_expansion, expansions in self.iter_player_count_table(player_count, player_type):
+                    if row_counter % 2:
+                        yield '\\rowcolor{LightGray}'
+                     
+                    if need_expansion:
+                        row_string = base_game.get_latex_string('Parenthesis', 'Playing Time', 'BGG Rank')
+                    else:
+                        row_string = base_game.get_latex_string('Playing Time', 'BGG Rank')    
+                    yield row_string
                     
-                    # Check if there are games with that player count for the player count type
-                    if self.collection.player_counts[player_count][player_type]:
-                        # Write table header
-                        latex_file.write(
-                                        '\\begin{longtable}{+p{10cm}^c^c^c}\n'
-                                        '\\caption*{\\large \\textbf{' + player_type.capitalize() + ' for}}\n'
-                                        + header_string
-                                        )
-                        
-                        row_counter = 1
-                        for base_game_id in self.collection.ids_sorted_by_playing_time(self.collection.player_counts[player_count][player_type].keys()):
-                            if row_counter % 2:
-                                latex_file.write('\\rowcolor{LightGray}')                                
-                               
-                            base_game = self.collection.base_games[base_game_id]
-                             
-                            if self.collection.player_counts[player_count][player_type][base_game_id]['need_expansion']:
-                                row_string = base_game.get_latex_string('Parenthesis', 'Playing Time', 'BGG Rank')
-                            else:
-                                row_string = base_game.get_latex_string('Playing Time', 'BGG Rank')    
-                            latex_file.write(row_string)
-                            
-                            # Write applicable expansions for player count
-                            for expansion_id in self.collection.player_counts[player_count][player_type][base_game_id]['expansions']:
-                                if row_counter % 2:
-                                    latex_file.write('\\rowcolor{LightGray}')  
+                    # Write applicable expansions for player count
+                    for expansion in expansions:
+                        if row_counter % 2:
+                            yield '\\rowcolor{LightGray}'
 #                                row_counter += 1
-                                
-                                expansion = self.collection.expansions[expansion_id]
-                                row_string = expansion.get_latex_string('Playing Time', '')  
-                                latex_file.write(row_string)
-                                
-                            row_counter += 1
-                        # Write end table
-                        latex_file.write('\\hline\n\\end{longtable}\n')
-                    
-                latex_file.write('\\cleardoublepage\n')
+                        
+                        row_string = expansion.get_latex_string('Playing Time', '')  
+                        yield row_string
+                        
+                    row_counter += 1
+                # Write end table
+                yield '\\hline\n\\end{longtable}\n'
+            
+        yield '\\cleardoublepage\n'
 
-    def write_game_history(self):
-        with open(self.latex_path+self.latex_filename,"a", encoding="utf-8") as latex_file:
-            latex_file.write('\\pagestyle{empty}\n')
+    def get_history_table(self, n_expansions):
+        # The history table only depends on the number of expansions, so it is rendered once per count
+        if n_expansions not in self.history_tables:
+            multicolumn_row_string = ''.join([
+                            '\\multirow{ 2}{*}{} & ',
+                            ' \\multirow{ 2}{*}{} &'*n_expansions,
+                            ' & \\multirow{ 2}{*}{} & \\multirow{ 2}{*}{} \\\\ \n',
+                            '\\cdashline{' + str(2+n_expansions) + '-' + str(2+n_expansions) + '}[1pt/2pt]\n',
+                            ])
+            blank_row_string = ' &' + ' &'*n_expansions + ' & & \\\\ \n' + '\\hline \n'
             
-            for base_game_id in self.collection.ids_sorted_by_title(self.collection.base_games.keys()):
-                base_game = self.collection.base_games[base_game_id]
-                
-                if base_game.playing_time > BoardGame.NO_VALUE:
-                    pass
-                else:
-                    for page_index in range(2):
-                        latex_file.write(
-                                        '\\begin{sidewaystable} \n' 
-                                        '\\subsection*{' + base_game.get_latex_title() + '}\n'
-                                        )
-                    
-                        if base_game.expansions:
-                            latex_file.write( 
-                                            'Available expansions:\n'
-                                            '\\begin{enumerate}\n'
-                                            )
-                            for expansion_id in base_game.expansions:
-                                expansion = self.collection.expansions[expansion_id]
-                                latex_file.write('\\item ' + expansion.get_latex_title() + '\n')        
-    
-                            latex_file.write('\\end{enumerate}\n')   
-        
-                        
-                        latex_file.write(
-                                        '{\\def\\arraystretch{2}\\tabcolsep=10pt\n'
-                                        '\\begin{tabularx}{\\textwidth}{|P{30pt}|' + 'c|'*len(base_game.expansions) + 'Y|P{60pt}|c|}\n'
-                                        '\\multicolumn{1}{c}{}'                                    
-                                        )
+            expansion_header_string = ''
+            if n_expansions:
+                expansion_header_string = ' & \\multicolumn{' + str(n_expansions) + '}{c}{\\makebox[0pt]{Expansions}}'
+            
+            MAX_GAME_ROWS = 9
+            N_plays = MAX_GAME_ROWS-ceil(n_expansions/2);
+            
+            self.history_tables[n_expansions] = ''.join([
+                            '{\\def\\arraystretch{2}\\tabcolsep=10pt\n'
+                            '\\begin{tabularx}{\\textwidth}{|P{30pt}|' + 'c|'*n_expansions + 'Y|P{60pt}|c|}\n'
+                            '\\multicolumn{1}{c}{}',
+                            expansion_header_string,
+                            '& \\multicolumn{1}{c}{}& \\multicolumn{2}{c}{Winner} \\\\ \n'
+                            '\\hline \n'
+                            'Date &',
+                            ''.join([str(index+1) + ' & ' for index in range(n_expansions)]),
+                            'Players & Name & Score\\\\ \n'
+                            '\\hline \n',
+                            (multicolumn_row_string + blank_row_string)*N_plays,
+                            '\\end{tabularx}} \n' 
+                            '\\end{sidewaystable} \n',
+                            ])
+        return self.history_tables[n_expansions]
     
-                        if base_game.expansions:
-                            latex_file.write(' & \\multicolumn{' + str(len(base_game.expansions)) + '}{c}{\\makebox[0pt]{Expansions}}')
-                            
-                        latex_file.write(
-                                        '& \\multicolumn{1}{c}{}& \\multicolumn{2}{c}{Winner} \\\\ \n'
-                                        '\\hline \n'
-                                        'Date &'
-                                        )
-                        for index in range(len(base_game.expansions)):
-                            latex_file.write(str(index+1) + ' & ')
+    def get_history_game_ids(self):
+        history_game_ids = []
+        for base_game_id in self.get_game_ids():
+            if not self.collection.base_games[base_game_id].playing_time > BoardGame.NO_VALUE:
+                history_game_ids.append(base_game_id)
+        return history_game_ids
     
-                        latex_file.write(
-                                        'Players & Name & Score\\\\ \n'
-                                        '\\hline \n'
-                                        )
-                        
-                        multicolumn_row_string = '\\multirow{ 2}{*}{} & '
-                        blank_row_string = ' &'
-                        for index in range(len(base_game.expansions)):
-                            multicolumn_row_string = multicolumn_row_string + ' \\multirow{ 2}{*}{} &'
-                            blank_row_string = blank_row_string + ' &'
+    def render_game_history(self):
+        yield '\\pagestyle{empty}\n'
         
-                        multicolumn_row_string = multicolumn_row_string + ' & \\multirow{ 2}{*}{} & \\multirow{ 2}{*}{} \\\\ \n'
-                        
-                        offset = len(base_game.expansions)
-                        multicolumn_row_string = multicolumn_row_string + '\\cdashline{' + str(2+offset) + '-' + str(2+offset) + '}[1pt/2pt]\n'
-                        
-                        blank_row_string = blank_row_string + ' & & \\\\ \n'
-                        blank_row_string = blank_row_string + '\\hline \n'
-                        
-                        MAX_GAME_ROWS = 9
-                        N_plays = MAX_GAME_ROWS-ceil(len(base_game.expansions)/2);
-                        for index in range(N_plays):
-                            latex_file.write( multicolumn_row_string)
-                            latex_file.write(blank_row_string)
-                        
-                        latex_file.write(
-                                        '\\end{tabularx}} \n' 
-                                        '\\end{sidewaystable} \n' 
-                                        )      
-                        if page_index == 0:
-                            latex_file.write('\clearpage \n')
-                        else:
-                            latex_file.write('\\cleardoublepage \n')
+        for base_game_id in self.get_history_game_ids():
+            if self.sections is None:
+                yield self.render_history_page(base_game_id)
+                continue
+            key = 'history_' + base_game_id
+            if key not in self.sections:
+                self.sections[key] = self.render_history_page(base_game_id)
+                metrics.count('sections_rendered')
+            yield self.sections[key]
+            
+    def render_history_page(self, base_game_id):
+        base_game = self.collection.base_games[base_game_id]
+        
+        # Only the title and the expansion list are filled in per game
+        page_parts = [
+                        '\\begin{sidewaystable} \n' 
+                        '\\subsection*{' + base_game.get_latex_title() + '}\n'
+                        ]
+        
+        if base_game.expansions:
+            page_parts.append( 
+                            'Available expansions:\n'
+                            '\\begin{enumerate}\n'
+                            )
+            for expansion_id in base_game.expansions:
+                expansion = self.collection.expansions[expansion_id]
+                page_parts.append('\\item ' + expansion.get_latex_title() + '\n')
+            page_parts.append('\\end{enumerate}\n')
+            
+        page_parts.append(self.get_history_table(len(base_game.expansions)))
+        page = ''.join(page_parts)
+        
+        # Each game gets two identical pages
+        return page + '\\clearpage \n' + page + '\\cleardoublepage \n'
 
-    def create_tex(self):
-        self.write_preamble()
-        self.write_player_count_tables(6)
-        self.write_game_history()
+    def render_document(self):
+        # The whole document as a stream of string fragments, section by section
+        yield from metrics.timed_iter('render_preamble', self.render_preamble())
+        yield from metrics.timed_iter('render_player_count_tables', self.render_player_count_tables(self.MAX_PLAYER_COUNT))
+        yield from metrics.timed_iter('render_game_history', self.render_game_history())
+        yield '\\end{document}'
         
-        with open(self.latex_path+self.latex_filename,"a", encoding="utf-8") as latex_file:
-            latex_file.write('\\end{document}')
+    def create_tex(self):
+        self.export()
+            
+    def run_compiler(self, directory, filename):
+        # Rerun while LaTeX asks for it, e.g. until the longtable column widths have settled
+        log_path = os.path.join(directory, os.path.splitext(filename)[0] + '.log')
+        for run in range(self.MAX_RUNS):
+            try:
+                with metrics.timer('latex_run'):
+                    subprocess.run([self.compiler, '-interaction=nonstopmode', '-halt-on-error', filename],
+                                   cwd=directory, stdout=subprocess.DEVNULL, check=True)
+            except subprocess.CalledProcessError:
+                logger.error('Compiling %s failed, see %s', filename, log_path)
+                raise
+            with open(log_path, encoding='latin-1') as log_file:
+                if 'Rerun' not in log_file.read():
+                    break
             
     def compile_latex(self):
-        subprocess.check_call('pdflatex -output-directory ' + self.latex_path + ' ' + self.latex_path + self.latex_filename, shell=False)
-        os.remove(self.latex_path + self.latex_filename.split('.')[0] + '.log')
-        os.remove(self.latex_path + self.latex_filename.split('.')[0] + '.aux')
+        self.run_compiler(self.output_path, self.filename)
+        os.remove(self.output_path + self.filename.split('.')[0] + '.log')
+        os.remove(self.output_path + self.filename.split('.')[0] + '.aux')
+    
+    def render_history_chunk(self, base_game_id):
+        yield '\\pagestyle{empty}\n'
+        yield self.render_history_page(base_game_id)
     
-    
\ No newline at end of file
+    def render_chunks(self, max_player_count=Exporter.MAX_PLAYER_COUNT):
+        # The document split into standalone parts: one per player count and one per game history. History chunks 
+        # are named after the game, not its position, so adding or renaming a game only compiles its own chunk
+        for player_count in self.get_player_counts(max_player_count):
+            yield 'players_' + str(player_count), self.render_player_count_table(player_count)
+        
+        for base_game_id in self.get_history_game_ids():
+            yield 'history_' + base_game_id, self.render_history_chunk(base_game_id)
+            
+    def render_master(self, chunk_names):
+        # The compiled chunks are merged page by page, keeping their own page numbers
+        yield '\\documentclass[a4paper]{article}\n\\usepackage{pdfpages}\n\\begin{document}\n'
+        for chunk_name in chunk_names:
+            yield '\\includepdf[pages=-]{' + chunk_name + '.pdf}\n'
+        yield '\\end{document}'
+        
+    def write_build_file(self, filename, text):
+        with open(filename + '.tmp', "w", encoding="utf-8") as build_file:
+            build_file.write(text)
+        os.replace(filename + '.tmp', filename)
+        
+    def build_pdf(self):
+        # Incremental build: only chunks whose content changed since the last build are compiled, in parallel
+        build_path = self.output_path + self.BUILD_DIRECTORY
+        os.makedirs(build_path, exist_ok=True)
+        manifest_path = build_path + self.MANIFEST_FILENAME
+        try:
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            manifest = {}
+        
+        preamble = ''.join(self.render_preamble())
+        chunk_names = []
+        changed_chunks = dict()
+        for chunk_name, chunk_body in self.render_chunks():
+            chunk = preamble + ''.join(chunk_body) + '\\end{document}'
+            chunk_hash = hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+            chunk_names.append(chunk_name)
+            if manifest.get(chunk_name) != chunk_hash or not os.path.exists(build_path + chunk_name + '.pdf'):
+                self.write_build_file(build_path + chunk_name + '.tex', chunk)
+                changed_chunks[chunk_name] = chunk_hash
+        
+        # Remove the files of chunks that no longer exist, e.g. after removing a player count
+        for chunk_name in set(manifest) - set(chunk_names) - {'master'}:
+            del manifest[chunk_name]
+            for extension in ['.tex', '.pdf', '.aux', '.log']:
+                if os.path.exists(build_path + chunk_name + extension):
+                    os.remove(build_path + chunk_name + extension)
+        
+        logger.info('Compiling %s of %s chunks', len(changed_chunks), len(chunk_names))
+        failed_chunks = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {chunk_name: executor.submit(self.run_compiler, build_path, chunk_name + '.tex') for chunk_name in changed_chunks}
+            for chunk_name, future in futures.items():
+                try:
+                    future.result()
+                    manifest[chunk_name] = changed_chunks[chunk_name]
+                except subprocess.CalledProcessError:
+                    manifest.pop(chunk_name, None)
+                    failed_chunks.append(chunk_name)
+        
+        # Only successfully compiled chunks are recorded, failed ones are retried on the next build
+        master_name = os.path.splitext(self.filename)[0]
+        master = ''.join(self.render_master(chunk_names))
+        master_hash = hashlib.sha256(master.encode('utf-8')).hexdigest()
+        if not failed_chunks and (changed_chunks or manifest.get('master') != master_hash or not os.path.exists(self.output_path + master_name + '.pdf')):
+            self.write_build_file(build_path + master_name + '.tex', master)
+            self.run_compiler(build_path, master_name + '.tex')
+            os.replace(build_path + master_name + '.pdf', self.output_path + master_name + '.pdf')
+            manifest['master'] = master_hash
+        
+        self.write_build_file(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+        if failed_chunks:
+            raise RuntimeError('LaTeX chunks failed to compile: ' + ', '.join(failed_chunks))
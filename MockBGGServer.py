@@ -0,0 +1,247 @@
+import glob
+import gzip
+import hashlib
+import os
+import random
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import quoteattr
+
+class MockBGGServer:
+    # Local stand-in for the collection and thing endpoints of the xmlapi2, serving synthetic or recorded games
+    FIRST_ID = 1000
+    ITEMS_PER_FIXTURE = 100
+    
+    def __init__(self, n_base_games=100, n_expansions=50, latency=0.0, queued_probability=0.0, 
+                 throttled_probability=0.0, seed=0, ownership=1.0, queue_delay=0.0, rate_limit=None, 
+                 corpus_directory=None):
+        self.latency = latency
+        self.ownership = ownership # Share of the games each user owns, drawn per user
+        self.queued_probability = queued_probability
+        self.throttled_probability = throttled_probability
+        self.queue_delay = queue_delay # Seconds a collection request stays queued (202) after it was first asked for
+        self.queued_since = dict()
+        self.rate_limit = rate_limit # Requests per second answered before 429, with a burst of one second's worth
+        self.tokens = rate_limit
+        self.last_refill = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.status_counts = dict()
+        self.things_served = 0
+        
+        self.titles = dict()
+        self.items = dict()
+        if corpus_directory:
+            self.load_corpus(corpus_directory)
+        else:
+            self.generate_items(n_base_games, n_expansions)
+            
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = None
+        
+    def generate_items(self, n_base_games, n_expansions):
+        self.base_game_ids = [str(self.FIRST_ID + index) for index in range(n_base_games)]
+        self.expansion_ids = [str(self.FIRST_ID + n_base_games + index) for index in range(n_expansions)]
+        
+        for bgg_id in self.base_game_ids:
+            self.titles[bgg_id] = 'Game ' + bgg_id
+            self.items[bgg_id] = self.thing_item(bgg_id, 'boardgame', [])
+        
+        for bgg_id in self.expansion_ids:
+            base_game_ids = [self.random.choice(self.base_game_ids)]
+            self.titles[bgg_id] = self.titles[base_game_ids[0]] + ': Expansion ' + bgg_id
+            
+            # Some expansions fit several base games, or one that is not in the collection
+            draw = self.random.random()
+            if draw < 0.1:
+                base_game_ids.append(self.random.choice(self.base_game_ids))
+            elif draw < 0.2:
+                base_game_ids.insert(0, str(self.FIRST_ID - 1))
+                self.titles[base_game_ids[0]] = 'Game not in collection'
+            self.items[bgg_id] = self.thing_item(bgg_id, 'boardgameexpansion', base_game_ids)
+            
+    def load_corpus(self, directory):
+        # Recorded thing responses, e.g. saved with record_corpus or the bodies of a ResponseCache directory. 
+        # Files without thing items, like cached collection responses, are skipped
+        self.base_game_ids = []
+        self.expansion_ids = []
+        for filename in sorted(glob.glob(os.path.join(directory, '*.xml'))):
+            for item in ET.parse(filename).getroot().findall('item'):
+                bgg_id = item.get('id')
+                if bgg_id is None or bgg_id in self.items:
+                    continue
+                if item.get('type') == 'boardgameexpansion':
+                    self.expansion_ids.append(bgg_id)
+                else:
+                    self.base_game_ids.append(bgg_id)
+                name = item.find('name[@type="primary"]')
+                self.titles[bgg_id] = name.get('value') if name is not None else bgg_id
+                self.items[bgg_id] = ET.tostring(item, encoding='unicode')
+                
+    def record_corpus(self, directory):
+        # Saves the served games as fixtures, so a generated or recorded set can be replayed with load_corpus
+        os.makedirs(directory, exist_ok=True)
+        bgg_ids = self.base_game_ids + self.expansion_ids
+        for start in range(0, len(bgg_ids), self.ITEMS_PER_FIXTURE):
+            filename = os.path.join(directory, 'things_' + str(start//self.ITEMS_PER_FIXTURE + 1).zfill(4) + '.xml')
+            fixture_ids = bgg_ids[start:start+self.ITEMS_PER_FIXTURE]
+            with open(filename, 'w', encoding='utf-8') as fixture_file:
+                fixture_file.write('<items>' + ''.join(self.items[bgg_id] for bgg_id in fixture_ids) + '</items>')
+        
+    def thing_item(self, bgg_id, subtype, base_game_ids):
+        min_players = self.random.randint(1, 3)
+        max_players = self.random.randint(min_players, 8)
+        playing_time = self.random.choice([0, 15, 30, 45, 60, 90, 120, 180])
+        
+        poll = ''
+        for player_count in range(1, max_players + 1):
+            votes = [self.random.randint(0, 50) for _ in range(3)]
+            poll += ('<results numplayers="' + str(player_count) + '">'
+                     '<result value="Best" numvotes="' + str(votes[0]) + '"/>'
+                     '<result value="Recommended" numvotes="' + str(votes[1]) + '"/>'
+                     '<result value="Not Recommended" numvotes="' + str(votes[2]) + '"/>'
+                     '</results>')
+        poll += '<results numplayers="' + str(max_players) + '+"></results>'
+        
+        links = ''
+        for base_game_id in base_game_ids:
+            links += ('<link type="boardgameexpansion" id="' + base_game_id + '" value=' 
+                      + quoteattr(self.titles[base_game_id]) + ' inbound="true"/>')
+            
+        if subtype == 'boardgame' and self.random.random() < 0.9:
+            rank = str(self.random.randint(1, 20000))
+        else:
+            rank = 'Not Ranked'
+        
+        return ('<item type="' + subtype + '" id="' + bgg_id + '">'
+                '<name type="primary" sortindex="1" value=' + quoteattr(self.titles[bgg_id]) + '/>'
+                '<minplayers value="' + str(min_players) + '"/>'
+                '<maxplayers value="' + str(max_players) + '"/>'
+                '<poll name="suggested_numplayers" title="User Suggested Number of Players" totalvotes="100">' 
+                + poll + '</poll>'
+                '<playingtime value="' + str(playing_time) + '"/>'
+                + links + 
+                '<statistics page="1"><ratings><ranks>'
+                '<rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="' + rank + '"/>'
+                '</ranks></ratings></statistics>'
+                '</item>')
+    
+    def collection_xml(self, params):
+        if params.get('subtype') == 'boardgameexpansion':
+            bgg_ids = self.expansion_ids
+        else:
+            bgg_ids = self.base_game_ids
+        if self.ownership < 1:
+            bgg_ids = [bgg_id for bgg_id in bgg_ids if self.owns(params.get('username', ''), bgg_id)]
+        
+        body = '<items totalitems="' + str(len(bgg_ids)) + '">'
+        for bgg_id in bgg_ids:
+            body += ('<item objecttype="thing" objectid="' + bgg_id + '">'
+                     '<name sortindex="1">' + self.titles[bgg_id] + '</name>'
+                     '<status own="1"/>'
+                     '</item>')
+        return body + '</items>'
+    
+    def owns(self, username, bgg_id):
+        # Same answer on every request, so collections of different users overlap in a repeatable way
+        draw = int(hashlib.sha1((username + ':' + bgg_id).encode('utf-8')).hexdigest()[:8], 16)/0xffffffff
+        return draw < self.ownership
+    
+    def thing_xml(self, params):
+        body = '<items termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">'
+        for bgg_id in params.get('id', '').split(','):
+            if bgg_id in self.items:
+                body += self.items[bgg_id]
+                with self.lock:
+                    self.things_served += 1
+        return body + '</items>'
+        
+    def respond(self, path, params):
+        time.sleep(self.latency)
+        
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.queued_probability:
+            return 202, ''
+        if draw < self.queued_probability + self.throttled_probability:
+            return 429, ''
+        if not self.take_token():
+            return 429, ''
+        if path.endswith('/collection') and self.is_queued(params):
+            return 202, ''
+        
+        if path.endswith('/collection'):
+            return 200, self.collection_xml(params)
+        if path.endswith('/thing'):
+            return 200, self.thing_xml(params)
+        return 404, ''
+    
+    def take_token(self):
+        if self.rate_limit is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.last_refill)*self.rate_limit)
+            self.last_refill = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+        
+    def is_queued(self, params):
+        # Like BGG, a collection is prepared in the background and the same request succeeds once it is ready
+        key = tuple(sorted(params.items()))
+        with self.lock:
+            if key not in self.queued_since:
+                self.queued_since[key] = time.monotonic()
+            return time.monotonic() - self.queued_since[key] < self.queue_delay
+        
+    def etag(self, body):
+        return '"' + hashlib.sha1(body).hexdigest() + '"'
+    
+    def handler_class(self):
+        mock = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                status_code, body = mock.respond(url.path, params)
+                body = body.encode('utf-8')
+                etag = mock.etag(body)
+                if status_code == 200 and self.headers.get('If-None-Match') == etag:
+                    status_code = 304
+                    body = b''
+                with mock.lock:
+                    mock.status_counts[status_code] = mock.status_counts.get(status_code, 0) + 1
+                
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                if status_code in (200, 304):
+                    self.send_header('ETag', etag)
+                if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                
+            def log_message(self, format, *args):
+                pass
+            
+        return Handler
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return 'http://127.0.0.1:' + str(self.server.server_port) + '/xmlapi2/'
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
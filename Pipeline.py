@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+from Collection import BaseGame, Collection, Expansion
+from Exporter import CSVExporter, HTMLExporter, JSONExporter
+from Instrumentation import metrics
+from LatexHandler import LatexHandler
+from Snapshot import Snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+EXPORTERS = {
+    'tex': LatexHandler,
+    'json': JSONExporter,
+    'csv': CSVExporter,
+    'html': HTMLExporter,
+}
+
+def export_collection(collection, output_path, latex_filename, formats):
+    # The LaTeX document keeps its filename, the other formats are written next to it with their own extension
+    for output_format in formats:
+        exporter_class = EXPORTERS[output_format]
+        filename = latex_filename
+        if exporter_class is not LatexHandler:
+            filename = os.path.splitext(latex_filename)[0] + exporter_class.EXTENSION
+        exporter_class(collection, output_path, filename).export()
+
+class Pipeline:
+    STAGES = ['games', 'render', 'pdf']
+    STATE_FILENAME = 'pipeline.json'
+
+    def __init__(self, api, store, latex_path, latex_filename, incremental=True, compile_pdf=False, compile_workers=None,
+                 player_count_rule=None, formats=('tex',)):
+        self.api = api
+        self.store = store
+        self.latex_path = latex_path
+        self.latex_filename = latex_filename
+        self.incremental = incremental
+        self.compile_pdf = compile_pdf
+        self.compile_workers = compile_workers
+        self.player_count_rule = player_count_rule # Another rule than the one applied while parsing, see PollAnalysis
+        self.formats = list(formats)
+        self.state_path = latex_path + self.STATE_FILENAME
+        self.completed_stages = []
+
+    def load_state(self):
+        # Stages completed by an earlier run for the same user and output
+        try:
+            with open(self.state_path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return []
+        if (state.get('username') != self.api.username or state.get('latex_filename') != self.latex_filename 
+                or state.get('formats') != self.formats):
+            return []
+        return state['completed_stages']
+
+    def complete_stage(self, stage):
+        self.completed_stages.append(stage)
+        state = {
+            'username': self.api.username,
+            'latex_filename': self.latex_filename,
+            'formats': self.formats,
+            'completed_stages': self.completed_stages,
+        }
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def collect_game_ids(self, collection, xml_collection):
+        if self.incremental and collection.load_state(self.store, fresh_only=True):
+            # Only games added since the last run are queried and parsed
+            return collection.sync_xml_collection(xml_collection)
+
+        game_ids = collection.parse_xml_collection(xml_collection)
+
+        # Games already in the store skip both the query and the XML parsing, unless they are stale
+        return collection.import_games(self.store, game_ids, fresh_only=True)
+
+    def fetch_games(self):
+        # Games fetched within the store's max_age are loaded from it, the others are fetched again
+        stored_ids = self.store.get_game_ids(fresh_only=True) if self.incremental else set()
+
+        # The listings and the detail fetches stream into one bounded queue. Details are fetched as soon as their ids
+        # are listed, games are parsed while later batches are still downloading and the XML of the whole collection 
+        # is never held at once
+        collection = Collection()
+        collection.parse_xml_stream(self.api.iter_collection_games(skip_ids=stored_ids), self.store, stored_ids)
+        collection.save_state(self.store, skip_ids=stored_ids)
+        return collection
+
+    def load_collection(self):
+        # The games stage finished in an earlier run. Its snapshot is memory-mapped instead of rebuilding every
+        # game from the store, which is only the fallback
+        try:
+            return Snapshot(self.latex_path + Snapshot.SNAPSHOT_FILENAME).load_collection()
+        except (OSError, ValueError):
+            collection = Collection()
+            collection.load_state(self.store)
+            return collection
+
+    def dry_run(self):
+        # Queries only the collection list and reports the work a real run would do, without writing any output
+        collection = Collection()
+        game_ids = self.collect_game_ids(collection, self.api.query_bgg_collection())
+        logger.info('Dry run for user %s: %s base games and %s expansions in the collection, %s base games and %s '
+                    'expansions to fetch', self.api.username, len(collection.base_games), len(collection.expansions), 
+                    len(game_ids['base_game_ids']), len(game_ids['expansion_ids']))
+        logger.info('Stages to run: %s', ', '.join(self.get_stages()))
+        return game_ids
+
+    def get_stages(self):
+        if self.compile_pdf:
+            return self.STAGES
+        return self.STAGES[:-1]
+
+    def run(self, resume=False):
+        completed_stages = self.load_state() if resume else []
+        self.completed_stages = []
+        os.makedirs(self.latex_path, exist_ok=True)
+
+        collection = None
+        for stage in self.get_stages():
+            if stage in completed_stages:
+                logger.info('Resuming: skipping stage %s', stage)
+                self.complete_stage(stage)
+                continue
+
+            with metrics.timer('stage_' + stage):
+                if stage == 'games':
+                    collection = self.fetch_games()
+                    with metrics.timer('write_snapshot'):
+                        write_snapshot(collection, self.latex_path + Snapshot.SNAPSHOT_FILENAME)
+                    if self.player_count_rule:
+                        collection.apply_player_count_rule(self.player_count_rule)
+                else:
+                    if collection is None:
+                        collection = self.load_collection()
+                        if self.player_count_rule:
+                            collection.apply_player_count_rule(self.player_count_rule)
+                    if stage == 'render':
+                        export_collection(collection, self.latex_path, self.latex_filename, self.formats)
+                    else:
+                        LatexHandler(collection, self.latex_path, self.latex_filename, 
+                                     max_workers=self.compile_workers).build_pdf()
+            self.complete_stage(stage)
+        return collection
+
+
+class BatchPipeline:
+    # Collection books for several users at once. Every game is fetched once into the shared game store, 
+    # however many users own it, and each user's collection is then built from the store
+    STORE_BATCH_SIZE = 500 # Fetched games written to the store per transaction
+
+    def __init__(self, api, store, latex_path, latex_filename, usernames, incremental=True, compile_pdf=False, 
+                 compile_workers=None, player_count_rule=None, formats=('tex',)):
+        self.api = api
+        self.store = store
+        self.latex_path = latex_path
+        self.latex_filename = latex_filename
+        self.usernames = usernames
+        self.incremental = incremental
+        self.compile_pdf = compile_pdf
+        self.compile_workers = compile_workers
+        self.player_count_rule = player_count_rule
+        self.formats = list(formats)
+
+    def get_game_ids(self, xml_collections):
+        # Union of all collections, as ordered sets
+        base_game_ids = dict()
+        expansion_ids = dict()
+        for xml_collection in xml_collections.values():
+            base_game_ids.update(dict.fromkeys(item.attrib['objectid'] for item in xml_collection['base_game_items']))
+            expansion_ids.update(dict.fromkeys(item.attrib['objectid'] for item in xml_collection['expansion_items']))
+            
+        game_ids = {
+                'base_game_ids': list(base_game_ids),
+                'expansion_ids': list(expansion_ids),
+                }
+        
+        return game_ids
+
+    def get_missing_game_ids(self, xml_collections):
+        game_ids = self.get_game_ids(xml_collections)
+        n_owned = sum(len(xml_collection['base_game_items']) + len(xml_collection['expansion_items']) 
+                      for xml_collection in xml_collections.values())
+        
+        records = dict()
+        if self.incremental:
+            records = self.store.get_games(game_ids['base_game_ids'] + game_ids['expansion_ids'], fresh_only=True)
+        missing_game_ids = {
+                'base_game_ids': [bgg_id for bgg_id in game_ids['base_game_ids'] if bgg_id not in records],
+                'expansion_ids': [bgg_id for bgg_id in game_ids['expansion_ids'] if bgg_id not in records],
+                }
+        
+        metrics.count('games_owned', n_owned)
+        metrics.count('games_unique', len(game_ids['base_game_ids']) + len(game_ids['expansion_ids']))
+        logger.info('%s users own %s games, %s of them unique and %s missing from the store or stale', len(xml_collections), 
+                    n_owned, len(game_ids['base_game_ids']) + len(game_ids['expansion_ids']), 
+                    len(missing_game_ids['base_game_ids']) + len(missing_game_ids['expansion_ids']))
+        return missing_game_ids
+
+    def fetch_games(self, game_ids):
+        # Parsed games go straight into the store as records, no collection is built yet
+        base_game_ids = set(game_ids['base_game_ids'])
+        records = []
+        for bgg_id, item in self.api.iter_bgg_ids(game_ids):
+            game = BaseGame(bgg_id) if bgg_id in base_game_ids else Expansion(bgg_id)
+            with metrics.timer('add_info_from_xml'):
+                game.add_info_from_xml(item)
+            records.append(game.get_record())
+            if len(records) == self.STORE_BATCH_SIZE:
+                self.store.put_games(records)
+                records = []
+        self.store.put_games(records)
+
+    def build_collection(self, xml_collection):
+        collection = Collection()
+        game_ids = collection.parse_xml_collection(xml_collection)
+        
+        # Games that could not be fetched are left out, like in a single user run
+        missing_game_ids = collection.import_games(self.store, game_ids)
+        for bgg_id in missing_game_ids['base_game_ids']:
+            del collection.base_games[bgg_id]
+        for bgg_id in missing_game_ids['expansion_ids']:
+            del collection.expansions[bgg_id]
+        if self.player_count_rule:
+            collection.apply_player_count_rule(self.player_count_rule)
+        return collection
+
+    def dry_run(self):
+        missing_game_ids = self.get_missing_game_ids(self.api.query_bgg_collections(self.usernames))
+        logger.info('Dry run: %s base games and %s expansions to fetch', len(missing_game_ids['base_game_ids']), 
+                    len(missing_game_ids['expansion_ids']))
+        return missing_game_ids
+
+    def run(self):
+        with metrics.timer('stage_collections'):
+            xml_collections = self.api.query_bgg_collections(self.usernames)
+        with metrics.timer('stage_games'):
+            self.fetch_games(self.get_missing_game_ids(xml_collections))
+        
+        # Every user gets their own directory, so incremental PDF builds don't share chunks. Collections are 
+        # built one at a time, only the store holds the games of all users
+        for username in self.usernames:
+            logger.info('Creating collection of user %s', username)
+            with metrics.timer('build_collection'):
+                collection = self.build_collection(xml_collections.pop(username))
+            user_path = self.latex_path + username + '/'
+            os.makedirs(user_path, exist_ok=True)
+            export_collection(collection, user_path, self.latex_filename, self.formats)
+            if self.compile_pdf:
+                LatexHandler(collection, user_path, self.latex_filename, max_workers=self.compile_workers).build_pdf()
@@ -0,0 +1,150 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError: # Only the poll analysis needs NumPy
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def decode_player_count_votes(player_count_votes):
+    # Inverse of Collection.encode_player_count_votes: (numplayers, (best, recommended, not recommended) or None) rows
+    rows = []
+    for row in player_count_votes.split(';') if player_count_votes else []:
+        player_count, votes = row.split(':')
+        rows.append((player_count, tuple(int(value) for value in votes.split('/')) if votes else None))
+    return rows
+
+class PollAnalysis:
+    # The suggested_numplayers polls of many games as one games x player counts x responses matrix of votes, so the
+    # best and recommended player counts of a whole library are recomputed under any rule with a few array operations
+    RULES = ['plurality', 'threshold', 'majority', 'bayesian']
+    BEST = 0
+    RECOMMENDED = 1
+    NOT_RECOMMENDED = 2
+    THRESHOLD = 0.5 # Share of a row's votes needed under the threshold rule
+    PRIOR_STRENGTH = 10 # Pseudo votes per row under the bayesian rule, spread like the votes of the whole library
+
+    def __init__(self, games, include_plus_buckets=False):
+        if np is None:
+            raise ImportError('The poll analysis needs NumPy, install it with pip install numpy')
+
+        games = list(games)
+        self.include_plus_buckets = include_plus_buckets
+        self.bgg_ids = [game.bgg_id for game in games]
+        self.min_players = np.array([game.min_players for game in games], dtype=np.int64)
+        self.max_players = np.array([game.max_players for game in games], dtype=np.int64)
+
+        # Rows are collected as flat lists and written into the matrices in one go
+        game_indexes = []
+        player_counts = []
+        row_votes = []
+        row_positions = []
+        self.reset_positions = np.full(len(games), -1, dtype=np.int64)
+        n_plus_buckets = 0
+        for game_index, game in enumerate(games):
+            for position, (player_count, votes) in enumerate(decode_player_count_votes(game.player_count_votes)):
+                if votes is None:
+                    self.reset_positions[game_index] = position # Row nobody voted on
+                    continue
+                if player_count.isdigit():
+                    player_count = int(player_count)
+                elif player_count.endswith('+') and player_count[:-1].isdigit() and sum(votes):
+                    # 'N+' means more than N players, it only counts when asked for
+                    n_plus_buckets += 1
+                    if not include_plus_buckets:
+                        continue
+                    player_count = int(player_count[:-1]) + 1
+                else:
+                    continue
+                game_indexes.append(game_index)
+                player_counts.append(player_count)
+                row_votes.append(votes)
+                row_positions.append(position)
+        if n_plus_buckets and not include_plus_buckets:
+            logger.info('%s poll rows with votes for more than the listed player counts are left out', n_plus_buckets)
+
+        # Only as wide as the polls, a single game listed for hundreds of players must not widen every row. The
+        # player ranges recommended when nobody voted are added per game, see masks and games_by_player_count
+        n_columns = 1 + max([0] + player_counts)
+        self.votes = np.zeros((len(games), n_columns, 3), dtype=np.int64)
+        self.has_votes = np.zeros((len(games), n_columns), dtype=bool) # A row with results, even if all are 0
+        self.positions = np.full((len(games), n_columns), -1, dtype=np.int64)
+        if game_indexes:
+            self.votes[game_indexes, player_counts] = row_votes
+            self.has_votes[game_indexes, player_counts] = True
+            self.positions[game_indexes, player_counts] = row_positions
+
+    def winners(self, rule='plurality', threshold=THRESHOLD, prior_strength=PRIOR_STRENGTH):
+        # Returns the optimal and recommended player counts as boolean games x poll player counts matrices, and a
+        # boolean vector of the games that are also recommended for their whole player range
+        if rule == 'plurality':
+            return self.plurality_winners()
+
+        best = self.votes[:, :, self.BEST]
+        recommended = self.votes[:, :, self.RECOMMENDED]
+        totals = self.votes.sum(axis=2)
+        voted = totals > 0
+        if rule == 'threshold':
+            optimal_counts = voted & (best >= threshold*totals)
+            recommended_counts = voted & ~optimal_counts & (best + recommended >= threshold*totals)
+        elif rule == 'majority':
+            optimal_counts = voted & (2*best > totals)
+            recommended_counts = voted & ~optimal_counts & (2*(best + recommended) > totals)
+        elif rule == 'bayesian':
+            # Rows with few votes are pulled towards the vote shares of the whole library
+            shares = self.votes.sum(axis=(0, 1))/max(1, totals.sum())
+            winner = (self.votes + prior_strength*shares).argmax(axis=2)
+            optimal_counts = voted & (winner == self.BEST)
+            recommended_counts = voted & (winner == self.RECOMMENDED)
+        else:
+            raise ValueError('Unknown player count rule ' + rule + ', expected one of ' + ', '.join(self.RULES))
+
+        # Games nobody voted on are recommended for their whole player range
+        return optimal_counts, recommended_counts, ~voted.any(axis=1)
+
+    def plurality_winners(self):
+        # The rule add_info_from_fields applies while parsing: the response with the most votes wins, ties going to
+        # the first. A row without results makes the whole player range recommended, dropping the recommended
+        # counts of earlier rows
+        winner = self.votes.argmax(axis=2)
+        optimal_counts = self.has_votes & (winner == self.BEST)
+        recommended_counts = self.has_votes & (winner == self.RECOMMENDED) & (self.positions > self.reset_positions[:, None])
+        return optimal_counts, recommended_counts, self.reset_positions >= 0
+
+    def get_player_range(self, game_index):
+        return range(int(self.min_players[game_index]), int(self.max_players[game_index]) + 1)
+
+    def masks(self, player_counts, whole_range=None):
+        # Player count bitmasks like BoardGame keeps them, one Python int per game. The games in whole_range get
+        # their whole player range on top
+        packed = np.packbits(player_counts, axis=1, bitorder='little')
+        masks = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        if whole_range is not None:
+            for game_index in np.flatnonzero(whole_range).tolist():
+                player_range = self.get_player_range(game_index)
+                if player_range:
+                    masks[game_index] |= (1 << player_range.stop) - (1 << player_range.start)
+        return masks
+
+    def games_by_player_count(self, player_counts, whole_range=None):
+        # Game indexes per player count, in ascending order
+        columns, game_indexes = np.nonzero(player_counts.T)
+        games = dict()
+        for player_count, game_index in zip(columns.tolist(), game_indexes.tolist()):
+            if player_count not in games:
+                games[player_count] = []
+            games[player_count].append(game_index)
+        if whole_range is None:
+            return games
+
+        extended_player_counts = set()
+        for game_index in np.flatnonzero(whole_range).tolist():
+            for player_count in self.get_player_range(game_index):
+                if player_count not in games:
+                    games[player_count] = []
+                games[player_count].append(game_index)
+                extended_player_counts.add(player_count)
+        for player_count in extended_player_counts:
+            games[player_count] = sorted(set(games[player_count]))
+        return dict(sorted(games.items()))
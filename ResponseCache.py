@@ -0,0 +1,136 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+class ResponseCache:
+    CACHE_DIRECTORY = 'bgg_cache/'
+    INDEX_FILENAME = 'index.json'
+    MAX_SIZE = 256*1024*1024 # Bytes of stored response bodies
+    TTLS = {
+        'collection': 60*60, # Seconds, collections change whenever the user logs a purchase
+        'thing': 7*24*60*60,
+    }
+    DEFAULT_TTL = 24*60*60
+    
+    def __init__(self, directory=CACHE_DIRECTORY, max_size=MAX_SIZE, ttls=TTLS):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttls = ttls
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, self.INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as index_file:
+                entries = json.load(index_file)
+        else:
+            entries = dict()
+        # Kept in access order, least recently used first, so eviction never has to sort
+        self.entries = collections.OrderedDict(sorted(entries.items(), key=lambda item: item[1]['last_access']))
+        
+        # Bodies are stored by content hash, so identical responses share one file
+        self.body_references = dict()
+        self.size = 0
+        for entry in self.entries.values():
+            self.add_body_reference(entry)
+            
+    def key(self, endpoint, params):
+        normalized_params = urllib.parse.urlencode(sorted((str(name), str(value)) for name, value in params.items()))
+        return hashlib.sha256((endpoint + '?' + normalized_params).encode('utf-8')).hexdigest()
+    
+    def body_path(self, body_hash):
+        return os.path.join(self.directory, body_hash + '.xml')
+    
+    def add_body_reference(self, entry):
+        if entry['body'] not in self.body_references:
+            self.body_references[entry['body']] = 0
+            self.size += entry['size']
+        self.body_references[entry['body']] += 1
+        
+    def remove_body_reference(self, entry):
+        self.body_references[entry['body']] -= 1
+        if self.body_references[entry['body']] == 0:
+            del self.body_references[entry['body']]
+            self.size -= entry['size']
+            if os.path.exists(self.body_path(entry['body'])):
+                os.remove(self.body_path(entry['body']))
+    
+    def lookup(self, endpoint, params):
+        # Returns the cached entry, stale or not, with its body loaded
+        key = self.key(endpoint, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not os.path.exists(self.body_path(entry['body'])):
+                self.misses += 1
+                return None
+            
+            entry['last_access'] = time.time()
+            self.entries.move_to_end(key)
+            with open(self.body_path(entry['body']), 'rb') as body_file:
+                body = body_file.read()
+                
+            if entry['expires'] > time.time():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return dict(entry, body=body, fresh=entry['expires'] > time.time())
+        
+    def get_fresh(self, endpoint, params):
+        entry = self.lookup(endpoint, params)
+        if entry and entry['fresh']:
+            return entry['body']
+        return None
+    
+    def put(self, endpoint, params, body, etag=None, last_modified=None):
+        key = self.key(endpoint, params)
+        body_hash = hashlib.sha256(body).hexdigest()
+        
+        with self.lock:
+            if key in self.entries:
+                self.remove_body_reference(self.entries[key])
+            
+            if body_hash not in self.body_references:
+                with open(self.body_path(body_hash), 'wb') as body_file:
+                    body_file.write(body)
+            
+            now = time.time()
+            self.entries[key] = {
+                'endpoint': endpoint,
+                'body': body_hash,
+                'size': len(body),
+                'expires': now + self.ttls.get(endpoint, self.DEFAULT_TTL),
+                'last_access': now,
+                'etag': etag,
+                'last_modified': last_modified,
+            }
+            self.entries.move_to_end(key)
+            self.add_body_reference(self.entries[key])
+            self.evict()
+            
+    def refresh(self, endpoint, params):
+        # The server confirmed the cached body is still valid
+        key = self.key(endpoint, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry['expires'] = time.time() + self.ttls.get(endpoint, self.DEFAULT_TTL)
+                entry['last_access'] = time.time()
+                self.entries.move_to_end(key)
+    
+    def evict(self):
+        # Drops least recently used entries until the stored bodies fit within max_size
+        while self.size > self.max_size and self.entries:
+            self.remove_body_reference(self.entries.popitem(last=False)[1])
+            
+    def save(self):
+        index_path = os.path.join(self.directory, self.INDEX_FILENAME)
+        with self.lock:
+            with open(index_path + '.tmp', 'w', encoding='utf-8') as index_file:
+                json.dump(self.entries, index_file)
+            os.replace(index_path + '.tmp', index_path)
@@ -0,0 +1,244 @@
+import array
+import collections.abc
+import mmap
+import os
+import struct
+import sys
+from Collection import BaseGame, Collection, Expansion
+
+class LazyMapping(collections.abc.MutableMapping):
+    # Ordered mapping whose values are built from a snapshot record the first time they are looked up. Assigned
+    # and deleted keys behave like in a dict, so a loaded collection can still be synchronized
+    def __init__(self, positions, load):
+        self.positions = positions # Key to record position, None for values assigned after loading
+        self.load = load
+        self.loaded = dict()
+
+    def __getitem__(self, key):
+        value = self.loaded.get(key)
+        if value is None:
+            value = self.loaded[key] = self.load(self.positions[key])
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.positions:
+            self.positions[key] = None
+        self.loaded[key] = value
+
+    def __delitem__(self, key):
+        del self.positions[key]
+        self.loaded.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class Snapshot:
+    # Read-only image of a parsed collection: fixed-width records for the games and the player count entries, with
+    # every string, id list and player count mask in one string table. The file is memory-mapped, so processes
+    # loading the same snapshot share one copy in the page cache, and only the records looked up are decoded
+    SNAPSHOT_FILENAME = 'collection.snapshot'
+    MAGIC = b'BGGSNAP\0'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIIIIIIQ') # Magic, version, base games, expansions, player counts, entries, strings, offsets position
+    GAME = struct.Struct('<iiii9I') # Statistics, then string references, see write_snapshot
+    PLAYER_COUNT = struct.Struct('<iII') # Player count, first entry, number of entries
+    ENTRY = struct.Struct('<BBII') # Player type, need expansion, base game id, expansion ids
+    PLAYER_TYPES = ['optimal', 'recommended']
+
+    def __init__(self, filename=SNAPSHOT_FILENAME):
+        with open(filename, 'rb') as snapshot_file:
+            self.data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < self.HEADER.size:
+            self.data.close()
+            raise ValueError(filename + ' is truncated')
+        (magic, version, self.n_base_games, self.n_expansions, self.n_player_counts, self.n_entries, n_strings,
+         self.offsets_position) = self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.data.close()
+            raise ValueError(filename + ' is not a collection snapshot of version ' + str(self.VERSION))
+        self.games_position = self.HEADER.size
+        self.player_counts_position = self.games_position + (self.n_base_games + self.n_expansions)*self.GAME.size
+        self.entries_position = self.player_counts_position + self.n_player_counts*self.PLAYER_COUNT.size
+        self.strings_position = self.offsets_position + 8*(n_strings + 1)
+        # A file cut short by a crash or a full disk would only fail once a missing record is looked up
+        if (self.entries_position + self.n_entries*self.ENTRY.size > self.offsets_position
+                or self.strings_position > len(self.data)):
+            self.data.close()
+            raise ValueError(filename + ' is truncated')
+        
+        # The string offsets are read in place, only big-endian machines need a converted copy
+        self.view = memoryview(self.data)
+        if sys.byteorder == 'little':
+            self.offsets = self.view[self.offsets_position:self.strings_position].cast('Q')
+        else:
+            self.offsets = array.array('Q', self.view[self.offsets_position:self.strings_position])
+            self.offsets.byteswap()
+        if self.strings_position + self.offsets[n_strings] != len(self.data):
+            self.close()
+            raise ValueError(filename + ' is truncated')
+        self.strings = dict() # Decoded strings by reference, ids and titles recur across the records
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.view.release()
+        self.data.close()
+
+    def get_bytes(self, reference):
+        return self.data[self.strings_position+self.offsets[reference]:self.strings_position+self.offsets[reference+1]]
+
+    def get_string(self, reference):
+        string = self.strings.get(reference)
+        if string is None:
+            string = self.strings[reference] = sys.intern(self.get_bytes(reference).decode('utf-8'))
+        return string
+
+    def get_ids(self, reference):
+        ids = self.get_string(reference)
+        return [sys.intern(bgg_id) for bgg_id in ids.split(',')] if ids else []
+
+    def get_mask(self, reference):
+        return int.from_bytes(self.get_bytes(reference), 'little')
+
+    def get_game_id(self, position):
+        return self.get_string(self.GAME.unpack_from(self.data, self.games_position + position*self.GAME.size)[4])
+
+    def load_game(self, position, collection):
+        (min_players, max_players, playing_time, bgg_rank, bgg_id, title, short_title, latex_short_title, optimal_mask,
+         recommended_mask, player_count_votes, base_game_links, linked_ids) = self.GAME.unpack_from(
+                 self.data, self.games_position + position*self.GAME.size)
+        if position < self.n_base_games:
+            game = BaseGame(self.get_string(bgg_id))
+            game.bgg_rank = bgg_rank
+            for expansion_id in self.get_ids(linked_ids):
+                game.add_expansion(collection.expansions[expansion_id])
+        else:
+            game = Expansion(self.get_string(bgg_id))
+            game.short_title = self.get_string(short_title)
+            game.latex_short_title = self.get_string(latex_short_title)
+            game.base_game_links = tuple(self.get_ids(base_game_links))
+            game.base_game_ids = tuple(self.get_ids(linked_ids))
+        game.title = self.get_string(title)
+        game.min_players = min_players
+        game.max_players = max_players
+        game.playing_time = playing_time
+        game.optimal_player_mask = self.get_mask(optimal_mask)
+        game.recommended_player_mask = self.get_mask(recommended_mask)
+        game.player_count_votes = self.get_string(player_count_votes)
+        return game
+
+    def load_player_count(self, position):
+        _, first_entry, n_entries = self.PLAYER_COUNT.unpack_from(self.data, self.player_counts_position
+                                                                  + position*self.PLAYER_COUNT.size)
+        player_count = {'optimal': dict(), 'recommended': dict()}
+        start = self.entries_position + first_entry*self.ENTRY.size
+        for player_type, need_expansion, base_game_id, expansion_ids in self.ENTRY.iter_unpack(
+                self.view[start:start + n_entries*self.ENTRY.size]):
+            player_count[self.PLAYER_TYPES[player_type]][self.get_string(base_game_id)] = {
+                    'need_expansion': bool(need_expansion), 'expansions': self.get_ids(expansion_ids)}
+        return player_count
+
+    def load_collection(self):
+        # Only the ids are decoded here, games and player counts are built when first looked up
+        collection = Collection()
+        n_games = self.n_base_games + self.n_expansions
+        collection.base_games = LazyMapping({self.get_game_id(position): position for position in range(self.n_base_games)},
+                                            lambda position: self.load_game(position, collection))
+        collection.expansions = LazyMapping({self.get_game_id(position): position
+                                             for position in range(self.n_base_games, n_games)},
+                                            lambda position: self.load_game(position, collection))
+        player_counts = dict()
+        for position in range(self.n_player_counts):
+            player_count = self.PLAYER_COUNT.unpack_from(self.data, self.player_counts_position
+                                                         + position*self.PLAYER_COUNT.size)[0]
+            player_counts[player_count] = position
+        collection.player_counts = LazyMapping(player_counts, self.load_player_count)
+
+        # The reverse links are only needed when the collection changes, but they are cheap to rebuild
+        for position in range(self.n_base_games, n_games):
+            record = self.GAME.unpack_from(self.data, self.games_position + position*self.GAME.size)
+            bgg_id = self.get_string(record[4])
+            for base_game_id in self.get_ids(record[11]):
+                if base_game_id not in collection.expansion_links:
+                    collection.expansion_links[base_game_id] = dict()
+                collection.expansion_links[base_game_id][bgg_id] = None
+        return collection
+
+
+class StringTable:
+    # Deduplicated byte strings, referenced by index
+    def __init__(self):
+        self.references = dict()
+        self.strings = []
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        reference = self.references.get(value)
+        if reference is None:
+            reference = self.references[value] = len(self.strings)
+            self.strings.append(value)
+        return reference
+
+    def add_ids(self, bgg_ids):
+        return self.add(','.join(bgg_ids))
+
+    def add_mask(self, mask):
+        return self.add(mask.to_bytes((mask.bit_length() + 7)//8, 'little'))
+
+
+def write_snapshot(collection, filename=Snapshot.SNAPSHOT_FILENAME):
+    # Written once after parsing, to a temporary file that replaces the old snapshot only once complete
+    strings = StringTable()
+    records = []
+    for game in list(collection.base_games.values()) + list(collection.expansions.values()):
+        if isinstance(game, BaseGame):
+            bgg_rank = game.bgg_rank
+            short_title = latex_short_title = base_game_links = strings.add('')
+            linked_ids = strings.add_ids(game.expansions)
+        else:
+            bgg_rank = BaseGame.NO_VALUE
+            short_title = strings.add(game.short_title)
+            latex_short_title = strings.add(game.latex_short_title)
+            base_game_links = strings.add_ids(game.base_game_links)
+            linked_ids = strings.add_ids(game.base_game_ids)
+        records.append(Snapshot.GAME.pack(game.min_players, game.max_players, game.playing_time, bgg_rank,
+                                          strings.add(game.bgg_id), strings.add(game.title), short_title,
+                                          latex_short_title, strings.add_mask(game.optimal_player_mask),
+                                          strings.add_mask(game.recommended_player_mask),
+                                          strings.add(game.player_count_votes), base_game_links, linked_ids))
+
+    player_count_records = []
+    entries = []
+    for player_count, player_count_entries in collection.player_counts.items():
+        first_entry = len(entries)
+        for player_type_index, player_type in enumerate(Snapshot.PLAYER_TYPES):
+            for base_game_id, entry in player_count_entries[player_type].items():
+                entries.append(Snapshot.ENTRY.pack(player_type_index, entry['need_expansion'], strings.add(base_game_id),
+                                                   strings.add_ids(entry['expansions'])))
+        player_count_records.append(Snapshot.PLAYER_COUNT.pack(player_count, first_entry, len(entries) - first_entry))
+    records.extend(player_count_records)
+    records.extend(entries)
+
+    records_size = sum(len(record) for record in records)
+    padding = -(Snapshot.HEADER.size + records_size) % 8
+    offsets = [0]
+    for string in strings.strings:
+        offsets.append(offsets[-1] + len(string))
+
+    with open(filename + '.tmp', 'wb') as snapshot_file:
+        snapshot_file.write(Snapshot.HEADER.pack(Snapshot.MAGIC, Snapshot.VERSION, len(collection.base_games),
+                                                 len(collection.expansions), len(player_count_records), len(entries),
+                                                 len(strings.strings), Snapshot.HEADER.size + records_size + padding))
+        snapshot_file.writelines(records)
+        snapshot_file.write(b'\0'*padding)
+        snapshot_file.write(struct.pack('<' + str(len(offsets)) + 'Q', *offsets))
+        snapshot_file.writelines(strings.strings)
+    os.replace(filename + '.tmp', filename)
@@ -0,0 +1,368 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from BoardGameGeekAPI import BoardGameGeekAPI
+from Collection import BaseGame, Collection, extract_item_fields
+from Exporter import CSVExporter, HTMLExporter, JSONExporter
+from LatexHandler import LatexHandler
+from GameStore import GameStore
+from MockBGGServer import MockBGGServer
+from PollAnalysis import np
+from Snapshot import Snapshot, write_snapshot
+
+CORPUS_DIRECTORY = 'bgg_corpus/' # Saved thing responses, one or more items per file
+RESULTS_FILENAME = 'benchmark_results.json'
+SCENARIO_SIZES = (100, 1000, 10000) # Games per scenario, two base games to every expansion
+TOLERANCE = 0.25 # Slowdown against the baseline reported as a regression
+
+def benchmark_fetch(api_url, max_workers, batch_size):
+    api = BoardGameGeekAPI('benchmark', api_url, batch_size=batch_size, max_workers=max_workers,
+                           requests_per_second=200, retry_delay=0.05)
+    collection = Collection()
+    
+    start = time.perf_counter()
+    xml_collection = api.query_bgg_collection()
+    game_ids = collection.parse_xml_collection(xml_collection)
+    xml_games = api.query_bgg_ids(game_ids)
+    elapsed = time.perf_counter() - start
+    
+    connection_stats = api.connection_stats()
+    api.close()
+    return elapsed, len(xml_games['xml_base_games']) + len(xml_games['xml_expansions']), connection_stats
+
+def run_fetch_benchmarks():
+    print('Fetch benchmark (400 base games, 200 expansions, 20 ms latency, 10 % 202, 10 % 429)')
+    mock = MockBGGServer(400, 200, latency=0.02, queued_probability=0.1, throttled_probability=0.1)
+    api_url = mock.start()
+    
+    scenarios = [
+        ('Sequential, one id per request', 1, 1),
+        ('Sequential, batched', 1, BoardGameGeekAPI.BATCH_SIZE),
+        ('Concurrent, one id per request', 8, 1),
+        ('Concurrent, batched', 8, BoardGameGeekAPI.BATCH_SIZE),
+    ]
+    for name, max_workers, batch_size in scenarios:
+        elapsed, n_games, connection_stats = benchmark_fetch(api_url, max_workers, batch_size)
+        print('\t' + name + ': ' + str(n_games) + ' games in ' + str(round(elapsed, 2)) + ' s')
+        print('\t\t' + str(connection_stats['requests']) + ' requests over ' 
+              + str(connection_stats['connections_opened']) + ' connections, ' 
+              + str(connection_stats['bytes_transferred']) + ' bytes transferred (' 
+              + str(connection_stats['bytes_decoded']) + ' decoded)')
+        
+    mock.stop()
+    
+def load_corpus():
+    items = []
+    for filename in sorted(glob.glob(os.path.join(CORPUS_DIRECTORY, '*.xml'))):
+        items += ET.parse(filename).getroot().findall('item')
+    
+    if not items:
+        mock = MockBGGServer(2000, 0)
+        items = [ET.fromstring(mock.items[bgg_id]) for bgg_id in mock.base_game_ids]
+    return items
+
+def xpath_fields(xml_item):
+    # The descendant searches add_info_from_xml ran before the single pass extractor, kept as reference
+    xml_item.find('.//name[@type="primary"]').get('value')
+    int(xml_item.find('.//minplayers').get('value'))
+    int(xml_item.find('.//maxplayers').get('value'))
+    int(xml_item.find('.//playingtime').get('value'))
+    for results in xml_item.find('.//poll[@name="suggested_numplayers"]'):
+        if len(results) and results.attrib['numplayers'].isdigit():
+            int(results.find('./result[@value="Best"]').get('numvotes'))
+            int(results.find('./result[@value="Recommended"]').get('numvotes'))
+            int(results.find('./result[@value="Not Recommended"]').get('numvotes'))
+    xml_item.find('.//rank[@friendlyname="Board Game Rank"]').get('value')
+    xml_item.findall('.//link[@type="boardgameexpansion"][@inbound="true"]')
+
+def time_per_item(function, items, repeats=5):
+    best = None
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best/len(items)
+
+def run_parse_benchmarks():
+    items = load_corpus()
+    print('Parse benchmark (' + str(len(items)) + ' items)')
+    
+    scenarios = [
+        ('Descendant searches', xpath_fields),
+        ('Single pass extractor', extract_item_fields),
+        ('BaseGame.add_info_from_xml', lambda item: BaseGame('0').add_info_from_xml(item)),
+    ]
+    for name, function in scenarios:
+        print('\t' + name + ': ' + str(round(time_per_item(function, items)*1e6, 1)) + ' us per item')
+
+def run_memory_benchmark(n_base_games=5000, n_expansions=2500):
+    mock = MockBGGServer(n_base_games, n_expansions)
+    xml_items = [(bgg_id, ET.fromstring(mock.items[bgg_id])) for bgg_id in mock.base_game_ids + mock.expansion_ids]
+    xml_collection = {
+        'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+        'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+    }
+    
+    # Only the model built from the items is traced, not the XML itself
+    tracemalloc.start()
+    collection = Collection()
+    collection.parse_xml_collection(xml_collection)
+    collection.parse_xml_items(xml_items)
+    collection_size = tracemalloc.get_traced_memory()[0]
+    collection.player_counts = dict()
+    model_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    n_games = len(collection.base_games) + len(collection.expansions)
+    print('Memory benchmark (' + str(n_base_games) + ' base games, ' + str(n_expansions) + ' expansions)')
+    print('\tGames: ' + str(round(model_size/n_games)) + ' bytes per game')
+    print('\tGames and player counts: ' + str(round(collection_size/n_games)) + ' bytes per game')
+
+def run_linking_benchmark(sizes=(1000, 5000, 20000, 50000)):
+    print('Parse and link scaling benchmark (one base game in ten expansions is shared)')
+    for size in sizes:
+        mock = MockBGGServer(size*2//3, size//3)
+        xml_items = [(bgg_id, ET.fromstring(mock.items[bgg_id])) for bgg_id in mock.base_game_ids + mock.expansion_ids]
+        xml_collection = {
+            'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+            'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+        }
+        
+        start = time.perf_counter()
+        collection = Collection()
+        collection.parse_xml_collection(xml_collection)
+        collection.parse_xml_items(xml_items)
+        elapsed = time.perf_counter() - start
+        print('\t' + str(size) + ' items: ' + str(round(elapsed, 2)) + ' s, ' + str(round(elapsed/size*1e6, 1)) + ' us per item')
+
+def build_collection(n_base_games, n_expansions):
+    mock = MockBGGServer(n_base_games, n_expansions)
+    xml_collection = {
+        'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+        'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+    }
+    collection = Collection()
+    collection.parse_xml_collection(xml_collection)
+    collection.parse_xml_items((bgg_id, ET.fromstring(mock.items[bgg_id])) for bgg_id in mock.base_game_ids + mock.expansion_ids)
+    return collection
+
+def run_render_benchmark(n_base_games=5000, n_expansions=2500):
+    collection = build_collection(n_base_games, n_expansions)
+    print('Render benchmark (' + str(n_base_games) + ' base games, ' + str(n_expansions) + ' expansions)')
+    
+    with tempfile.TemporaryDirectory() as latex_path:
+        latex = LatexHandler(collection, latex_path + '/', 'collection.tex')
+        start = time.perf_counter()
+        latex.create_tex()
+        elapsed = time.perf_counter() - start
+        print('\tcreate_tex: ' + str(round(elapsed, 2)) + ' s, ' + str(os.path.getsize(latex_path + '/collection.tex')) + ' bytes')
+        
+    start = time.perf_counter()
+    latex.write(io.StringIO())
+    elapsed = time.perf_counter() - start
+    print('\tIn-memory buffer: ' + str(round(elapsed, 2)) + ' s')
+    
+    for section in [latex.render_player_count_tables, latex.render_game_history]:
+        start = time.perf_counter()
+        for fragment in section():
+            pass
+        elapsed = time.perf_counter() - start
+        print('\t\t' + section.__name__ + ': ' + str(round(elapsed, 3)) + ' s')
+
+def best_time(function, repeats=7):
+    best = None
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def scenario_mock(n_games, **options):
+    # Served from the corpus when there is one large enough, so recorded games can stand in for generated ones
+    n_base_games = n_games*2//3
+    if len(glob.glob(os.path.join(CORPUS_DIRECTORY, '*.xml'))):
+        mock = MockBGGServer(corpus_directory=CORPUS_DIRECTORY, **options)
+        if len(mock.items) >= n_games:
+            mock.base_game_ids = mock.base_game_ids[:n_base_games]
+            mock.expansion_ids = mock.expansion_ids[:n_games - len(mock.base_game_ids)]
+            return mock
+    return MockBGGServer(n_base_games, n_games - n_base_games, **options)
+
+def scenario_fetch(n_games):
+    # 10 ms latency, collections queued for half a second and 429 above 60 requests per second, while the 
+    # client allows itself 80, so the backoff is part of the measurement
+    mock = scenario_mock(n_games, latency=0.01, queue_delay=0.5, rate_limit=60)
+    api_url = mock.start()
+    api = BoardGameGeekAPI('benchmark', api_url, max_workers=8, requests_per_second=80, retry_delay=0.1)
+    
+    start = time.perf_counter()
+    collection = Collection()
+    game_ids = collection.parse_xml_collection(api.query_bgg_collection())
+    api.query_bgg_ids(game_ids)
+    elapsed = time.perf_counter() - start
+    
+    api.close()
+    mock.stop()
+    return elapsed
+
+def scenario_xml_games(mock):
+    xml_collection = {
+        'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+        'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+    }
+    xml_games = {
+        'xml_base_games': {bgg_id: ET.fromstring('<items>' + mock.items[bgg_id] + '</items>') for bgg_id in mock.base_game_ids},
+        'xml_expansions': {bgg_id: ET.fromstring('<items>' + mock.items[bgg_id] + '</items>') for bgg_id in mock.expansion_ids},
+    }
+    return xml_collection, xml_games
+
+def scenario_parse(xml_collection, xml_games):
+    collection = Collection()
+    collection.parse_xml_collection(xml_collection)
+    collection.parse_xml_games(xml_games)
+    return collection
+
+def scenario_player_counts(collection):
+    # Rebuilds every player count entry of the parsed collection
+    collection.player_counts = dict()
+    for bgg_id in collection.base_games:
+        collection.update_player_counts_base_game(bgg_id)
+    for bgg_id, expansion in collection.expansions.items():
+        for base_game_id in expansion.base_game_ids:
+            collection.update_player_counts_expansion(bgg_id, base_game_id)
+
+def scenario_render(collection, exporter_class=LatexHandler):
+    with tempfile.TemporaryDirectory() as output_path:
+        exporter_class(collection, output_path + '/', 'collection' + exporter_class.EXTENSION).export()
+
+def scenario_load_snapshot(filename):
+    snapshot = Snapshot(filename)
+    snapshot.load_collection()
+    snapshot.close()
+
+def scenario_reload(collection):
+    # Loading the saved collection back from the game store and from a snapshot
+    with tempfile.TemporaryDirectory() as directory:
+        store = GameStore(directory + '/games.sqlite')
+        collection.save_state(store)
+        write_snapshot(collection, directory + '/' + Snapshot.SNAPSHOT_FILENAME)
+        load_store = best_time(lambda: Collection().load_state(store))
+        store.close()
+        
+        load_snapshot = best_time(lambda: scenario_load_snapshot(directory + '/' + Snapshot.SNAPSHOT_FILENAME))
+    return load_store, load_snapshot
+
+def run_scenario_benchmarks(sizes=SCENARIO_SIZES):
+    # Best of seven for the offline scenarios, the fetch scenario runs once as it mostly waits
+    results = {'query_bgg_ids': {}, 'parse_xml_games': {}, 'update_player_counts': {}, 'create_tex': {},
+               'export_json': {}, 'export_csv': {}, 'export_html': {}, 'load_store': {}, 'load_snapshot': {}}
+    if np is not None:
+        results['player_count_rule'] = {}
+    print('Scenario benchmarks')
+    for n_games in sizes:
+        size = str(n_games)
+        results['query_bgg_ids'][size] = scenario_fetch(n_games)
+        
+        xml_collection, xml_games = scenario_xml_games(scenario_mock(n_games))
+        results['parse_xml_games'][size] = best_time(lambda: scenario_parse(xml_collection, xml_games))
+        collection = scenario_parse(xml_collection, xml_games)
+        results['update_player_counts'][size] = best_time(lambda: scenario_player_counts(collection))
+        results['create_tex'][size] = best_time(lambda: scenario_render(collection))
+        for exporter_class in [JSONExporter, CSVExporter, HTMLExporter]:
+            results['export_' + exporter_class.FORMAT][size] = best_time(lambda: scenario_render(collection, exporter_class))
+        results['load_store'][size], results['load_snapshot'][size] = scenario_reload(collection)
+        if np is not None:
+            # Player counts of the whole collection under another rule, from the votes kept while parsing
+            collection.apply_player_count_rule('majority')
+            results['player_count_rule'][size] = best_time(lambda: collection.apply_player_count_rule('majority'))
+        
+        for scenario in results:
+            print('\t' + scenario + ', ' + size + ' games: ' + str(round(results[scenario][size], 4)) + ' s')
+    return results
+
+def save_results(results, filename):
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(filename, 'w', encoding='utf-8') as results_file:
+        json.dump(report, results_file, indent=1)
+        
+def compare_results(results, filename, tolerance=TOLERANCE):
+    # Returns the scenarios that got slower than the baseline by more than the tolerance
+    try:
+        with open(filename, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    except FileNotFoundError:
+        # Timings only compare on the same machine, so there is no baseline in the repository
+        print('No stored results to compare with in ' + filename + ', record a baseline with --save first')
+        return []
+    
+    print('Comparison with ' + filename)
+    regressions = []
+    for scenario in results:
+        for size in results[scenario]:
+            if size not in baseline.get(scenario, {}):
+                continue
+            ratio = results[scenario][size]/baseline[scenario][size]
+            line = '\t' + scenario + ', ' + size + ' games: ' + str(round(ratio, 2)) + 'x baseline'
+            if ratio > 1 + tolerance:
+                regressions.append((scenario, size))
+                line += ' REGRESSION'
+            print(line)
+    return regressions
+
+def parse_arguments(arguments):
+    benchmarks = ['fetch', 'parse', 'memory', 'linking', 'render', 'scenarios']
+    parser = argparse.ArgumentParser(description='Offline benchmarks against the mock BoardGameGeek server')
+    parser.add_argument('benchmarks', nargs='*', choices=benchmarks, default=benchmarks)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SCENARIO_SIZES, help='games per scenario')
+    parser.add_argument('--save', nargs='?', const=RESULTS_FILENAME, help='store the scenario results as JSON')
+    parser.add_argument('--compare', nargs='?', const=RESULTS_FILENAME, 
+                        help='compare the scenario results with stored ones, exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    return parser.parse_args(arguments)
+
+def main(arguments):
+    args = parse_arguments(arguments)
+    logging.basicConfig(level=logging.ERROR) # The 202 and 429 warnings are expected here
+    
+    benchmarks = {
+        'fetch': run_fetch_benchmarks,
+        'parse': run_parse_benchmarks,
+        'memory': run_memory_benchmark,
+        'linking': run_linking_benchmark,
+        'render': run_render_benchmark,
+    }
+    for name in args.benchmarks:
+        if name in benchmarks:
+            benchmarks[name]()
+    
+    if 'scenarios' not in args.benchmarks:
+        return 0
+    results = run_scenario_benchmarks(args.sizes)
+    regressions = []
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+    if args.save:
+        save_results(results, args.save)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
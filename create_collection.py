@@ -1,26 +1,110 @@
+import argparse
+import cProfile
+import logging
+import os
+import sys
 from BoardGameGeekAPI import BoardGameGeekAPI
-from Collection import Collection
-from LatexHandler import LatexHandler
+from CollectionDaemon import CollectionDaemon
+from GameStore import GameStore
+from Instrumentation import metrics
+from Pipeline import EXPORTERS, BatchPipeline, Pipeline
+from PollAnalysis import PollAnalysis
+from ResponseCache import ResponseCache
 
-api = BoardGameGeekAPI('Cyduck')
-       
-# Import collection from BGG 
-collection = Collection()  
-xml_collection = api.query_bgg_collection()      
-game_ids = collection.parse_xml_collection(xml_collection)
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(description='Create a LaTeX collection book from a BoardGameGeek collection')
+    parser.add_argument('usernames', nargs='*', 
+                        help='BoardGameGeek users whose collections are used, several users run in batch mode')
+    parser.add_argument('--users-file', help='file with one BoardGameGeek user per line, runs in batch mode')
+    parser.add_argument('--api-url', default=BoardGameGeekAPI.API_URL, help='BoardGameGeek XML API endpoint')
+    parser.add_argument('--output', default='../Latex/', help='directory of the LaTeX document')
+    parser.add_argument('--filename', default='collection.tex', help='name of the LaTeX document')
+    parser.add_argument('--store', default=GameStore.STORE_FILENAME, help='game store database')
+    parser.add_argument('--max-age', type=float, default=GameStore.MAX_AGE,
+                        help='seconds before a stored game is fetched again')
+    parser.add_argument('--cache', default=ResponseCache.CACHE_DIRECTORY, help='response cache directory')
+    parser.add_argument('--full', action='store_true', help='parse the whole collection instead of only added games')
+    parser.add_argument('--formats', nargs='+', default=['tex'], choices=list(EXPORTERS),
+                        help='output formats, written next to the LaTeX document with their own extension')
+    parser.add_argument('--pdf', action='store_true', help='also compile the PDF')
+    parser.add_argument('--fetch-workers', type=int, default=BoardGameGeekAPI.MAX_WORKERS,
+                        help='concurrent BoardGameGeek queries')
+    parser.add_argument('--queue-size', type=int, default=BoardGameGeekAPI.QUEUE_SIZE,
+                        help='fetched games waiting to be parsed')
+    parser.add_argument('--compile-workers', type=int, default=None, help='concurrent LaTeX compiler processes')
+    parser.add_argument('--player-count-rule', choices=PollAnalysis.RULES,
+                        help='recompute best and recommended player counts from the poll votes under this rule, needs NumPy')
+    parser.add_argument('--resume', action='store_true', help='skip the stages completed by the last run of a single user')
+    parser.add_argument('--dry-run', action='store_true', help='only report what a run would fetch and render')
+    parser.add_argument('--cache-only', action='store_true', help='use cached responses only, never the network')
+    parser.add_argument('--daemon', action='store_true', 
+                        help='keep running, regenerate when the collections change or on a request to the local port')
+    parser.add_argument('--poll-interval', type=float, default=CollectionDaemon.POLL_INTERVAL,
+                        help='seconds between polls of the collections in daemon mode')
+    parser.add_argument('--port', type=int, default=CollectionDaemon.PORT, help='local HTTP port of the daemon')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG also lists every query and parsed game')
+    parser.add_argument('--metrics', help='write timers and counters of the run to this JSON file')
+    parser.add_argument('--profile', help='write cProfile statistics of the run to this file')
+    args = parser.parse_args(arguments)
+    if not args.usernames and not args.users_file:
+        parser.error('give at least one username or a --users-file')
+    return args
 
-load_from_file = False
-if load_from_file:
-    collection.import_xml_games()
-    
-else:
-    xml_games = api.query_bgg_ids(game_ids)
-    collection.export_xml_games(xml_games)
-    collection.parse_xml_games(xml_games)
+def main(arguments):
+    args = parse_arguments(arguments)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.reset()
+    latex_path = os.path.join(args.output, '')
+    usernames = args.usernames
+    if args.users_file:
+        with open(args.users_file, encoding='utf-8') as users_file:
+            usernames = [line.strip() for line in users_file if line.strip()]
+        if not usernames:
+            logging.error('No users in %s', args.users_file)
+            return 1
+    batch = args.users_file or len(usernames) > 1
 
-# Create PDF
-latex_path = "../Latex/"
-latex_filename = "collection.tex"
-latex = LatexHandler(collection, latex_path, latex_filename) 
-latex.create_tex()
-#latex.compile_latex()
\ No newline at end of file
+    api = BoardGameGeekAPI(usernames[0], api_url=args.api_url, max_workers=args.fetch_workers, queue_size=args.queue_size,
+                           cache=ResponseCache(args.cache), cache_only=args.cache_only)
+    store = GameStore(args.store, check_same_thread=not args.daemon, max_age=args.max_age) # The daemon regenerates from its HTTP threads
+    if args.daemon:
+        pipeline = CollectionDaemon(api, store, latex_path, args.filename, usernames, formats=args.formats, 
+                                    compile_pdf=args.pdf, compile_workers=args.compile_workers, 
+                                    player_count_rule=args.player_count_rule, poll_interval=args.poll_interval, 
+                                    port=args.port)
+    elif batch:
+        pipeline = BatchPipeline(api, store, latex_path, args.filename, usernames, incremental=not args.full, 
+                                 compile_pdf=args.pdf, compile_workers=args.compile_workers, 
+                                 player_count_rule=args.player_count_rule, formats=args.formats)
+    else:
+        pipeline = Pipeline(api, store, latex_path, args.filename, incremental=not args.full, compile_pdf=args.pdf,
+                            compile_workers=args.compile_workers, player_count_rule=args.player_count_rule, 
+                            formats=args.formats)
+    profile = cProfile.Profile() if args.profile else None
+    try:
+        if profile:
+            profile.enable()
+        if args.daemon:
+            pipeline.serve_forever()
+        elif args.dry_run:
+            pipeline.dry_run()
+        elif batch:
+            pipeline.run()
+        else:
+            pipeline.run(resume=args.resume)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+        if args.metrics:
+            metrics.write_json(args.metrics, {
+                'connections': api.connection_stats(),
+                'cache': {'hits': api.cache.hits, 'misses': api.cache.misses},
+            })
+        api.close()
+        store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
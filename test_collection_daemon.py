@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.request
+from BoardGameGeekAPI import BoardGameGeekAPI
+from CollectionDaemon import CollectionDaemon
+from GameStore import GameStore
+from MockBGGServer import MockBGGServer
+from Pipeline import Pipeline
+from ResponseCache import ResponseCache
+
+class CollectionDaemonTest(unittest.TestCase):
+    # Drives the daemon against the mock server: after every poll its document has to be the one a fresh run on
+    # the same collection renders
+    USERNAME = 'tester'
+    ADDED_ID = 5000 # Ids of games added during a test, clear of the generated ones
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mock = MockBGGServer(60, 40, seed=7)
+        self.url = self.mock.start()
+        self.next_id = self.ADDED_ID
+        self.failing = False
+        respond = self.mock.respond
+        self.mock.respond = lambda path, params: (500, '') if self.failing and path.endswith('/thing') else respond(path, params)
+
+        self.api = BoardGameGeekAPI(self.USERNAME, api_url=self.url, requests_per_second=1000,
+                                    cache=ResponseCache(os.path.join(self.directory, 'cache', '')))
+        self.store = GameStore(os.path.join(self.directory, 'games.sqlite'), check_same_thread=False)
+        self.output_path = os.path.join(self.directory, 'daemon', '')
+        self.daemon = CollectionDaemon(self.api, self.store, self.output_path, 'collection.tex', [self.USERNAME], port=0)
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.api.close()
+        self.store.close()
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+    def add_games(self, n_base_games, n_expansions, position):
+        # Listed at position, so they don't simply end up last. Expansions go to the added and to existing games
+        base_game_ids = []
+        for _ in range(n_base_games):
+            bgg_id = str(self.next_id)
+            self.next_id += 1
+            self.mock.titles[bgg_id] = 'Added game ' + bgg_id
+            self.mock.items[bgg_id] = self.mock.thing_item(bgg_id, 'boardgame', [])
+            base_game_ids.append(bgg_id)
+        expansion_ids = []
+        for index in range(n_expansions):
+            bgg_id = str(self.next_id)
+            self.next_id += 1
+            base_game_id = (base_game_ids + self.mock.base_game_ids)[index % (len(base_game_ids) + 3)]
+            self.mock.titles[bgg_id] = self.mock.titles[base_game_id] + ': Added expansion ' + bgg_id
+            self.mock.items[bgg_id] = self.mock.thing_item(bgg_id, 'boardgameexpansion', [base_game_id])
+            expansion_ids.append(bgg_id)
+        self.mock.base_game_ids[position:position] = base_game_ids
+        self.mock.expansion_ids[position:position] = expansion_ids
+
+    def remove_games(self, base_game_ids, expansion_ids):
+        for bgg_id in base_game_ids:
+            self.mock.base_game_ids.remove(bgg_id)
+        for bgg_id in expansion_ids:
+            self.mock.expansion_ids.remove(bgg_id)
+
+    def render_fresh(self):
+        output_path = os.path.join(self.directory, 'fresh', '')
+        store_filename = os.path.join(self.directory, 'fresh.sqlite')
+        shutil.rmtree(output_path, ignore_errors=True)
+        if os.path.exists(store_filename):
+            os.remove(store_filename)
+        api = BoardGameGeekAPI(self.USERNAME, api_url=self.url, requests_per_second=1000)
+        store = GameStore(store_filename)
+        try:
+            Pipeline(api, store, output_path, 'collection.tex', incremental=False).run()
+        finally:
+            api.close()
+            store.close()
+        return self.read_output(output_path)
+
+    def read_output(self, output_path=None):
+        with open((output_path or self.output_path) + 'collection.tex', encoding='utf-8') as tex_file:
+            return tex_file.read()
+
+    def assert_fresh(self):
+        self.assertEqual(self.read_output(), self.render_fresh())
+
+    def test_polls(self):
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertEqual(result['added'], 100)
+        self.assertTrue(result['rendered'])
+        self.assert_fresh()
+
+        # Nothing changed: both listings are revalidated with 304s and nothing is rendered
+        not_modified = self.mock.status_counts.get(304, 0)
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertEqual((result['added'], result['removed'], result['rendered']), (0, 0, False))
+        self.assertEqual(self.mock.status_counts.get(304, 0), not_modified + 2)
+
+        self.add_games(3, 5, 10)
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertEqual((result['added'], result['removed'], result['rendered']), (8, 0, True))
+        self.assert_fresh()
+
+        # Removed base games take their expansions' links along, the expansions stay in the collection
+        self.remove_games(self.mock.base_game_ids[:4], self.mock.expansion_ids[-3:])
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertEqual((result['added'], result['removed'], result['rendered']), (0, 7, True))
+        self.assert_fresh()
+
+    def test_expansion_of_stored_and_fetched_games(self):
+        # The expansion links a base game loaded from the store and one fetched in the same poll. It must not be
+        # attached to the fetched one before that is parsed, or the base game's player counts lose it
+        stored_id, fetched_id, expansion_id = str(self.next_id), str(self.next_id + 1), str(self.next_id + 2)
+        self.next_id += 3
+        for bgg_id in (stored_id, fetched_id):
+            self.mock.titles[bgg_id] = 'Linked game ' + bgg_id
+            self.mock.items[bgg_id] = self.mock.thing_item(bgg_id, 'boardgame', [])
+        self.mock.titles[expansion_id] = 'Linked game ' + stored_id + ': Expansion'
+        self.mock.items[expansion_id] = self.mock.thing_item(expansion_id, 'boardgameexpansion', [stored_id, fetched_id])
+        self.mock.base_game_ids.append(stored_id)
+        self.mock.expansion_ids.append(expansion_id)
+        self.daemon.regenerate(self.USERNAME)
+
+        # A removed base game stays in the store
+        self.remove_games([stored_id], [])
+        self.daemon.regenerate(self.USERNAME)
+        self.mock.base_game_ids[:0] = [stored_id, fetched_id]
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertEqual(result['added'], 2)
+
+        collection = self.daemon.collections[self.USERNAME]
+        expansion = collection.expansions[expansion_id]
+        self.assertEqual(expansion.base_game_ids, (stored_id, fetched_id))
+        for player_count in expansion.optimal_player_count:
+            self.assertIn(expansion_id, collection.player_counts[player_count]['optimal'][fetched_id]['expansions'])
+        for player_count in expansion.recommended_player_count:
+            self.assertIn(expansion_id, collection.player_counts[player_count]['recommended'][fetched_id]['expansions'])
+        self.assert_fresh()
+
+    def test_failed_poll(self):
+        self.daemon.regenerate(self.USERNAME)
+
+        # The added games can't be fetched. The poll fails, and the next one renders them once they can
+        self.add_games(10, 10, 0)
+        self.failing = True
+        with self.assertLogs(level='WARNING') as logs:
+            results = self.daemon.regenerate_all()
+        self.assertIn('error', results[self.USERNAME])
+        self.assertTrue(any('Regenerating the collection of user ' + self.USERNAME + ' failed' in line
+                            for line in logs.output))
+        self.failing = False
+
+        result = self.daemon.regenerate(self.USERNAME)
+        self.assertTrue(result['rendered'])
+        self.assertEqual(result['base_games'], 70)
+        collection = self.daemon.collections[self.USERNAME]
+        self.assertTrue(all(base_game.title for base_game in collection.base_games.values()))
+        self.assert_fresh()
+
+    def test_http_endpoint(self):
+        url = self.daemon.start()
+        request = urllib.request.Request(url + 'regenerate?user=' + self.USERNAME, method='POST')
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(json.load(response)[self.USERNAME]['added'], 100)
+        with urllib.request.urlopen(url + 'status') as response:
+            status = json.load(response)
+        self.assertEqual(status['results'][self.USERNAME]['base_games'], 60)
+        self.assert_fresh()
+
+if __name__ == '__main__':
+    unittest.main()
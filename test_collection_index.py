@@ -0,0 +1,68 @@
+import random
+import unittest
+import xml.etree.ElementTree as ET
+from Collection import BaseGame, Collection
+from MockBGGServer import MockBGGServer
+
+class CollectionIndexTest(unittest.TestCase):
+    # Random queries against a plain scan over the player counts, sorted by the same keys. Large enough for the
+    # range indexes to have several prefix blocks
+    N_QUERIES = 500
+
+    def setUp(self):
+        mock = MockBGGServer(600, 200, seed=17)
+        mock.server.server_close() # Only its games are used
+        self.collection = Collection()
+        self.collection.parse_xml_collection({
+            'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+            'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+        })
+        self.collection.parse_xml_items((bgg_id, ET.fromstring(mock.items[bgg_id]))
+                                        for bgg_id in mock.base_game_ids + mock.expansion_ids)
+
+        # Titles shared by several games, so ties in every sort order are broken the same way
+        for base_game in list(self.collection.base_games.values())[::7]:
+            base_game.title = 'Shared title'
+        self.collection.add_sort_key('max_players', lambda base_game: (base_game.max_players, base_game.title))
+
+    def scan(self, player_count=None, player_type='optimal', min_playing_time=None, max_playing_time=None,
+             max_bgg_rank=None, sort_by='title', limit=None):
+        if player_count is None:
+            base_game_ids = list(self.collection.base_games)
+        else:
+            base_game_ids = list(self.collection.player_counts.get(player_count, {player_type: dict()})[player_type])
+        matches = []
+        for base_game_id in base_game_ids:
+            base_game = self.collection.base_games[base_game_id]
+            if min_playing_time is not None and base_game.playing_time < min_playing_time:
+                continue
+            if max_playing_time is not None and base_game.playing_time > max_playing_time:
+                continue
+            if max_bgg_rank is not None and base_game.bgg_rank > max_bgg_rank:
+                continue
+            matches.append(base_game_id)
+
+        # Games with the same key keep their title order, and games with the same title their collection order
+        position = {base_game_id: index for index, base_game_id in enumerate(self.collection.base_games)}
+        matches.sort(key=lambda base_game_id: (self.collection.base_games[base_game_id].title, position[base_game_id]))
+        sort_key = self.collection.sort_keys[sort_by]
+        matches.sort(key=lambda base_game_id: sort_key(self.collection.base_games[base_game_id]))
+        return matches[:limit]
+
+    def test_random_queries(self):
+        generator = random.Random(5)
+        playing_times = [None, 0, 15, 30, 45, 60, 100, 180, BaseGame.NO_VALUE]
+        for _ in range(self.N_QUERIES):
+            filters = {
+                'player_count': generator.choice([None] + list(range(10))),
+                'player_type': generator.choice(['optimal', 'recommended']),
+                'min_playing_time': generator.choice(playing_times),
+                'max_playing_time': generator.choice(playing_times),
+                'max_bgg_rank': generator.choice([None, 1, 500, generator.randint(1, 20000), BaseGame.NO_VALUE]),
+                'sort_by': generator.choice(['title', 'playing_time', 'bgg_rank', 'max_players']),
+                'limit': generator.choice([None, 0, 1, generator.randint(1, 600)]),
+            }
+            self.assertEqual(self.collection.query(**filters), self.scan(**filters), filters)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import unittest
+import xml.etree.ElementTree as ET
+from Collection import Collection
+from Exporter import CSVExporter, HTMLExporter, JSONExporter
+from MockBGGServer import MockBGGServer
+
+class ExporterTest(unittest.TestCase):
+    # Every format has to come out parseable with one row per player count entry and game, whatever the titles hold
+    TITLE = 'Cats & <Dogs>'
+    EXPANSION_TITLE = TITLE + ': Fish & <Chips>'
+
+    def setUp(self):
+        mock = MockBGGServer(40, 20, seed=19)
+        mock.server.server_close() # Only its games are used
+        base_game_id = mock.base_game_ids[0]
+        expansion_id = mock.expansion_ids[0]
+        mock.titles[base_game_id] = self.TITLE
+        mock.items[base_game_id] = mock.thing_item(base_game_id, 'boardgame', [])
+        mock.titles[expansion_id] = self.EXPANSION_TITLE
+        mock.items[expansion_id] = mock.thing_item(expansion_id, 'boardgameexpansion', [base_game_id])
+
+        self.collection = Collection()
+        self.collection.parse_xml_collection({
+            'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+            'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+        })
+        self.collection.parse_xml_items((bgg_id, ET.fromstring(mock.items[bgg_id]))
+                                        for bgg_id in mock.base_game_ids + mock.expansion_ids)
+        self.player_counts = [player_count for player_count in sorted(self.collection.player_counts)
+                              if player_count <= JSONExporter.MAX_PLAYER_COUNT]
+
+    def render(self, exporter_class):
+        output = io.StringIO()
+        exporter_class(self.collection, '', 'collection' + exporter_class.EXTENSION).write(output)
+        return output.getvalue()
+
+    def test_json(self):
+        document = json.loads(self.render(JSONExporter))
+        self.assertEqual([table['player_count'] for table in document['player_counts']], self.player_counts)
+        for table in document['player_counts']:
+            for player_type in ['optimal', 'recommended']:
+                entries = self.collection.player_counts[table['player_count']][player_type]
+                self.assertEqual(sorted(row['bgg_id'] for row in table[player_type]), sorted(entries))
+                for row in table[player_type]:
+                    self.assertEqual([expansion['bgg_id'] for expansion in row['expansions']],
+                                     entries[row['bgg_id']]['expansions'])
+        self.assertEqual(sorted(game['bgg_id'] for game in document['games']), sorted(self.collection.base_games))
+        game = next(game for game in document['games'] if game['title'] == self.TITLE)
+        self.assertIn(self.EXPANSION_TITLE, [expansion['title'] for expansion in game['expansions']])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.render(CSVExporter))))
+        self.assertEqual(rows[0], CSVExporter.COLUMNS)
+
+        # A row per entry and one per expansion listed with it, then a row per base game and per linked expansion
+        counts = dict()
+        for row in rows[1:]:
+            key = (row[0], row[1])
+            counts[key] = counts.get(key, 0) + 1
+        expected_counts = dict()
+        for player_count in self.player_counts:
+            for player_type in ['optimal', 'recommended']:
+                entries = self.collection.player_counts[player_count][player_type]
+                if entries:
+                    expected_counts[(player_type, str(player_count))] = sum(1 + len(entry['expansions'])
+                                                                            for entry in entries.values())
+        expected_counts[('games', '')] = sum(1 + len(base_game.expansions)
+                                             for base_game in self.collection.base_games.values())
+        self.assertEqual(counts, expected_counts)
+        self.assertIn(self.TITLE, [row[3] for row in rows])
+        self.assertIn(self.EXPANSION_TITLE, [row[3] for row in rows])
+
+    def test_html(self):
+        document = self.render(HTMLExporter)
+        self.assertIn('<li>Cats &amp; &lt;Dogs&gt;', document)
+        self.assertIn('<li>Cats &amp; &lt;Dogs&gt;: Fish &amp; &lt;Chips&gt;</li>', document)
+        self.assertNotIn('<Dogs>', document)
+        self.assertNotIn('<Chips>', document)
+        self.assertEqual(document.count('<section id="players-'), len(self.player_counts))
+
+if __name__ == '__main__':
+    unittest.main()
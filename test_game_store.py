@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from BoardGameGeekAPI import BoardGameGeekAPI
+from GameStore import GameStore
+from MockBGGServer import MockBGGServer
+from Pipeline import Pipeline
+
+class GameStoreTest(unittest.TestCase):
+    # Incremental runs load the games they fetched before from the store, until the records are older than max_age
+    USERNAME = 'tester'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output', '')
+        self.mock = MockBGGServer(30, 15, seed=23)
+        self.url = self.mock.start()
+        self.store = GameStore(os.path.join(self.directory, 'games.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+    def run_pipeline(self):
+        # Returns the games fetched by the run and the document it rendered
+        things_served = self.mock.things_served
+        api = BoardGameGeekAPI(self.USERNAME, api_url=self.url, requests_per_second=1000)
+        try:
+            Pipeline(api, self.store, self.output_path, 'collection.tex').run()
+        finally:
+            api.close()
+        with open(self.output_path + 'collection.tex', encoding='utf-8') as tex_file:
+            return self.mock.things_served - things_served, tex_file.read()
+
+    def age_games(self, bgg_ids):
+        with self.store.connection:
+            self.store.connection.executemany('UPDATE games SET fetched_at = fetched_at - ? WHERE bgg_id = ?',
+                                              [(self.store.max_age + 1, bgg_id) for bgg_id in bgg_ids])
+
+    def test_fresh_games(self):
+        fetched, document = self.run_pipeline()
+        self.assertEqual(fetched, 45)
+        self.assertEqual(self.store.get_game_ids(fresh_only=True), set(self.mock.base_game_ids + self.mock.expansion_ids))
+        self.assertEqual(self.run_pipeline(), (0, document))
+
+    def test_stale_games(self):
+        fetched, document = self.run_pipeline()
+
+        # Only the stale games are fetched again, and stamped again once stored. The others keep their first fetch
+        stale_ids = self.mock.base_game_ids[:5] + self.mock.expansion_ids[:3]
+        self.age_games(stale_ids)
+        self.assertEqual(len(self.store.get_game_ids(fresh_only=True)), 45 - 8)
+        self.assertEqual(len(self.store.get_game_ids()), 45)
+        self.assertEqual(self.run_pipeline(), (8, document))
+        self.assertEqual(len(self.store.get_game_ids(fresh_only=True)), 45)
+
+        self.age_games(self.mock.base_game_ids + self.mock.expansion_ids)
+        self.assertEqual(self.run_pipeline(), (45, document))
+        self.assertEqual(self.run_pipeline(), (0, document))
+
+if __name__ == '__main__':
+    unittest.main()
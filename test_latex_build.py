@@ -0,0 +1,127 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from Collection import Collection
+from LatexHandler import LatexHandler
+from MockBGGServer import MockBGGServer
+
+# Stands in for pdflatex, as a TeX installation is not guaranteed: records every compiled file and writes the PDF,
+# or fails on documents containing FAIL
+STUB_COMPILER = '''#!{python}
+import os, sys
+filename = sys.argv[-1]
+name = os.path.splitext(filename)[0]
+with open({calls_filename!r}, 'a') as calls_file:
+    calls_file.write(name + '\\n')
+with open(filename, encoding='utf-8') as tex_file:
+    text = tex_file.read()
+open(name + '.log', 'w').close()
+open(name + '.aux', 'w').close()
+if 'FAIL' in text:
+    sys.exit(1)
+with open(name + '.pdf', 'w', encoding='utf-8') as pdf_file:
+    pdf_file.write(text)
+'''
+
+class BuildPdfTest(unittest.TestCase):
+    # Incremental builds with a stub compiler: only chunks whose content changed may be compiled again
+    ADDED_ID = '5000'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output', '')
+        os.makedirs(self.output_path)
+        self.calls_filename = os.path.join(self.directory, 'calls.txt')
+        self.compiler = os.path.join(self.directory, 'pdflatex')
+        with open(self.compiler, 'w', encoding='utf-8') as compiler_file:
+            compiler_file.write(STUB_COMPILER.format(python=sys.executable, calls_filename=self.calls_filename))
+        os.chmod(self.compiler, os.stat(self.compiler).st_mode | stat.S_IXUSR)
+
+        self.mock = MockBGGServer(30, 15, seed=3)
+        self.mock.server.server_close() # Only its games are used
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self):
+        # Like a new run: the collection is parsed again and the document built into the same directory
+        collection = Collection()
+        collection.parse_xml_collection({
+            'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in self.mock.base_game_ids],
+            'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in self.mock.expansion_ids],
+        })
+        collection.parse_xml_items((bgg_id, ET.fromstring(self.mock.items[bgg_id]))
+                                   for bgg_id in self.mock.base_game_ids + self.mock.expansion_ids)
+        self.collection = collection
+        if os.path.exists(self.calls_filename):
+            os.remove(self.calls_filename)
+        LatexHandler(collection, self.output_path, 'collection.tex', compiler=self.compiler, max_workers=4).build_pdf()
+        if not os.path.exists(self.calls_filename):
+            return set()
+        with open(self.calls_filename, encoding='utf-8') as calls_file:
+            return set(calls_file.read().split())
+
+    def set_game(self, bgg_id, title):
+        self.mock.titles[bgg_id] = title
+        self.mock.items[bgg_id] = self.mock.thing_item(bgg_id, 'boardgame', [])
+
+    def history_game_ids(self):
+        return LatexHandler(self.collection, self.output_path, 'collection.tex').get_history_game_ids()
+
+    def get_history_chunks(self, compiled):
+        return {chunk_name for chunk_name in compiled if chunk_name.startswith('history_')}
+
+    def test_first_build(self):
+        compiled = self.build()
+        self.assertEqual(self.get_history_chunks(compiled), {'history_' + bgg_id for bgg_id in self.history_game_ids()})
+        self.assertIn('collection', compiled)
+        self.assertTrue(os.path.exists(self.output_path + 'collection.pdf'))
+        self.assertEqual(self.build(), set())
+
+    def test_added_game(self):
+        self.build()
+
+        # Listed first by title, so every later history page moves by one position
+        self.set_game(self.ADDED_ID, 'A game added first')
+        self.mock.base_game_ids.append(self.ADDED_ID)
+        compiled = self.build()
+        self.assertEqual(self.get_history_chunks(compiled), {'history_' + self.ADDED_ID})
+        self.assertIn('collection', compiled)
+
+    def test_renamed_game(self):
+        self.build()
+
+        bgg_id = next(bgg_id for bgg_id, base_game in self.collection.base_games.items()
+                      if not base_game.expansions and bgg_id in self.history_game_ids())
+        self.mock.titles[bgg_id] = 'Renamed game'
+        self.mock.items[bgg_id] = self.mock.items[bgg_id].replace(self.collection.base_games[bgg_id].title, 'Renamed game')
+        compiled = self.build()
+        self.assertEqual(self.get_history_chunks(compiled), {'history_' + bgg_id})
+
+    def test_removed_game(self):
+        self.build()
+
+        bgg_id = self.history_game_ids()[0]
+        self.mock.base_game_ids.remove(bgg_id)
+        self.build()
+        self.assertFalse(os.path.exists(self.output_path + LatexHandler.BUILD_DIRECTORY + 'history_' + bgg_id + '.pdf'))
+
+    def test_failed_chunk(self):
+        self.build()
+
+        # The failed chunk is left out of the manifest and compiled again by the next build
+        self.set_game(self.ADDED_ID, 'A game that FAILs')
+        self.mock.base_game_ids.append(self.ADDED_ID)
+        with self.assertRaises(RuntimeError):
+            self.build()
+        self.set_game(self.ADDED_ID, 'A game that compiles')
+        compiled = self.build()
+        self.assertEqual(self.get_history_chunks(compiled), {'history_' + self.ADDED_ID})
+        self.assertIn('collection', compiled)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import copy
+import unittest
+import xml.etree.ElementTree as ET
+from Collection import Collection
+from MockBGGServer import MockBGGServer
+from PollAnalysis import np
+
+def poll_item(bgg_id, min_players, max_players, rows):
+    # A base game with the given suggested_numplayers rows: (numplayers, (best, recommended, not recommended)), or
+    # None for a row without results
+    poll = ''
+    for player_count, votes in rows:
+        poll += '<results numplayers="' + player_count + '">'
+        if votes is not None:
+            for value, numvotes in zip(['Best', 'Recommended', 'Not Recommended'], votes):
+                poll += '<result value="' + value + '" numvotes="' + str(numvotes) + '"/>'
+        poll += '</results>'
+    return ('<item type="boardgame" id="' + bgg_id + '">'
+            '<name type="primary" sortindex="1" value="Poll game ' + bgg_id + '"/>'
+            '<minplayers value="' + str(min_players) + '"/>'
+            '<maxplayers value="' + str(max_players) + '"/>'
+            '<poll name="suggested_numplayers" title="User Suggested Number of Players" totalvotes="100">'
+            + poll + '</poll>'
+            '<playingtime value="30"/>'
+            '<statistics page="1"><ratings><ranks>'
+            '<rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="Not Ranked"/>'
+            '</ranks></ratings></statistics>'
+            '</item>')
+
+def parse_collection(items, base_game_ids, expansion_ids=()):
+    collection = Collection()
+    collection.parse_xml_collection({
+        'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in base_game_ids],
+        'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in expansion_ids],
+    })
+    collection.parse_xml_items((bgg_id, ET.fromstring(items[bgg_id])) for bgg_id in list(base_game_ids) + list(expansion_ids))
+    return collection
+
+@unittest.skipIf(np is None, 'The poll analysis needs NumPy')
+class PollAnalysisTest(unittest.TestCase):
+    # Every rule against player counts worked out by hand, and plurality against the counts found while parsing
+    VOTED_ID = '1'
+    UNVOTED_ID = '2'
+
+    def setUp(self):
+        # Best 13, recommended 14 and not recommended 25 votes in the numbered rows. Row 5 has results without votes
+        self.items = {
+            self.VOTED_ID: poll_item(self.VOTED_ID, 1, 5, [('1', (2, 3, 20)), ('2', (6, 4, 2)), ('3', (4, 7, 3)),
+                                                             ('4', (1, 0, 0)), ('5', (0, 0, 0)), ('5+', (0, 1, 4))]),
+            self.UNVOTED_ID: poll_item(self.UNVOTED_ID, 2, 3, [('2', (0, 0, 0)), ('3', None)]),
+        }
+
+    def apply_rule(self, rule):
+        collection = parse_collection(self.items, [self.VOTED_ID, self.UNVOTED_ID])
+        collection.apply_player_count_rule(rule)
+        counts = dict()
+        for bgg_id, base_game in collection.base_games.items():
+            counts[bgg_id] = (base_game.optimal_player_count, base_game.recommended_player_count)
+            for player_count, entries in collection.player_counts.items():
+                self.assertEqual(bgg_id in entries['optimal'], player_count in counts[bgg_id][0])
+                self.assertEqual(bgg_id in entries['recommended'], player_count in counts[bgg_id][1])
+        return counts
+
+    def test_plurality(self):
+        # Zero votes go to best like a tie, and the row without results recommends the whole player range
+        self.assertEqual(self.apply_rule('plurality'), {self.VOTED_ID: ([2, 4, 5], [3]), self.UNVOTED_ID: ([2], [2, 3])})
+
+    def test_threshold(self):
+        # Half of the row's votes for best, or for best and recommended together
+        self.assertEqual(self.apply_rule('threshold'), {self.VOTED_ID: ([2, 4], [3]), self.UNVOTED_ID: ([], [2, 3])})
+
+    def test_majority(self):
+        # More than half, a tie like the 6 of 12 best votes for 2 players is not enough
+        self.assertEqual(self.apply_rule('majority'), {self.VOTED_ID: ([4], [2, 3]), self.UNVOTED_ID: ([], [2, 3])})
+
+    def test_bayesian(self):
+        # 10 pseudo votes shared 13:14:25 like the library's votes outweigh the single best vote for 4 players
+        self.assertEqual(self.apply_rule('bayesian'), {self.VOTED_ID: ([2], [3]), self.UNVOTED_ID: ([], [2, 3])})
+
+    def test_plurality_unchanged(self):
+        # Recomputing under the rule applied while parsing changes nothing. The mock games end their polls with an
+        # 'N+' row without results, the added ones have empty, zero vote and 'N+' rows with votes in other places
+        mock = MockBGGServer(30, 15, seed=13)
+        mock.server.server_close() # Only its games are used
+        items = dict(mock.items)
+        items['10'] = poll_item('10', 1, 4, [('1', (10, 5, 0)), ('2', (0, 0, 0)), ('3', (1, 20, 3)), ('4+', (2, 3, 40))])
+        items['11'] = poll_item('11', 2, 5, [('2', (5, 8, 1)), ('3', None), ('4', (30, 2, 2)), ('5', (0, 9, 1))])
+        items['12'] = poll_item('12', 3, 4, [('3', (0, 0, 0)), ('4', (0, 0, 0))])
+        items['13'] = poll_item('13', 1, 2, [])
+        collection = parse_collection(items, mock.base_game_ids + ['10', '11', '12', '13'], mock.expansion_ids)
+
+        games = list(collection.base_games.values()) + list(collection.expansions.values())
+        masks = [(game.optimal_player_mask, game.recommended_player_mask) for game in games]
+        player_counts = copy.deepcopy(collection.player_counts)
+        collection.apply_player_count_rule('plurality')
+        self.assertEqual([(game.optimal_player_mask, game.recommended_player_mask) for game in games], masks)
+        self.assertEqual(collection.player_counts, player_counts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+from BoardGameGeekAPI import BoardGameGeekAPI
+from MockBGGServer import MockBGGServer
+from ResponseCache import ResponseCache
+
+class ResponseCacheTest(unittest.TestCase):
+    # Fresh entries are served without a request, stale ones are revalidated against the mock server's ETags
+    USERNAME = 'tester'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mock = MockBGGServer(10, 5, seed=5)
+        self.url = self.mock.start()
+        self.api = None
+
+    def tearDown(self):
+        if self.api:
+            self.api.close()
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+    def create_api(self, ttls=ResponseCache.TTLS):
+        self.cache = ResponseCache(os.path.join(self.directory, 'cache', ''), ttls=ttls)
+        self.api = BoardGameGeekAPI(self.USERNAME, api_url=self.url, requests_per_second=1000, cache=self.cache)
+        return self.api
+
+    def count_requests(self):
+        return sum(self.mock.status_counts.values())
+
+    def count_bodies(self):
+        return len([filename for filename in os.listdir(self.cache.directory) if filename.endswith('.xml')])
+
+    def test_fresh_entries(self):
+        api = self.create_api()
+        params_base, _ = api.collection_params(self.USERNAME)
+        body = api.query_bgg('collection', params_base).content
+        requests = self.count_requests()
+
+        # Served from the cache until the TTL runs out, even when the collection changed meanwhile
+        self.mock.base_game_ids.pop()
+        hits = self.cache.hits
+        self.assertEqual(api.query_bgg('collection', params_base).content, body)
+        self.assertEqual(self.count_requests(), requests)
+        self.assertEqual(self.cache.hits, hits + 1)
+        self.assertTrue(self.cache.lookup('collection', params_base)['fresh'])
+
+    def test_revalidation(self):
+        api = self.create_api(ttls={'collection': -1}) # Stale as soon as they are stored
+        params_base, _ = api.collection_params(self.USERNAME)
+        body = api.query_bgg('collection', params_base).content
+        self.assertFalse(self.cache.lookup('collection', params_base)['fresh'])
+
+        # Unchanged: a 304 without a body, the cached body is used and not stored again
+        self.assertEqual(api.query_bgg('collection', params_base).content, body)
+        self.assertEqual(self.mock.status_counts.get(304), 1)
+        self.assertEqual(self.count_bodies(), 1)
+
+        # Changed: downloaded again and replacing the old body
+        self.mock.base_game_ids.pop()
+        changed_body = api.query_bgg('collection', params_base).content
+        self.assertNotEqual(changed_body, body)
+        self.assertEqual(self.mock.status_counts.get(304), 1)
+        self.assertEqual(self.cache.lookup('collection', params_base)['body'], changed_body)
+        self.assertEqual(self.count_bodies(), 1)
+
+    def test_shared_bodies(self):
+        cache = ResponseCache(os.path.join(self.directory, 'cache', ''))
+        self.cache = cache
+        cache.put('thing', {'id': '1'}, b'<items/>')
+        cache.put('thing', {'id': '2'}, b'<items/>')
+        self.assertEqual(self.count_bodies(), 1)
+        self.assertEqual(cache.size, len(b'<items/>'))
+
+        # The shared body stays as long as one entry refers to it
+        cache.put('thing', {'id': '1'}, b'<items></items>')
+        self.assertEqual(cache.lookup('thing', {'id': '2'})['body'], b'<items/>')
+        self.assertEqual(self.count_bodies(), 2)
+        cache.put('thing', {'id': '2'}, b'<items></items>')
+        self.assertEqual(self.count_bodies(), 1)
+        self.assertEqual(cache.size, len(b'<items></items>'))
+
+        # References are counted again from the saved index
+        cache.save()
+        cache = ResponseCache(cache.directory)
+        self.assertEqual(cache.body_references, {cache.entries[cache.key('thing', {'id': '1'})]['body']: 2})
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(os.path.join(self.directory, 'cache', ''), max_size=30)
+        self.cache = cache
+        for game_id in '123':
+            cache.put('thing', {'id': game_id}, game_id.encode('utf-8')*10)
+
+        # The least recently used entry goes first, a lookup counts as a use
+        cache.lookup('thing', {'id': '1'})
+        cache.put('thing', {'id': '4'}, b'4'*10)
+        self.assertIsNone(cache.lookup('thing', {'id': '2'}))
+        self.assertIsNotNone(cache.lookup('thing', {'id': '1'}))
+        self.assertEqual(cache.size, 30)
+        self.assertEqual(self.count_bodies(), 3)
+
+        # The order survives a reload of the index
+        cache.save()
+        cache = ResponseCache(cache.directory, max_size=30)
+        cache.put('thing', {'id': '5'}, b'5'*20)
+        self.assertEqual([cache.lookup('thing', {'id': game_id}) is not None for game_id in '1345'],
+                         [True, False, False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from Collection import Collection
+from GameStore import GameStore
+from LatexHandler import LatexHandler
+from MockBGGServer import MockBGGServer
+from Pipeline import Pipeline
+from Snapshot import Snapshot, write_snapshot
+
+class SnapshotTest(unittest.TestCase):
+    # A collection loaded from its snapshot has to render the document the parsed collection renders
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output', '')
+        os.makedirs(self.output_path)
+        self.filename = self.output_path + Snapshot.SNAPSHOT_FILENAME
+
+        mock = MockBGGServer(40, 25, seed=11)
+        mock.server.server_close() # Only its games are used
+        self.collection = Collection()
+        self.collection.parse_xml_collection({
+            'base_game_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.base_game_ids],
+            'expansion_items': [ET.Element('item', objectid=bgg_id) for bgg_id in mock.expansion_ids],
+        })
+        self.collection.parse_xml_items((bgg_id, ET.fromstring(mock.items[bgg_id]))
+                                        for bgg_id in mock.base_game_ids + mock.expansion_ids)
+        write_snapshot(self.collection, self.filename)
+        self.snapshot = None
+
+    def tearDown(self):
+        if self.snapshot:
+            self.snapshot.close()
+        shutil.rmtree(self.directory)
+
+    def render(self, collection):
+        output = io.StringIO()
+        LatexHandler(collection, self.output_path, 'collection.tex').write(output)
+        return output.getvalue()
+
+    def test_round_trip(self):
+        self.snapshot = Snapshot(self.filename)
+        collection = self.snapshot.load_collection()
+
+        # Nothing is decoded before it is looked up
+        self.assertEqual(list(collection.base_games), list(self.collection.base_games))
+        self.assertEqual(list(collection.expansions), list(self.collection.expansions))
+        self.assertEqual(sorted(collection.player_counts), sorted(self.collection.player_counts))
+        for mapping in (collection.base_games, collection.expansions, collection.player_counts):
+            self.assertEqual(mapping.loaded, dict())
+
+        self.assertEqual(self.render(collection), self.render(self.collection))
+
+    def test_truncated(self):
+        with open(self.filename, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+        for size in (0, Snapshot.HEADER.size - 1, Snapshot.HEADER.size, len(data)//2, len(data) - 1):
+            with open(self.filename, 'wb') as snapshot_file:
+                snapshot_file.write(data[:size])
+            with self.assertRaises(ValueError):
+                Snapshot(self.filename)
+
+    def test_truncated_resume(self):
+        # A resumed run falls back to the store instead of failing on the snapshot
+        with open(self.filename, 'r+b') as snapshot_file:
+            snapshot_file.truncate(os.path.getsize(self.filename)//2)
+        store = GameStore(os.path.join(self.directory, 'games.sqlite'))
+        try:
+            self.collection.save_state(store)
+            collection = Pipeline(None, store, self.output_path, 'collection.tex').load_collection()
+            self.assertEqual(self.render(collection), self.render(self.collection))
+        finally:
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()